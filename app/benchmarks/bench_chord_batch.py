@@ -0,0 +1,59 @@
+"""
+CChordRec 逐个识别与批量识别的吞吐量对比
+
+在 app 目录下运行: python -m benchmarks.bench_chord_batch [n]
+"""
+import sys
+import time
+
+import numpy as np
+
+from services.audio_service import get_chord_model
+
+SR = 22050
+DURATION = 2.0
+# C 大调六个和弦的根音、三音、五音（Hz）
+CHORDS = {
+    "c": (261.63, 329.63, 392.00),
+    "dm": (293.66, 349.23, 440.00),
+    "em": (329.63, 392.00, 493.88),
+    "f": (349.23, 440.00, 523.25),
+    "g": (392.00, 493.88, 587.33),
+    "am": (440.00, 523.25, 659.25),
+}
+
+
+def make_inputs(n):
+    t = np.arange(int(SR * DURATION)) / SR
+    rng = np.random.default_rng(0)
+    inputs = []
+    for i in range(n):
+        freqs = list(CHORDS.values())[i % len(CHORDS)]
+        y = sum(np.sin(2 * np.pi * f * t) for f in freqs) / len(freqs)
+        y = y * np.exp(-t) + 0.01 * rng.standard_normal(len(t))
+        inputs.append((y.astype(np.float32), SR))
+    return inputs
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    model = get_chord_model()
+    inputs = make_inputs(n)
+    model.predictBatch(inputs[:2])  # 预热
+
+    start = time.perf_counter()
+    single = [model.predictBatch([i])[0] for i in inputs]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = model.predictBatch(inputs)
+    batch_time = time.perf_counter() - start
+
+    same = sum(a[0] == b[0] for a, b in zip(single, batch))
+    print(f"{n} inputs: one by one {single_time:.3f}s ({n / single_time:.1f}/s), "
+          f"batched {batch_time:.3f}s ({n / batch_time:.1f}/s), speedup {single_time / batch_time:.1f}x, "
+          f"same labels {same}/{n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+CChordRec 各推理模式 (eager / script / int8) 的延迟与精度差异
+
+在 app 目录下运行: python -m benchmarks.bench_chord_optimize [repeat]
+"""
+import statistics
+import sys
+import time
+
+import torch
+
+from benchmarks.bench_chord_batch import make_inputs
+from services.audio_service import CHORD_MODEL_PATH
+from utils.audio.CChordRec import CChordRec
+
+TEST_CLIP = "utils/audio/test.wav"
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clips = [TEST_CLIP] + make_inputs(12)
+    reference = None
+    for mode in ("eager", "script", "int8"):
+        model = CChordRec(path=CHORD_MODEL_PATH, mode=mode)
+        if model.mode != mode:
+            print(f"{mode}: unavailable")
+            continue
+        tensors = [model.toInput(model.loadChroma(c)) for c in clips]
+        model.predictTensors(tensors[:1])  # 预热
+
+        latency = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model.predictTensors(tensors[:1])
+            latency.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        probs = model.predictTensors(tensors)
+        batch_time = time.perf_counter() - start
+
+        line = f"{mode}: p50 {statistics.median(latency) * 1000:.1f} ms/input, " \
+               f"batch of {len(tensors)} {batch_time * 1000:.1f} ms"
+        if reference is None:
+            reference = probs
+        else:
+            same = (probs.argmax(dim=1) == reference.argmax(dim=1)).sum().item()
+            diff = (probs - reference).abs().max().item()
+            line += f", max prob diff {diff:.4f}, same labels {same}/{len(tensors)}"
+        print(line)
+
+
+if __name__ == "__main__":
+    torch.set_grad_enabled(False)
+    main()
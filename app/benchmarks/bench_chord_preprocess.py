@@ -0,0 +1,45 @@
+"""
+CChordRec 预处理: PIL 路径与张量路径的耗时和数值对比
+
+在 app 目录下运行: python -m benchmarks.bench_chord_preprocess [repeat]
+"""
+import sys
+import time
+
+import torch
+
+from benchmarks.bench_chord_batch import CHORDS, make_inputs
+from services.audio_service import get_chord_model
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    model = get_chord_model()
+    chromas = [model.loadChroma(i) for i in make_inputs(len(CHORDS))]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        reference = [model.preprocess(model.normalize_chroma(c)) for c in chromas]
+    pil_time = (time.perf_counter() - start) / (repeat * len(chromas))
+
+    model.toInput(chromas[0])  # 预热重采样矩阵缓存
+    start = time.perf_counter()
+    for _ in range(repeat):
+        tensors = [model.preprocessTensor(c) for c in chromas]
+    tensor_time = (time.perf_counter() - start) / (repeat * len(chromas))
+
+    # uint8 量化最多带来 1/255/std 的差异
+    max_diff = max((a - b).abs().max().item() for a, b in zip(reference, tensors))
+    with torch.inference_mode():
+        pil_probs = model.predictTensors(reference)
+        tensor_probs = model.predictTensors(tensors)
+    same = (pil_probs.argmax(dim=1) == tensor_probs.argmax(dim=1)).sum().item()
+    prob_diff = (pil_probs - tensor_probs).abs().max().item()
+    print(f"PIL {pil_time * 1000:.2f} ms/input, tensor {tensor_time * 1000:.2f} ms/input, "
+          f"speedup {pil_time / tensor_time:.1f}x")
+    print(f"max input diff {max_diff:.4f}, max prob diff {prob_diff:.4f}, "
+          f"same labels {same}/{len(chromas)} ({', '.join(CHORDS)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+fastdtw 与 services.dtw 的耗时对比, 使用 13 维 MFCC 大小的序列
+
+在 app 目录下运行: python -m benchmarks.bench_dtw
+"""
+import time
+
+import numpy as np
+from fastdtw import fastdtw
+from scipy.spatial.distance import euclidean
+
+from services.dtw import dtw
+
+FRAMES = [1000, 5000, 10000]
+N_MFCC = 13
+WINDOW = 0.1  # 约束带半径占帧数的比例
+
+
+def make_mfcc(frames, rng):
+    """生成一对相似的 MFCC 序列: 随机游走, 第二条做了时间伸缩并加噪声"""
+    x = np.cumsum(rng.standard_normal((frames, N_MFCC)), axis=0)
+    stretch = np.linspace(0, frames - 1, int(frames * 1.05)) ** 1.02
+    stretch = np.clip(stretch / stretch[-1] * (frames - 1), 0, frames - 1).astype(int)
+    y = x[stretch] + 0.5 * rng.standard_normal((len(stretch), N_MFCC))
+    return x, y
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    rng = np.random.default_rng(0)
+    # 预热 numba 编译
+    dtw(rng.standard_normal((10, N_MFCC)), rng.standard_normal((12, N_MFCC)), window=2, return_path=True)
+
+    print(f"{'frames':>8} {'fastdtw(s)':>11} {'banded(s)':>10} {'speedup':>8} {'fastdtw dist':>13} {'banded dist':>12}")
+    for frames in FRAMES:
+        x, y = make_mfcc(frames, rng)
+        window = int(WINDOW * max(len(x), len(y)))
+        fast_time, (fast_dist, _) = timed(fastdtw, x, y, dist=euclidean)
+        band_time, band_dist = timed(dtw, x, y, window=window)
+        print(f"{frames:>8} {fast_time:>11.3f} {band_time:>10.3f} {fast_time / band_time:>7.1f}x "
+              f"{fast_dist:>13.1f} {band_dist:>12.1f}")
+
+        path_time, _ = timed(dtw, x, y, window=window, return_path=True)
+        abandon_time, _ = timed(dtw, x, y, window=window, max_dist=band_dist * 0.1)
+        print(f"{'':>8} with path: {path_time:.3f}s  early abandon at 10%: {abandon_time:.3f}s")
+
+    # calculate_segment_match 中每段约 44 帧
+    pairs = [(rng.standard_normal((44, 20)), rng.standard_normal((44, 20))) for _ in range(500)]
+    fast_time, _ = timed(lambda: [fastdtw(a, b, dist=euclidean) for a, b in pairs])
+    band_time, _ = timed(lambda: [dtw(a, b, window=4) for a, b in pairs])
+    print(f"500 segments of 20x44: fastdtw {fast_time:.3f}s  banded {band_time:.3f}s  "
+          f"speedup {fast_time / band_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
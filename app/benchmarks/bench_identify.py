@@ -0,0 +1,83 @@
+"""
+曲谱识别索引的建立、增量加入和查询耗时
+
+曲谱库由合成旋律组成: 前 REAL 首计算真实指纹, 其余曲谱的指纹从真实指纹中随机抽取,
+只用于扩大索引规模。查询片段取自前 REAL 首并加入白噪声。
+
+在 app 目录下运行: python -m benchmarks.bench_identify [曲谱数] [每首秒数]
+"""
+import sys
+import time
+
+import numpy as np
+
+from services.fingerprint_index import FingerprintIndex, fingerprint_audio, frames_to_seconds
+
+SR = 22050
+REAL = 20
+CLIP_SECONDS = 8
+QUERIES = 40
+
+
+def melody(seed, seconds):
+    """每 0.25 秒一个随机音符（两个八度内）, 带二次谐波和衰减"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(SR // 4) / SR
+    notes = []
+    for _ in range(int(seconds * 4)):
+        f = 220 * 2 ** (rng.integers(0, 24) / 12)
+        notes.append((np.sin(2 * np.pi * f * t) + 0.5 * np.sin(4 * np.pi * f * t)) * np.exp(-3 * t))
+    return np.concatenate(notes).astype(np.float32)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 120
+    rng = np.random.default_rng(0)
+
+    songs = [melody(i, seconds) for i in range(REAL)]
+    start = time.perf_counter()
+    sheets = {i: fingerprint_audio(y, SR) for i, y in enumerate(songs)}
+    fingerprint_time = (time.perf_counter() - start) / (REAL * seconds)
+    pool = np.concatenate(list(sheets.values()))
+    per_sheet = len(pool) // REAL
+    for i in range(REAL, n):
+        landmarks = pool[rng.integers(0, len(pool), per_sheet)].copy()
+        landmarks[:, 1] = np.sort(rng.integers(0, per_sheet, per_sheet))
+        sheets[i] = landmarks
+
+    index = FingerprintIndex()
+    start = time.perf_counter()
+    index.add({i: sheets[i] for i in range(n - QUERIES)})
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(n - QUERIES, n):
+        index.add({i: sheets[i]})
+    add_time = (time.perf_counter() - start) / QUERIES
+
+    times, correct, offset_error = [], 0, 0.0
+    for q in range(QUERIES):
+        sheet = q % REAL
+        begin = rng.integers(0, len(songs[sheet]) - CLIP_SECONDS * SR)
+        clip = songs[sheet][begin:begin + CLIP_SECONDS * SR] * 0.3
+        clip = clip + 0.1 * rng.standard_normal(len(clip)).astype(np.float32)
+        landmarks = fingerprint_audio(clip, SR)
+        start = time.perf_counter()
+        results = index.query(landmarks, top_k=5)
+        times.append(time.perf_counter() - start)
+        if results and results[0][0] == sheet:
+            correct += 1
+            offset_error = max(offset_error, abs(frames_to_seconds(results[0][2]) - begin / SR))
+
+    times = np.array(times) * 1000
+    print(f"{n} sheets x {seconds:.0f}s, {sum(len(s) for s in sheets.values())} fingerprints, "
+          f"{len(index._segments)} segments")
+    print(f"fingerprint {fingerprint_time * 1000:.2f}ms per second of audio, "
+          f"build {build_time:.2f}s, add one sheet {add_time * 1000:.1f}ms")
+    print(f"query p50 {np.percentile(times, 50):.1f}ms, p95 {np.percentile(times, 95):.1f}ms, "
+          f"correct {correct}/{QUERIES}, max offset error {offset_error * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+逐帧循环提取音高与 extract_pitch_contour 的对比测试
+
+在 app 目录下运行: python -m benchmarks.bench_pitch
+"""
+import time
+
+import librosa
+import numpy as np
+
+from services.audio_service import SAMPLE_RATE, extract_pitch_contour, pitch_contour
+
+DURATIONS = [10, 60, 300]  # 测试音频时长（秒）
+REPEAT = 3
+
+
+def make_signal(duration, sr=SAMPLE_RATE):
+    """生成带噪声的扫频信号"""
+    t = np.arange(int(duration * sr)) / sr
+    freq = 110 + 770 * (t % 4) / 4
+    y = 0.5 * np.sin(2 * np.pi * np.cumsum(freq) / sr)
+    y += 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    return y.astype(np.float32)
+
+
+def best_of(func, *args):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def pitch_loop(pitches, magnitudes):
+    # 原 extract_pitch 中的逐帧循环
+    pitch = []
+    for t in range(pitches.shape[1]):
+        index = magnitudes[:, t].argmax()
+        pitch.append(pitches[index, t])
+    return pitch
+
+
+def extract_pitch_loop(y, sr):
+    # 原 extract_pitch
+    pitches, magnitudes = librosa.core.piptrack(y=y, sr=sr)
+    return pitch_loop(pitches, magnitudes)
+
+
+def main():
+    print(f"{'duration':>8} {'frames':>8} {'loop(s)':>10} {'vector(s)':>10} {'speedup':>8} {'total old':>10} {'total new':>10}")
+    for duration in DURATIONS:
+        y = make_signal(duration)
+        pitches, magnitudes = librosa.core.piptrack(y=y, sr=SAMPLE_RATE)
+        assert np.array_equal(np.asarray(pitch_loop(pitches, magnitudes), dtype=np.float32),
+                              pitch_contour(pitches, magnitudes))
+
+        loop = best_of(pitch_loop, pitches, magnitudes)
+        vector = best_of(pitch_contour, pitches, magnitudes)
+        total_old = best_of(extract_pitch_loop, y, SAMPLE_RATE)
+        total_new = best_of(extract_pitch_contour, y, SAMPLE_RATE)
+        print(f"{duration:>7}s {pitches.shape[1]:>8} {loop:>10.4f} {vector:>10.4f} {loop / vector:>7.1f}x "
+              f"{total_old:>10.4f} {total_new:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+calculate_segment_match 两种模式的耗时与分数对比
+
+在 app 目录下运行: python -m benchmarks.bench_segment_match [file1 file2]
+"""
+import sys
+import time
+
+import numpy as np
+
+from services.audio_service import calculate_segment_match
+
+FILES = ("data/init30_1.wav", "data/init30_2.wav")
+NAMES = ("match_scores", "mfcc_scores", "pitch_scores", "beats_scores")
+
+
+def run(mode, file1, file2):
+    start = time.perf_counter()
+    scores = calculate_segment_match(file1, file2, mode=mode)
+    return time.perf_counter() - start, scores
+
+
+def main():
+    file1, file2 = sys.argv[1:3] if len(sys.argv) > 2 else FILES
+    # 预热 librosa 的 numba 编译
+    calculate_segment_match(file1, file1, mode="full")
+
+    segment_time, segment_scores = run("segment", file1, file2)
+    full_time, full_scores = run("full", file1, file2)
+
+    print(f"segment: {segment_time:.3f}s  full: {full_time:.3f}s  speedup: {segment_time / full_time:.1f}x")
+    for name, old, new in zip(NAMES, segment_scores, full_scores):
+        old, new = np.asarray(old), np.asarray(new)
+        assert len(old) == len(new), f"{name}: segment count differs"
+        diff = np.abs(old - new)
+        print(f"{name:>13}: segments={len(old)} mean|diff|={diff.mean():.6f} max|diff|={diff.max():.6f}")
+
+
+if __name__ == "__main__":
+    main()
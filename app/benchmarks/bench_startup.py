@@ -0,0 +1,47 @@
+"""
+和弦识别模型立即加载与延迟加载时, 导入 main 的耗时和内存
+
+在 app 目录下运行: python -m benchmarks.bench_startup [module]
+module 默认为 main（需要能连接数据库）, 也可以传 routers.audio
+"""
+import json
+import subprocess
+import sys
+
+REPEAT = 3
+
+# 在子进程中导入模块, eager 时随后立即加载模型, 输出耗时(秒)和峰值 RSS(MB)
+CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+if {eager}:
+    from services.audio_service import get_chord_model
+    get_chord_model()
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"time": elapsed, "rss": rss, "torch": "torch" in sys.modules}}))
+"""
+
+
+def measure(module, eager):
+    runs = []
+    for _ in range(REPEAT):
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD.format(module=module, eager=eager)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return min(run["time"] for run in runs), max(run["rss"] for run in runs), runs[0]["torch"]
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "main"
+    print(f"{'mode':>6} {'import(s)':>10} {'rss(MB)':>9} {'torch loaded':>13}")
+    for name, eager in (("lazy", False), ("eager", True)):
+        elapsed, rss, torch_loaded = measure(module, eager)
+        print(f"{name:>6} {elapsed:>10.3f} {rss:>9.1f} {str(torch_loaded):>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,12 @@ from fastapi import FastAPI, Response
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from routers import audio, ai, user, post, activity
-from database import engine, Base
+from database import engine, Base, SessionLocal
+from services.audio_pool import audio_pool
+from services.audio_jobs import job_store
+from services.audio_service import CHORD_MODEL_WARMUP, get_chord_model
+from services.audio import get_all_music
+from services.fingerprint_index import sheet_identifier
 
 Base.metadata.create_all(bind=engine)
 
@@ -23,6 +28,30 @@ app.include_router(audio.router)
 app.include_router(user.router)
 
 
+@app.on_event("startup")
+def warm_up_audio_pool():
+    # 设置 CHORD_MODEL_WARMUP=1 时, 分析进程启动后立即加载和弦识别模型; 加载失败时在首次识别和弦时再加载
+    if CHORD_MODEL_WARMUP:
+        audio_pool.warm_up(get_chord_model)
+
+
+@app.on_event("startup")
+def load_sheet_index():
+    # 读取曲谱库的指纹建立识别索引, 没有缓存的曲谱在后台计算
+    db = SessionLocal()
+    try:
+        sheets = [(sheet.id, sheet.audio_file_path) for sheet in get_all_music(db)]
+    finally:
+        db.close()
+    sheet_identifier.load_library(sheets)
+
+
+@app.on_event("shutdown")
+def shutdown_audio_pool():
+    audio_pool.shutdown()
+    job_store.shutdown()
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to EchoStrings."}
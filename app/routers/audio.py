@@ -1,10 +1,12 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, status, Depends, Form, Path
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+import asyncio
 import os
 import pathlib
 import shutil
+import uuid
+from typing import List
 from mutagen.mp3 import MP3
-import requests
 
 from sqlalchemy.orm import Session
 from models.audio import MusicSheet
@@ -13,7 +15,11 @@ from database import get_db
 from dotenv import load_dotenv
 load_dotenv()
 
-from services.audio_service import calculate_segment_match, model_recognize_chord, midi_to_audio, base64_to_midi
+from services.audio_service import model_recognize_chord, model_recognize_chords, model_recognize_chord_timeline, midi_to_audio, base64_to_midi
+from services.audio_pool import audio_pool
+from services.audio_jobs import job_store
+from services.feature_store import feature_store, extract_sheet_features, match_sheet
+from services.fingerprint_index import sheet_identifier, fingerprint_file, frames_to_seconds
 from services.upload_file import upload_file
 from services.audio import get_all_music, get_music_by_id
 from services.user import get_user_by_id
@@ -33,26 +39,21 @@ async def compare_audio(
     db: Session = Depends(get_db)
 ):
     print("start")
-    # 查找曲谱库中的文件并临时保存
+    # 查找曲谱库中的音频
     music = get_music_by_id(db, audio_id)
     print("finish find music")
     if not music:
         raise HTTPException(status_code=404, detail="音频文件不存在")
-    file1_path = os.path.join(temp_dir, f"{music.title}.mp3")
-    print("finish save music")
-    response = requests.get(music.audio_file_path)
-    print("finish get music")
-    with open(file1_path, 'wb') as f:
-        f.write(response.content)
-    print("finish save music")
     # 保存上传的文件
     file2_path = os.path.join(temp_dir, file.filename)
     with open(file2_path, 'wb') as f:
         f.write(await file.read())
     print("start match")
     try: 
-        # 计算匹配度
-        match_scores, mfcc_scores, pitch_scores, beats_scores = calculate_segment_match(file1_path, file2_path)
+        # 在分析进程中计算匹配度, 曲谱库音频的波形和特征从缓存读取, 不再下载和解码
+        match_scores, mfcc_scores, pitch_scores, beats_scores = await audio_pool.run(
+            match_sheet, music.id, music.audio_file_path, file2_path
+        )
 
         return JSONResponse({
             "status": "success",
@@ -63,12 +64,120 @@ async def compare_audio(
                 "beats_scores": beats_scores
             }
         })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        os.remove(file1_path)
         os.remove(file2_path)
 
+# 上传音频文件并逐段返回匹配度, 每行一个 JSON 对象（NDJSON）
+@router.post('/match/stream', description="上传音频文件并逐段返回与曲谱库中某个音频的匹配度(NDJSON)")
+async def stream_compare_audio(
+    audio_id: int = Form(..., description="曲谱库中的音频id"),
+    file: UploadFile = File(..., description="上传的音频文件(支持wav/mp3)"),
+    db: Session = Depends(get_db)
+):
+    music = get_music_by_id(db, audio_id)
+    if not music:
+        raise HTTPException(status_code=404, detail="音频文件不存在")
+    # 保存上传的文件, 任务结束后由分析进程删除
+    file_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}-{file.filename}")
+    with open(file_path, 'wb') as f:
+        f.write(await file.read())
+    try:
+        lines = job_store.stream_match(music.id, music.audio_file_path, file_path)
+    except Exception as e:
+        os.remove(file_path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+# 提交后台匹配任务, 立即返回任务id, 适合较长的录音
+@router.post('/match/jobs', description="上传音频文件并提交与曲谱库中某个音频的后台匹配任务")
+async def submit_compare_job(
+    audio_id: int = Form(..., description="曲谱库中的音频id"),
+    file: UploadFile = File(..., description="上传的音频文件(支持wav/mp3)"),
+    db: Session = Depends(get_db)
+):
+    music = get_music_by_id(db, audio_id)
+    if not music:
+        raise HTTPException(status_code=404, detail="音频文件不存在")
+    # 保存上传的文件, 任务结束后由分析进程删除
+    file_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}-{file.filename}")
+    with open(file_path, 'wb') as f:
+        f.write(await file.read())
+    try:
+        job = job_store.submit_match(music.id, music.audio_file_path, file_path)
+    except Exception as e:
+        os.remove(file_path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "status": "success",
+            "data": {"job_id": job.id}
+        }
+    )
+
+# 查询后台匹配任务的进度和结果
+@router.get('/match/jobs/{job_id}', description="查询后台匹配任务的进度和结果")
+async def get_compare_job(job_id: str = Path(..., description="任务id")):
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return JSONResponse({
+        "status": "success",
+        "data": job.to_dict()
+    })
+
+# 上传音频片段并识别是曲谱库中的哪一首曲谱
+@router.post('/identify', description="上传音频片段并识别是曲谱库中的哪一首曲谱, 返回得分最高的几首及片段在曲谱中的位置")
+async def identify_audio(
+    file: UploadFile = File(..., description="上传的音频文件(支持wav/mp3)"),
+    top_k: int = Form(5, ge=1, le=50, description="返回的曲谱数"),
+    db: Session = Depends(get_db)
+):
+    if not file.filename.lower().endswith(('.wav', '.mp3')):
+        raise HTTPException(status_code=400, detail="仅支持wav/mp3格式音频文件")
+    temp_path = temp_dir / f"{uuid.uuid4().hex}-{file.filename}"
+    try:
+        with open(temp_path, 'wb') as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        # 在分析进程中计算片段的指纹, 在主进程的索引中查找
+        landmarks = await audio_pool.run(fingerprint_file, str(temp_path))
+        results = await asyncio.to_thread(sheet_identifier.index.query, landmarks, top_k)
+        titles = dict(
+            db.query(MusicSheet.id, MusicSheet.title)
+            .filter(MusicSheet.id.in_([sheet_id for sheet_id, _, _ in results]))
+            .all()
+        )
+        return JSONResponse({
+            "status": "success",
+            "data": {
+                "indexed_sheets": len(sheet_identifier.index),
+                "candidates": [
+                    {
+                        "id": sheet_id,
+                        "title": titles[sheet_id],
+                        "score": score,
+                        "offset": frames_to_seconds(offset)  # 片段开头在曲谱音频中的时间（秒）
+                    }
+                    for sheet_id, score, offset in results if sheet_id in titles
+                ]
+            }
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
 # 上传音频文件并识别和弦
 @router.post("/recognize_chord", description="上传音频文件并识别和弦")
 async def recognize_chord(file: UploadFile = File(..., description="上传的音频文件(支持wav/mp3)")):
@@ -85,7 +194,7 @@ async def recognize_chord(file: UploadFile = File(..., description="上传的音
             raise HTTPException(status_code=400, detail="仅支持wav/mp3格式音频文件")
         print("recognize chord")
         # 识别和弦
-        chord =model_recognize_chord(str(temp_path))
+        chord = await audio_pool.run(model_recognize_chord, str(temp_path))
         print("extract pitch")
         temp_path.unlink()
         return JSONResponse({
@@ -96,9 +205,68 @@ async def recognize_chord(file: UploadFile = File(..., description="上传的音
     except Exception as e:
         if temp_path.exists():
             os.remove(temp_path)
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 批量上传音频文件并识别和弦
+@router.post("/recognize_chord/batch", description="批量上传音频文件并识别和弦")
+async def recognize_chords(files: List[UploadFile] = File(..., description="上传的音频文件(支持wav/mp3)")):
+    for file in files:
+        if not file.filename.lower().endswith(('.wav', '.mp3')):
+            raise HTTPException(status_code=400, detail="仅支持wav/mp3格式音频文件")
+    temp_paths = []
+    try:
+        for file in files:
+            temp_path = temp_dir / f"{uuid.uuid4().hex}-{file.filename}"
+            with open(temp_path, 'wb') as buffer:
+                shutil.copyfileobj(file.file, buffer)
+            temp_paths.append(temp_path)
+        # 识别和弦
+        results = await audio_pool.run(model_recognize_chords, [str(path) for path in temp_paths])
+        return JSONResponse({
+            "status": "success",
+            "data": [
+                {"filename": file.filename, **result} for file, result in zip(files, results)
+            ]
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        for path in temp_paths:
+            path.unlink(missing_ok=True)
+
+
+# 上传音频文件并识别和弦时间线
+@router.post("/recognize_chord/timeline", description="上传音频文件并按时间窗口识别和弦进行")
+async def recognize_chord_timeline(
+    file: UploadFile = File(..., description="上传的音频文件(支持wav/mp3)"),
+    window: float = Form(2.0, gt=0, description="识别窗口长度（秒）"),
+    hop: float = Form(0.5, gt=0, description="窗口滑动步长（秒）")
+):
+    if not file.filename.lower().endswith(('.wav', '.mp3')):
+        raise HTTPException(status_code=400, detail="仅支持wav/mp3格式音频文件")
+    temp_path = temp_dir / f"{uuid.uuid4().hex}-{file.filename}"
+    try:
+        with open(temp_path, 'wb') as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        timeline = await audio_pool.run(model_recognize_chord_timeline, str(temp_path), window, hop)
+        return JSONResponse({
+            "status": "success",
+            "data": timeline,
+            "filename": file.filename
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
 # 将上传至曲谱库
 @router.post("/sheet/upload", description="上传音频文件并保存到曲谱库")
 async def create_music(request: MusicSheetRequest, db: Session = Depends(get_db)):
@@ -117,7 +285,7 @@ async def create_music(request: MusicSheetRequest, db: Session = Depends(get_db)
         midi_path = f"{temp_dir}/{title}.mid"
         base64_to_midi(base64_date, midi_path)
         print("to midi ok")
-        audio_path = midi_to_audio(midi_path, temp_dir)
+        audio_path = await audio_pool.run(midi_to_audio, midi_path, temp_dir)
         print("to audio ok")
         duration = MP3(audio_path).info.length
         # audio_length = librosa.get_duration(path=audio_path)
@@ -140,6 +308,17 @@ async def create_music(request: MusicSheetRequest, db: Session = Depends(get_db)
         except Exception as e:
             db.rollback()
             raise HTTPException(status_code=500, detail=str(e))
+
+        # 在后台预先提取曲谱音频的特征, 失败时在匹配时再提取
+        try:
+            audio_pool.submit(extract_sheet_features, db_sheet.id, audio_path, audio_db_path)
+        except Exception as e:
+            print(f"Warning: failed to extract features for sheet {db_sheet.id}: {e}")
+        # 计算曲谱音频的指纹, 完成后加入识别索引
+        try:
+            sheet_identifier.submit(db_sheet.id, audio_db_path, audio_path)
+        except Exception as e:
+            print(f"Warning: failed to fingerprint sheet {db_sheet.id}: {e}")
         
         return JSONResponse(
             status_code=status.HTTP_201_CREATED,
@@ -149,6 +328,8 @@ async def create_music(request: MusicSheetRequest, db: Session = Depends(get_db)
             }
         )
     
+    except HTTPException:
+        raise
     except ValueError as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -234,6 +415,8 @@ async def delete_music_sheet(
             raise HTTPException(status_code=404, detail="曲谱不存在")
         db.delete(music)
         db.commit()
+        feature_store.invalidate(id)
+        sheet_identifier.remove(id)
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={
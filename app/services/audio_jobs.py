@@ -0,0 +1,236 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from services.audio_pool import audio_pool
+from services.feature_store import match_sheet, iter_match_sheet
+
+load_dotenv()
+
+AUDIO_JOB_TTL = float(os.getenv("AUDIO_JOB_TTL", 600))  # 结束后结果保留时间（秒）
+AUDIO_JOB_MAX = int(os.getenv("AUDIO_JOB_MAX", 256))  # 最多保留的任务数
+STREAM_POLL_INTERVAL = 1.0  # 逐段匹配时等待下一段结果的间隔（秒）, 每次等待后检查任务是否已结束
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.state = PENDING
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "state": self.state,
+            "progress": {"done": self.done, "total": self.total},
+        }
+        if self.state == DONE:
+            match_scores, mfcc_scores, pitch_scores, beats_scores = self.result
+            data["result"] = {
+                "match_scores": match_scores,
+                "mfcc_scores": mfcc_scores,
+                "pitch_scores": pitch_scores,
+                "beats_scores": beats_scores
+            }
+        if self.state == FAILED:
+            data["error"] = self.error
+        return data
+
+
+def _run_match_job(job_id, progress, sheet_id, source, file_path):
+    """在分析进程中执行匹配任务, 每段完成后把进度写入共享的 progress 字典"""
+    def report(done, total):
+        progress[job_id] = (done, total)
+
+    return match_sheet(sheet_id, source, file_path, on_segment=report)
+
+
+def _run_stream_match(segments, cancel, sheet_id, source, file_path):
+    """在分析进程中逐段计算匹配度, 每段结果放入共享队列, 以 None 结束; cancel 被设置后不再计算后面的段"""
+    try:
+        for segment in iter_match_sheet(sheet_id, source, file_path):
+            if cancel.is_set():
+                break
+            segments.put(segment)
+    except Exception as e:
+        segments.put({"error": str(e)})
+    finally:
+        segments.put(None)
+
+
+def _remove_when_done(future, file_path):
+    """任务结束（包括超时、未开始就被取消）后删除上传的文件"""
+    def remove(f):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    future.add_done_callback(remove)
+
+
+class JobStore:
+    """
+    后台匹配任务及其结果, 保存在当前进程内存中。
+    任务结束 ttl 秒后删除, 总数超过 max_jobs 时先删除最早结束的任务;
+    max_jobs 个任务都未结束时拒绝新任务。
+    """
+
+    def __init__(self, ttl: float, max_jobs: int):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._manager = None
+        self._progress = None
+
+    def _get_manager(self):
+        # 分析进程通过 Manager 的字典和队列汇报进度, 首次提交任务时才启动 Manager 进程
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+            self._progress = self._manager.dict()
+        return self._manager
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _make_room(self) -> bool:
+        """任务数达到 max_jobs 时删除最早结束的任务, 没有可删除的任务时返回 False"""
+        self._evict()
+        if len(self._jobs) < self.max_jobs:
+            return True
+        # 未结束的任务仍在使用分析进程, 客户端还会查询, 不能删除
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished_at is not None),
+            key=lambda job: job.finished_at
+        )
+        for job in finished[:len(self._jobs) - self.max_jobs + 1]:
+            del self._jobs[job.id]
+        return len(self._jobs) < self.max_jobs
+
+    def _finish(self, job: Job, future):
+        if future.cancelled():
+            job.error = "任务已取消"
+            job.state = FAILED
+        elif future.exception() is not None:
+            job.error = str(future.exception())
+            job.state = FAILED
+        else:
+            job.result = future.result()
+            job.state = DONE
+            job.done = job.total = len(job.result[0])
+        job.finished_at = time.monotonic()
+        try:
+            self._progress.pop(job.id, None)
+        except Exception:
+            pass  # Manager 已关闭
+
+    def submit_match(self, sheet_id: int, source: str, file_path: str) -> Job:
+        """
+        提交匹配任务, 任务结束后删除 file_path; 进程池已满或未结束的任务达到 max_jobs 时抛出 503。
+        任务超时（audio_pool.timeout）时以 "音频分析超时" 失败。
+        """
+        self._get_manager()
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            if not self._make_room():
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="后台匹配任务过多, 请稍后重试"
+                )
+            self._jobs[job.id] = job
+        try:
+            future = audio_pool.submit(_run_match_job, job.id, self._progress, sheet_id, source, file_path)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        _remove_when_done(future, file_path)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job
+
+    def get(self, job_id: str):
+        """查询任务, 不存在或已过期时返回 None"""
+        with self._lock:
+            self._evict()
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.finished_at is None:
+            reported = self._progress.get(job.id)
+            if reported is not None and job.finished_at is None:
+                job.state = RUNNING
+                job.done, job.total = reported
+        return job
+
+    def stream_match(self, sheet_id: int, source: str, file_path: str):
+        """
+        提交逐段匹配任务, 返回按行输出 JSON 的异步生成器, 每行是一段的结果。
+        任务结束后删除 file_path; 进程池已满时抛出 503。
+        生成器结束或被关闭（客户端断开连接）时通知分析进程停止计算后面的段。
+        """
+        # 先检查名额, 进程池已满时不创建用不到的共享队列
+        audio_pool.check_capacity()
+        manager = self._get_manager()
+        segments = manager.Queue()
+        cancel = manager.Event()
+        future = audio_pool.submit(_run_stream_match, segments, cancel, sheet_id, source, file_path)
+        _remove_when_done(future, file_path)
+
+        async def lines():
+            try:
+                while True:
+                    try:
+                        segment = await asyncio.to_thread(segments.get, timeout=STREAM_POLL_INTERVAL)
+                    except queue.Empty:
+                        if not future.done():
+                            continue
+                        # 任务卡住被回收或未开始就被取消, 没有写入结束标记
+                        if future.cancelled():
+                            segment = {"error": "任务已取消"}
+                        elif future.exception() is not None:
+                            segment = {"error": str(future.exception())}
+                        else:
+                            break
+                    if segment is None:
+                        break
+                    yield json.dumps(segment, ensure_ascii=False) + "\n"
+                    if "error" in segment:
+                        break
+            finally:
+                cancel.set()
+
+        return lines()
+
+    def shutdown(self) -> None:
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+job_store = JobStore(AUDIO_JOB_TTL, AUDIO_JOB_MAX)
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", os.cpu_count() or 1))  # 分析进程数
+AUDIO_QUEUE_DEPTH = int(os.getenv("AUDIO_QUEUE_DEPTH", 16))  # 等待中的任务上限
+AUDIO_JOB_TIMEOUT = float(os.getenv("AUDIO_JOB_TIMEOUT", 300))  # 单个任务超时（秒）
+AUDIO_JOB_GRACE = float(os.getenv("AUDIO_JOB_GRACE", 10))  # 超时后等待任务中断的时间, 之后终止分析进程（秒）
+
+
+def _timed_out(signum, frame):
+    raise TimeoutError("音频分析超时")
+
+
+def _initialize(initializer):
+    """分析进程的初始化函数; 失败时只打印警告, 不影响进程池中的其他任务"""
+    try:
+        initializer()
+    except Exception as e:
+        print(f"Warning: audio worker initializer {initializer.__name__} failed: {e}")
+
+
+def _run_until(deadline, func, args, kwargs):
+    """在分析进程中执行 func, 到达 deadline（time.time()）时以 TimeoutError 中断"""
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise TimeoutError("音频分析超时")
+    previous = signal.signal(signal.SIGALRM, _timed_out)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _settle(future, task=None, exception=None):
+    """以 task 的结果（或 exception）完成 future, future 已完成或已取消时忽略"""
+    try:
+        if task is None:
+            future.set_exception(exception)
+        elif task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+    except InvalidStateError:
+        pass
+
+
+class AudioPool:
+    """
+    音频分析进程池。
+    CPU 密集的分析任务在独立进程中执行, 不阻塞事件循环;
+    正在执行和排队的任务总数超过上限时直接返回 503。
+    """
+
+    def __init__(self, workers: int, queue_depth: int, timeout: float, grace: float):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.grace = grace
+        self.initializer = None  # 每个分析进程启动时执行
+        self._executor = None
+        self._pending = 0
+        self._futures = {}  # 尚未结束的任务 -> 执行它的进程池
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            if self.initializer is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_initialize,
+                                                     initargs=(self.initializer,))
+        return self._executor
+
+    def _release(self, future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._futures.pop(future, None)
+
+    def _replace(self, executor) -> None:
+        """进程池有进程异常退出时关闭它, 下次提交任务时重建"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _check_capacity(self) -> None:
+        if self._pending >= self.workers + self.queue_depth:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="音频分析任务繁忙, 请稍后重试"
+            )
+
+    def check_capacity(self) -> None:
+        """正在执行和排队的任务已达上限时抛出 503; 提交前需要先创建其他资源时使用"""
+        with self._lock:
+            self._check_capacity()
+
+    def submit(self, func, *args, timeout: float | None = None, **kwargs) -> Future:
+        """
+        提交任务, 返回 concurrent.futures.Future; 队列已满时抛出 503。
+        任务从提交起 timeout 秒（默认 self.timeout）后在分析进程中以 TimeoutError 中断;
+        再过 grace 秒仍未结束（卡在无法被信号中断的调用中）时回收进程池, Future 同样以 TimeoutError 结束。
+        """
+        timeout = timeout or self.timeout
+        with self._lock:
+            self._check_capacity()
+            self._pending += 1
+        deadline = time.time() + timeout
+        try:
+            executor = self._get_executor()
+            try:
+                task = executor.submit(_run_until, deadline, func, args, kwargs)
+            except BrokenProcessPool:
+                # 有进程异常退出时重建进程池
+                self._replace(executor)
+                executor = self._get_executor()
+                task = executor.submit(_run_until, deadline, func, args, kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        with self._lock:
+            self._futures[task] = executor
+
+        # 返回给调用方的 Future 在任务结束或卡住超时时完成; 任务真正结束时才释放名额
+        future = Future()
+        watchdog = threading.Timer(timeout + self.grace, self._expire, (task, future))
+        watchdog.daemon = True
+
+        def settle(task):
+            watchdog.cancel()
+            self._release(task)
+            if not task.cancelled() and isinstance(task.exception(), BrokenProcessPool):
+                self._replace(executor)
+            _settle(future, task)
+
+        future.add_done_callback(lambda f: f.cancelled() and task.cancel())
+        task.add_done_callback(settle)
+        watchdog.start()
+        return future
+
+    def _expire(self, task, future) -> None:
+        """任务超过 timeout + grace 仍未结束时执行"""
+        if task.done():
+            return
+        _settle(future, exception=TimeoutError("音频分析超时"))
+        if not task.cancel():
+            self._recycle(task)
+
+    async def run(self, func, *args, timeout: float | None = None, **kwargs):
+        """
+        在进程池中执行 func 并等待结果, 超时返回 504。
+        超时的任务在分析进程中被中断, 不会继续占用进程和名额;
+        除任务卡住、进程池被回收的情况外, run 返回或抛出异常时任务已经结束, 调用方可以删除任务使用的文件。
+        """
+        future = self.submit(func, *args, timeout=timeout, **kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="音频分析超时"
+            )
+        except BrokenProcessPool:
+            raise RuntimeError("音频分析进程异常退出")
+
+    def warm_up(self, initializer) -> None:
+        """设置进程初始化函数并立即启动分析进程; 初始化失败时进程照常执行任务"""
+        self.shutdown()
+        self.initializer = initializer
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(os.getpid)
+
+    def _recycle(self, hung) -> None:
+        """
+        任务 hung 卡住无法中断时, 之后的任务提交到新的进程池;
+        旧进程池中的其他任务照常执行完毕后, 再终止旧进程池的进程（包括卡住的进程）。
+        """
+        with self._lock:
+            executor = self._futures.get(hung)
+            if executor is None:
+                return
+            if self._executor is executor:
+                self._executor = None
+
+        def reap():
+            while True:
+                with self._lock:
+                    others = [future for future, owner in self._futures.items()
+                              if owner is executor and future is not hung]
+                if not others:
+                    break
+                wait(others)
+            # ProcessPoolExecutor 没有公开终止进程的接口
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        threading.Thread(target=reap, name="audio-pool-reaper", daemon=True).start()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+audio_pool = AudioPool(AUDIO_WORKERS, AUDIO_QUEUE_DEPTH, AUDIO_JOB_TIMEOUT, AUDIO_JOB_GRACE)
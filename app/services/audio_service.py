@@ -9,22 +9,72 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from fastdtw import fastdtw
 import subprocess
+import threading
 import base64
+from dataclasses import dataclass
 from midi2audio import FluidSynth
 from pydub import AudioSegment
-from utils.audio.CChordRec import CChordRec
+from services.dtw import dtw as banded_dtw
+from services.decode_cache import load_audio
 
 SOUND_FONT = "utils/soundfonts/GeneralUser-GS.sf2"
-model = CChordRec(path="utils/audio/model.pth")
+CHORD_MODEL_PATH = "utils/audio/model.pth"
+CHORD_MODEL_MODE = os.getenv("CHORD_MODEL_MODE", "eager")  # eager、script 或 int8, 见 CChordRec.optimize
+CHORD_MODEL_WARMUP = os.getenv("CHORD_MODEL_WARMUP", "0") == "1"  # 启动时预先加载和弦识别模型
+SAMPLE_RATE = 22050  # librosa.load 默认采样率
+HOP_LENGTH = 512  # librosa 特征提取默认帧移
+DTW_BACKEND = os.getenv("DTW_BACKEND", "fastdtw")  # fastdtw 或 banded
+DTW_WINDOW = float(os.getenv("DTW_WINDOW", 0.1))  # banded 后端约束带半径占较长序列帧数的比例, <=0 表示不约束
+MATCH_FEATURE_MODE = os.getenv("MATCH_FEATURE_MODE", "segment")  # /audio/match 的特征提取方式, segment 或 full, 见 calculate_segment_match
 
-# 提取音高
-def extract_pitch(y, sr):
+# 和弦识别模型在首次使用时加载, 只处理 /post、/user 等请求的进程不会导入 torch
+_chord_model = None
+_chord_model_lock = threading.Lock()
+
+
+@dataclass
+class AudioFeatures:
+    """整段音频的解码波形及特征, 只用于逐段提取特征时 mfcc、pitch、beats 为 None"""
+    y: np.ndarray  # 波形 (SAMPLE_RATE)
+    mfcc: np.ndarray | None = None  # MFCC 矩阵 (n_mfcc, frames)
+    pitch: np.ndarray | None = None  # 音高曲线 (frames,)
+    beats: np.ndarray | None = None  # 节拍所在帧
+    sr: int = SAMPLE_RATE
+
+
+@dataclass
+class SegmentFeatures:
+    """
+    整段音频按 segment_length 分段后各段的特征, 与逐段调用 _segment_features 的结果相同。
+    各段的 MFCC 和音高沿帧拼接, 第 k 段为 frame_offsets[k]:frame_offsets[k + 1] 帧;
+    节拍同样拼接, 第 k 段为 beats[beat_offsets[k]:beat_offsets[k + 1]]。
+    """
+    mfcc: np.ndarray  # (n_mfcc, 各段帧数之和)
+    pitch: np.ndarray  # (各段帧数之和,)
+    frame_offsets: np.ndarray  # (段数 + 1,)
+    beats: np.ndarray  # (各段节拍数之和,)
+    beat_offsets: np.ndarray  # (段数 + 1,)
+    samples: int  # 整段音频的采样数
+    segment_length: float
+    mode: str
+    sr: int = SAMPLE_RATE
+
+    def segment(self, index):
+        """第 index 段的 (mfcc, pitch, beats)"""
+        first, last = self.frame_offsets[index], self.frame_offsets[index + 1]
+        beats = self.beats[self.beat_offsets[index]:self.beat_offsets[index + 1]]
+        return self.mfcc[:, first:last], self.pitch[first:last], beats
+
+# 从 piptrack 的输出中一次性取出每帧幅度最大处的音高
+def pitch_contour(pitches, magnitudes) -> np.ndarray:
+    index = magnitudes.argmax(axis=0)
+    pitch = np.take_along_axis(pitches, index[np.newaxis, :], axis=0)[0]
+    return np.ascontiguousarray(pitch, dtype=np.float32)
+
+# 提取音高曲线（向量化版本）
+def extract_pitch_contour(y, sr) -> np.ndarray:
     pitches, magnitudes = librosa.core.piptrack(y=y, sr=sr)
-    pitch = []
-    for t in range(pitches.shape[1]):
-        index = magnitudes[:, t].argmax() # 找到最大值的索引
-        pitch.append(pitches[index, t]) # 最大值的音高
-    return pitch
+    return pitch_contour(pitches, magnitudes)
 
 # 提取节拍
 def extract_beats(y, sr):
@@ -32,11 +82,111 @@ def extract_beats(y, sr):
     tempo, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
     return beats
 
+# 提取整段音频的特征
+def extract_features(y, sr=SAMPLE_RATE) -> AudioFeatures:
+    mfcc = librosa.feature.mfcc(y=y, sr=sr)
+    pitch = extract_pitch_contour(y, sr)
+    beats = extract_beats(y, sr)
+    return AudioFeatures(y=y, mfcc=mfcc, pitch=pitch, beats=beats, sr=sr)
+
+def _check_mode(mode):
+    if mode not in ("segment", "full"):
+        raise ValueError(f"Unknown match mode: {mode}")
+
+# 加载音频并提取特征, mode="segment" 时只解码波形, 特征在分段时再提取
+def load_features(file_path, mode="full") -> AudioFeatures:
+    _check_mode(mode)
+    y, sr = load_audio(file_path, sr=SAMPLE_RATE)
+    if mode == "segment":
+        return AudioFeatures(y=y, sr=sr)
+    return extract_features(y, sr)
+
+# 从第 start 个采样开始、长 frame_length 个采样的一段的特征
+# mode="segment": 对该段波形单独提取
+# mode="full": 按分段边界从整段特征中截取, MFCC 和音高的帧数与对该段单独提取时一致,
+# 节拍取落在该段内的整段节拍, 帧号换算为相对该段起点
+def _segment_features(features: AudioFeatures, start, frame_length, mode):
+    if mode == "segment":
+        segment = features.y[start:start + frame_length]
+        mfcc = librosa.feature.mfcc(y=segment, sr=features.sr)
+        pitch = extract_pitch_contour(segment, features.sr)
+        beats = extract_beats(segment, features.sr)
+    else:
+        n_frames = 1 + frame_length // HOP_LENGTH
+        first = int(round(start / HOP_LENGTH))
+        mfcc = features.mfcc[:, first:first + n_frames]
+        pitch = features.pitch[first:first + n_frames]
+        beats = features.beats[(features.beats >= first) & (features.beats < first + n_frames)] - first
+    return mfcc, pitch, beats
+
+# 提取整段音频每一段的特征, 分段边界与 iter_match_features 相同;
+# 曲谱库音频的分段特征只与音频本身和 segment_length 有关, 由 feature_store 预先提取
+def extract_segment_features(features: AudioFeatures, segment_length=1.0, mode=MATCH_FEATURE_MODE) -> SegmentFeatures:
+    _check_mode(mode)
+    frame_length = int(segment_length * features.sr)
+    segments = [
+        _segment_features(features, start, frame_length, mode)
+        for start in range(0, len(features.y) - frame_length, frame_length)
+    ]
+    frame_counts = [len(pitch) for _, pitch, _ in segments]
+    beat_counts = [len(beats) for _, _, beats in segments]
+    if segments:
+        mfcc = np.concatenate([mfcc for mfcc, _, _ in segments], axis=1)
+        pitch = np.concatenate([pitch for _, pitch, _ in segments])
+        beats = np.concatenate([beats for _, _, beats in segments])
+    else:
+        mfcc = np.zeros((20, 0), dtype=np.float32)  # librosa.feature.mfcc 默认 n_mfcc=20
+        pitch = np.zeros(0, dtype=np.float32)
+        beats = np.zeros(0, dtype=np.int64)
+    return SegmentFeatures(
+        mfcc=mfcc,
+        pitch=pitch,
+        frame_offsets=np.concatenate([[0], np.cumsum(frame_counts)]).astype(np.int64),
+        beats=beats,
+        beat_offsets=np.concatenate([[0], np.cumsum(beat_counts)]).astype(np.int64),
+        samples=len(features.y),
+        segment_length=segment_length,
+        mode=mode,
+        sr=features.sr
+    )
+
+# 返回 (采样数, read), read(index, start) 为第 index 段（从第 start 个采样开始）的特征;
+# SegmentFeatures 直接读取预先提取的分段特征, AudioFeatures 在读取时提取
+def _segment_reader(features, segment_length, frame_length, mode):
+    if isinstance(features, SegmentFeatures):
+        if features.segment_length != segment_length or features.mode != mode:
+            raise ValueError(f"Segment features were extracted with segment_length={features.segment_length}, "
+                             f"mode={features.mode}")
+        return features.samples, lambda index, start: features.segment(index)
+    return len(features.y), lambda index, start: _segment_features(features, start, frame_length, mode)
+
+def _dtw_window(n, m):
+    if DTW_WINDOW <= 0:
+        return None
+    return max(1, int(DTW_WINDOW * max(n, m)))
+
+# MFCC 序列的 DTW 距离
+def mfcc_distance(mfcc1, mfcc2, backend=DTW_BACKEND):
+    if backend == "banded":
+        return banded_dtw(mfcc1.T, mfcc2.T, window=_dtw_window(mfcc1.shape[1], mfcc2.shape[1]))
+    if backend != "fastdtw":
+        raise ValueError(f"Unknown DTW backend: {backend}")
+    distance, path = fastdtw(mfcc1.T, mfcc2.T, dist=euclidean)
+    return distance
+
+# 音高、节拍等一维序列的 DTW 距离
+def series_distance(series1, series2, backend=DTW_BACKEND):
+    if backend == "banded":
+        return banded_dtw(series1, series2, window=_dtw_window(len(series1), len(series2)), metric="sqeuclidean")
+    if backend != "fastdtw":
+        raise ValueError(f"Unknown DTW backend: {backend}")
+    return dtw.distance(series1, series2)
+
 # 计算音频匹配度
-def calculate_match(file_path1, file_path2):
+def calculate_match(file_path1, file_path2, dtw_backend=DTW_BACKEND):
     # 加载音频文件
-    y1, sr1 = librosa.load(file_path1)
-    y2, sr2 = librosa.load(file_path2)
+    y1, sr1 = load_audio(file_path1, sr=SAMPLE_RATE)
+    y2, sr2 = load_audio(file_path2, sr=SAMPLE_RATE)
     # y: 音频时间序列
     # sr: 音频的采样率
 
@@ -45,22 +195,22 @@ def calculate_match(file_path1, file_path2):
     mfcc2 = librosa.feature.mfcc(y=y2, sr=sr2)
 
     # 使用DTW对齐MFCC特征
-    distance, path = fastdtw(mfcc1.T, mfcc2.T, dist=euclidean)
+    distance = mfcc_distance(mfcc1, mfcc2, dtw_backend)
     mfcc_match = 1 / (1 + distance)  # 将距离转换为相似度
 
     # 提取音高
-    pitch1 = extract_pitch(y1, sr1)
-    pitch2 = extract_pitch(y2, sr2)
+    pitch1 = extract_pitch_contour(y1, sr1)
+    pitch2 = extract_pitch_contour(y2, sr2)
 
     # 提取节拍
     beats1 = extract_beats(y1, sr1)
     beats2 = extract_beats(y2, sr2)
 
     # 计算音高的匹配度
-    distance = dtw.distance(pitch1, pitch2)
+    distance = series_distance(pitch1, pitch2, dtw_backend)
     pitch_match = 1 / (1 + distance)
     # 计算节奏的匹配度
-    distance = dtw.distance(beats1, beats2)
+    distance = series_distance(beats1, beats2, dtw_backend)
     beats_match = 1 / (1 + distance)
 
     # 加权计算音频匹配度
@@ -68,49 +218,47 @@ def calculate_match(file_path1, file_path2):
     return match_score, mfcc_match, pitch_match, beats_match
 
 # 计算音频匹配度（分段）
-def calculate_segment_match(file_path1, file_path2, segment_length=1.0):
-    # 加载音频文件
-    y1, sr1 = librosa.load(file_path1)
-    y2, sr2 = librosa.load(file_path2)
+# mode="segment": 对每一段单独提取特征
+# mode="full": 对整段音频只提取一次 MFCC、音高和节拍, 再按分段边界截取; 分段边缘的帧略有不同,
+# MFCC 和音高的匹配度与 segment 模式相差约 1e-4; 整段跟踪的节拍有前后文, 与逐段跟踪的结果不同,
+# 节拍匹配度相差较大, 见 benchmarks/bench_segment_match.py
+def calculate_segment_match(file_path1, file_path2, segment_length=1.0, mode="segment", dtw_backend=DTW_BACKEND):
+    return match_features(load_features(file_path1, mode), load_features(file_path2, mode), segment_length,
+                          dtw_backend=dtw_backend, mode=mode)
+
+# 逐段计算匹配度, 每算完一段就产出该段的结果; mode 的含义同 calculate_segment_match,
+# mode="full" 时 features1、features2 须为 load_features(..., mode="full") 提取的整段特征;
+# features1、features2 也可以是以相同 segment_length 和 mode 预先提取的 SegmentFeatures
+def iter_match_features(features1: AudioFeatures | SegmentFeatures, features2: AudioFeatures | SegmentFeatures,
+                        segment_length=1.0, dtw_backend=DTW_BACKEND, mode=MATCH_FEATURE_MODE):
+    _check_mode(mode)
+    sr = features1.sr
+    frame_length = int(segment_length * sr)
+    samples1, read1 = _segment_reader(features1, segment_length, frame_length, mode)
+    samples2, read2 = _segment_reader(features2, segment_length, frame_length, mode)
 
     # 检查音频长度
-    audio_length1 = len(y1) / sr1
-    audio_length2 = len(y2) / sr2
+    audio_length1 = samples1 / sr
+    audio_length2 = samples2 / sr
     print(f"Audio 1 length: {audio_length1:.2f} seconds")
     print(f"Audio 2 length: {audio_length2:.2f} seconds")
 
     if audio_length1 < segment_length or audio_length2 < segment_length:
         raise ValueError("Audio length is shorter than segment length. Please use shorter segment_length.")
 
-    # 计算每段的帧数
-    frame_length = int(segment_length * sr1)
-    match_scores = []
-    mfcc_scores = []
-    pitch_scores = []
-    beats_scores = []
+    # 分段边界与 calculate_segment_match 相同
+    segments = range(0, min(samples1, samples2) - frame_length, frame_length)
+    for index, i in enumerate(segments):
+        mfcc1, pitch1, beats1 = read1(index, i)
+        mfcc2, pitch2, beats2 = read2(index, i)
 
-    # 分段计算匹配度
-    for i in range(0, min(len(y1), len(y2)) - frame_length, frame_length):
-        segment1 = y1[i:i + frame_length]
-        segment2 = y2[i:i + frame_length]
-
-        # 提取特征
-        mfcc1 = librosa.feature.mfcc(y=segment1, sr=sr1)
-        mfcc2 = librosa.feature.mfcc(y=segment2, sr=sr2)
-        pitch1 = extract_pitch(segment1, sr1)
-        pitch2 = extract_pitch(segment2, sr2)
-        beats1 = extract_beats(segment1, sr1)
-        beats2 = extract_beats(segment2, sr2)
-
-        # 计算匹配度
-        distance, path = fastdtw(mfcc1.T, mfcc2.T, dist=euclidean)
-        mfcc_match = 1 / (1 + distance)  # 将距离转换为相似度
-        distance = dtw.distance(pitch1, pitch2)
+        distance = mfcc_distance(mfcc1, mfcc2, dtw_backend)
+        mfcc_match = 1 / (1 + distance)
+        distance = series_distance(pitch1, pitch2, dtw_backend)
         pitch_match = 1 / (1 + distance)
-        distance = dtw.distance(beats1, beats2)
+        distance = series_distance(beats1, beats2, dtw_backend)
         beats_match = 1 / (1 + distance)
 
-            # 检查匹配度是否为 NaN 或 Inf
         if np.isnan(mfcc_match) or np.isinf(mfcc_match):
             print(f"Warning: MFCC match is NaN or Inf at segment {i}")
         if np.isnan(pitch_match) or np.isinf(pitch_match):
@@ -118,23 +266,78 @@ def calculate_segment_match(file_path1, file_path2, segment_length=1.0):
         if np.isnan(beats_match) or np.isinf(beats_match):
             print(f"Warning: Beats match is NaN or Inf at segment {i}")
 
-        # 加权计算整体匹配度
         match_score = 0.4 * mfcc_match + 0.3 * pitch_match + 0.3 * beats_match
-        match_scores.append(match_score)  # 整体匹配度
-        mfcc_scores.append(mfcc_match)  # MFCC匹配度
-        pitch_scores.append(pitch_match) # 音高匹配度
-        beats_scores.append(beats_match)  # 节拍匹配度
+        yield {
+            "segment": index,
+            "total": len(segments),
+            "start": i / sr,  # 分段起始时间（秒）
+            "match_score": float(match_score),
+            "mfcc": float(mfcc_match),
+            "pitch": float(pitch_match),
+            "beats": float(beats_match)
+        }
+
+# 计算匹配度（分段）
+# on_segment(done, total) 在每段计算完成后调用, 用于汇报进度
+def match_features(features1: AudioFeatures | SegmentFeatures, features2: AudioFeatures | SegmentFeatures,
+                   segment_length=1.0, on_segment=None,
+                   dtw_backend=DTW_BACKEND, mode=MATCH_FEATURE_MODE):
+    match_scores = []
+    mfcc_scores = []
+    pitch_scores = []
+    beats_scores = []
+
+    for segment in iter_match_features(features1, features2, segment_length, dtw_backend, mode):
+        match_scores.append(segment["match_score"])
+        mfcc_scores.append(segment["mfcc"])
+        pitch_scores.append(segment["pitch"])
+        beats_scores.append(segment["beats"])
+        if on_segment is not None:
+            on_segment(segment["segment"] + 1, segment["total"])
 
     return match_scores, mfcc_scores, pitch_scores, beats_scores
 
+# 计算与曲谱库音频的匹配度（分段）, 曲谱库一侧使用预先提取的分段特征, 只对上传的音频提取特征
+def calculate_reference_match(reference: SegmentFeatures, file_path, segment_length=1.0, on_segment=None,
+                              dtw_backend=DTW_BACKEND, mode=MATCH_FEATURE_MODE):
+    return match_features(reference, load_features(file_path, mode), segment_length, on_segment, dtw_backend, mode)
+
+# 逐段计算与曲谱库音频的匹配度
+def iter_reference_match(reference: SegmentFeatures, file_path, segment_length=1.0, dtw_backend=DTW_BACKEND,
+                         mode=MATCH_FEATURE_MODE):
+    return iter_match_features(reference, load_features(file_path, mode), segment_length, dtw_backend, mode)
+
+# 获取和弦识别模型, 首次调用时加载
+def get_chord_model():
+    global _chord_model
+    if _chord_model is None:
+        with _chord_model_lock:
+            if _chord_model is None:
+                from utils.audio.CChordRec import CChordRec
+                _chord_model = CChordRec(path=CHORD_MODEL_PATH, mode=CHORD_MODEL_MODE, loader=load_audio)
+    return _chord_model
+
 # 识别和弦
 def model_recognize_chord(audio_path: str) -> str:
     try:
-        result = model.predictChord(audio_path)
+        result = get_chord_model().predictChord(audio_path)
         return result
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"Failed to recognize chord: {e.stderr}")
 
+# 批量识别和弦, 所有文件一次前向计算
+def model_recognize_chords(audio_paths: list[str]) -> list[dict]:
+    results = get_chord_model().predictBatch(audio_paths)
+    return [{"chord": chord, "probs": probs} for chord, probs in results]
+
+# 和弦时间线, 相邻窗口的相同和弦合并为一段
+def model_recognize_chord_timeline(audio_path: str, window: float = 2.0, hop: float = 0.5) -> list[dict]:
+    timeline = get_chord_model().predictTimeline(audio_path, window=window, hop=hop)
+    return [
+        {"start": start, "end": end, "chord": chord, "confidence": confidence}
+        for start, end, chord, confidence in timeline
+    ]
+
 # ----------------------------------------------
 # 上传曲谱库
 
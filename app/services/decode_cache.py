@@ -0,0 +1,117 @@
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import librosa
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DECODE_CACHE_DIR = pathlib.Path(os.getenv("DECODE_CACHE_DIR", "Temp/decode_cache"))
+DECODE_CACHE_DISK_BYTES = int(os.getenv("DECODE_CACHE_DISK_BYTES", 2 * 1024 ** 3))  # 磁盘缓存上限
+DECODE_CACHE_MEMORY_BYTES = int(os.getenv("DECODE_CACHE_MEMORY_BYTES", 256 * 1024 ** 2))  # 每个进程内存缓存上限
+
+
+def file_digest(path) -> str:
+    """文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DecodeCache:
+    """
+    上传音频的解码缓存, 以文件内容的 SHA-256 和目标采样率为键。
+    解码后的 float32 波形以 .npy 格式保存, 文件名为 {sha256}-{目标采样率}-{实际采样率}.npy,
+    读取时内存映射; 磁盘和进程内存中的缓存都按最近使用淘汰。
+    """
+
+    def __init__(self, root: pathlib.Path, disk_bytes: int, memory_bytes: int):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.disk_bytes = disk_bytes
+        self.memory_bytes = memory_bytes
+        self._entries = OrderedDict()  # (sha256, sr) -> (y, sr)
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    def _remember(self, key, y, sr):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (y, sr)
+            self._memory_used += y.nbytes
+            while self._memory_used > self.memory_bytes and len(self._entries) > 1:
+                _, (old, _) = self._entries.popitem(last=False)
+                self._memory_used -= old.nbytes
+
+    def _read(self, digest: str, target: str):
+        for path in self.root.glob(f"{digest}-{target}-*.npy"):
+            try:
+                y = np.load(path, mmap_mode="r")
+                os.utime(path)  # 以修改时间记录最近使用
+            except (FileNotFoundError, ValueError):
+                continue  # 被其他进程淘汰或尚未写完
+            return y, int(path.stem.rsplit("-", 1)[1])
+        return None
+
+    def _evict(self, keep: pathlib.Path):
+        """超过磁盘上限时删除最久未使用的文件, 刚写入的 keep 除外"""
+        files = []
+        for path in self.root.glob("*.npy"):
+            if path == keep:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files) + keep.stat().st_size
+        for _, size, path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def load(self, path, sr=None):
+        """解码音频文件, 返回 (float32 波形, 采样率); sr=None 表示保持原采样率"""
+        digest = file_digest(path)
+        target = "native" if sr is None else str(sr)
+        key = (digest, target)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = self._read(digest, target)
+        if entry is None:
+            y, actual_sr = librosa.load(path, sr=sr)
+            y = np.ascontiguousarray(y, dtype=np.float32)
+            # 先写入临时文件再改名, 避免其他进程读到不完整的数据
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, y)
+            # 与命中时一样返回只读的内存映射, 改名前打开, 文件被其他进程淘汰后映射仍然有效
+            y = np.load(tmp_path, mmap_mode="r")
+            cache_path = self.root / f"{digest}-{target}-{actual_sr}.npy"
+            os.replace(tmp_path, cache_path)
+            self._evict(cache_path)
+            entry = (y, int(actual_sr))
+        self._remember(key, *entry)
+        return entry
+
+
+decode_cache = DecodeCache(DECODE_CACHE_DIR, DECODE_CACHE_DISK_BYTES, DECODE_CACHE_MEMORY_BYTES)
+
+
+def load_audio(path, sr=None):
+    """通过解码缓存读取音频, 用法同 librosa.load(path, sr=sr)"""
+    return decode_cache.load(path, sr)
@@ -0,0 +1,226 @@
+"""
+带 Sakoe-Chiba 约束带的 DTW
+
+代价矩阵只在约束带内按块批量计算 (矩阵乘法), 累积代价的动态规划由 numba 编译执行。
+只求距离时逐块计算代价并只保留上一行的累积代价, 内存与序列长度的乘积无关;
+求对齐路径时需要保存整个带内的累积代价矩阵。
+metric="euclidean" 时结果等于逐帧欧氏距离之和, 与 fastdtw(x, y, dist=euclidean) 的精确解一致;
+metric="sqeuclidean" 时对平方距离之和开方, 与 dtaidistance.dtw.distance 一致。
+"""
+import math
+
+import numpy as np
+from numba import njit
+
+BLOCK_ROWS = 256  # 每次批量计算代价矩阵的行数
+MAX_PATH_CELLS = 25_000_000  # 求对齐路径时带内累积代价矩阵的最大元素数（约 200MB）
+
+
+def band_limits(n: int, m: int, window=None):
+    """
+    每一行在约束带内的列范围 [lo, hi)。
+    约束带沿 (0, 0) 到 (n-1, m-1) 的对角线, 半径为 window 帧;
+    半径不小于对角线斜率, 以保证相邻两行的范围相连。window=None 表示不加约束。
+    """
+    rows = np.arange(n)
+    if window is None:
+        return np.zeros(n, dtype=np.int64), np.full(n, m, dtype=np.int64)
+    slope = (m - 1) / (n - 1) if n > 1 else float(m - 1)
+    radius = max(float(window), math.ceil(slope), 1.0)
+    center = rows * slope
+    lo = np.clip(np.ceil(center - radius), 0, m - 1).astype(np.int64)
+    hi = np.clip(np.floor(center + radius) + 1, 1, m).astype(np.int64)
+    return lo, hi
+
+
+def _cost_blocks(x: np.ndarray, y: np.ndarray, lo: np.ndarray, hi: np.ndarray, squared=False):
+    """
+    每次计算 BLOCK_ROWS 行约束带内的帧间距离, 依次产出 (start, cost),
+    cost 为 (行数, w) 矩阵, 第 r 行第 k 列对应 x[start + r] 与 y[lo[start + r] + k]; 约束带外的位置为 inf。
+    """
+    n = len(x)
+    width = int((hi - lo).max())
+    x_norm = np.einsum("ij,ij->i", x, x)
+    y_norm = np.einsum("ij,ij->i", y, y)
+
+    for start in range(0, n, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, n)
+        cost = np.full((stop - start, width), np.inf)
+        col_start = lo[start:stop].min()
+        col_stop = hi[start:stop].max()
+        if x.shape[1] == 1:
+            # 一维序列直接相减, 避免展开式的舍入误差
+            block = np.square(x[start:stop] - y[col_start:col_stop].T)
+        else:
+            # |x - y|^2 = |x|^2 + |y|^2 - 2 x·y, 对整块一次矩阵乘法
+            block = x_norm[start:stop, None] + y_norm[None, col_start:col_stop] \
+                - 2.0 * (x[start:stop] @ y[col_start:col_stop].T)
+            np.maximum(block, 0.0, out=block)
+        if not squared:
+            np.sqrt(block, out=block)
+        _copy_band(block, lo, hi, start, col_start, cost)
+        yield start, cost
+
+
+def banded_cost(x: np.ndarray, y: np.ndarray, lo: np.ndarray, hi: np.ndarray, squared=False) -> np.ndarray:
+    """
+    计算约束带内的帧间距离, 返回 (n, w) 矩阵, 第 i 行第 k 列对应 x[i] 与 y[lo[i] + k];
+    约束带外的位置为 inf。
+    """
+    return np.concatenate([cost for _, cost in _cost_blocks(x, y, lo, hi, squared)])
+
+
+@njit(cache=True)
+def _copy_band(block, lo, hi, start, col_start, cost):
+    """把一块距离矩阵中落在约束带内的部分按行拷贝到带状存储"""
+    for r in range(block.shape[0]):
+        i = start + r
+        for k in range(hi[i] - lo[i]):
+            cost[r, k] = block[r, lo[i] + k - col_start]
+
+
+@njit(cache=True)
+def _accumulate_rows(cost, lo, hi, start, prev, cur, max_dist):
+    """
+    累积代价的滚动计算: cost 为第 start 行起的带状代价, prev 为第 start - 1 行的累积代价,
+    逐行计算后 prev 更新为最后一行的累积代价; 某一行的最小累积代价超过 max_dist 时返回 False
+    """
+    for r in range(cost.shape[0]):
+        i = start + r
+        row_best = np.inf
+        width = hi[i] - lo[i]
+        for k in range(width):
+            j = lo[i] + k
+            if i == 0 and j == 0:
+                value = cost[r, k]
+            else:
+                best = np.inf
+                if i > 0:
+                    up = j - lo[i - 1]
+                    prev_width = hi[i - 1] - lo[i - 1]
+                    if 0 <= up < prev_width:
+                        best = prev[up]
+                    if 0 <= up - 1 < prev_width and prev[up - 1] < best:
+                        best = prev[up - 1]
+                if k > 0 and cur[k - 1] < best:
+                    best = cur[k - 1]
+                value = cost[r, k] + best
+            cur[k] = value
+            if value < row_best:
+                row_best = value
+        if row_best > max_dist:
+            return False
+        prev[:width] = cur[:width]
+    return True
+
+
+@njit(cache=True)
+def _accumulate(cost, lo, hi, max_dist):
+    """累积代价; 某一行的最小累积代价超过 max_dist 时提前放弃, 返回 False"""
+    n = cost.shape[0]
+    acc = np.full(cost.shape, np.inf)
+    for i in range(n):
+        row_best = np.inf
+        for k in range(hi[i] - lo[i]):
+            j = lo[i] + k
+            if i == 0 and j == 0:
+                value = cost[i, k]
+            else:
+                best = np.inf
+                if i > 0:
+                    up = j - lo[i - 1]
+                    width = hi[i - 1] - lo[i - 1]
+                    if 0 <= up < width:
+                        best = acc[i - 1, up]
+                    if 0 <= up - 1 < width and acc[i - 1, up - 1] < best:
+                        best = acc[i - 1, up - 1]
+                if k > 0 and acc[i, k - 1] < best:
+                    best = acc[i, k - 1]
+                value = cost[i, k] + best
+            acc[i, k] = value
+            if value < row_best:
+                row_best = value
+        if row_best > max_dist:
+            return acc, False
+    return acc, True
+
+
+@njit(cache=True)
+def _backtrack(acc, lo, hi):
+    """从终点回溯最优对齐路径, 返回 (L, 2) 的 (i, j) 数组"""
+    n = acc.shape[0]
+    i = n - 1
+    j = hi[i] - 1
+    path = np.empty((n + hi[i], 2), dtype=np.int64)
+    length = 0
+    path[length, 0] = i
+    path[length, 1] = j
+    length += 1
+    while i > 0 or j > 0:
+        best = np.inf
+        next_i, next_j = i, j
+        if i > 0:
+            width = hi[i - 1] - lo[i - 1]
+            k = j - 1 - lo[i - 1]
+            if j > 0 and 0 <= k < width and acc[i - 1, k] < best:
+                best = acc[i - 1, k]
+                next_i, next_j = i - 1, j - 1
+            k = j - lo[i - 1]
+            if 0 <= k < width and acc[i - 1, k] < best:
+                best = acc[i - 1, k]
+                next_i, next_j = i - 1, j
+        k = j - 1 - lo[i]
+        if j > 0 and 0 <= k and acc[i, k] < best:
+            next_i, next_j = i, j - 1
+        i, j = next_i, next_j
+        path[length, 0] = i
+        path[length, 1] = j
+        length += 1
+    return path[:length][::-1]
+
+
+def dtw(x, y, window=None, max_dist=np.inf, return_path=False, metric="euclidean"):
+    """
+    计算两个序列的 DTW 距离。
+    x, y: (n, d) / (m, d) 的逐帧特征, 一维序列视为 d=1
+    window: Sakoe-Chiba 约束带半径（帧）, None 表示不加约束
+    max_dist: 提前放弃阈值, 距离必然超过该值时返回 inf
+    return_path: 为 True 时同时返回对齐路径 [(i, j), ...]; 带内元素数超过 MAX_PATH_CELLS 时抛出 ValueError
+    """
+    if metric not in ("euclidean", "sqeuclidean"):
+        raise ValueError(f"Unknown DTW metric: {metric}")
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    if y.ndim == 1:
+        y = y[:, np.newaxis]
+    if len(x) == 0 or len(y) == 0:
+        return (np.inf, []) if return_path else np.inf
+
+    squared = metric == "sqeuclidean"
+    lo, hi = band_limits(len(x), len(y), window)
+    limit = float(max_dist * max_dist if squared else max_dist)
+    if return_path:
+        if len(x) * int((hi - lo).max()) > MAX_PATH_CELLS:
+            raise ValueError("Sequences are too long to return a DTW path without a smaller window")
+        acc, finished = _accumulate(banded_cost(x, y, lo, hi, squared=squared), lo, hi, limit)
+        if not finished:
+            return np.inf, []
+        distance = acc[-1, hi[-1] - 1 - lo[-1]]
+    else:
+        width = int((hi - lo).max())
+        prev = np.full(width, np.inf)
+        cur = np.full(width, np.inf)
+        for start, cost in _cost_blocks(x, y, lo, hi, squared):
+            if not _accumulate_rows(cost, lo, hi, start, prev, cur, limit):
+                return np.inf
+        distance = prev[hi[-1] - 1 - lo[-1]]
+    if squared:
+        distance = math.sqrt(distance)
+    if distance > max_dist:
+        distance = np.inf
+    if not return_path:
+        return float(distance)
+    path = _backtrack(acc, lo, hi)
+    return float(distance), [(int(i), int(j)) for i, j in path]
@@ -0,0 +1,176 @@
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import librosa
+import numpy as np
+import requests
+from dotenv import load_dotenv
+
+from services.audio_service import (
+    MATCH_FEATURE_MODE, SAMPLE_RATE, AudioFeatures, SegmentFeatures, extract_features, extract_segment_features,
+    calculate_reference_match, iter_reference_match
+)
+from services.decode_cache import file_digest
+
+load_dotenv()
+
+FEATURE_STORE_DIR = pathlib.Path(os.getenv("FEATURE_STORE_DIR", "Temp/feature_store"))
+FEATURE_STORE_MEMORY_ENTRIES = int(os.getenv("FEATURE_STORE_MEMORY_ENTRIES", 64))  # 每个进程保持打开的曲谱数
+SEGMENT_LENGTH = 1.0  # /audio/match 的分段长度（秒）
+FEATURE_ARRAYS = ("mfcc", "pitch", "frame_offsets", "beats", "beat_offsets")
+
+
+class FeatureStore:
+    """
+    曲谱库音频的分段特征缓存, 以 MusicSheet.id 和音频内容的 SHA-256 为键。
+    曲谱一侧每段的 MFCC、音高和节拍只与音频本身、分段长度和特征提取方式有关, 提取一次后保存,
+    匹配时只需对上传的音频提取特征; 不保存解码后的波形。
+    每个曲谱在磁盘上保存为一个目录, 特征数组以 .npy 格式存储并内存映射,
+    分析进程之间共享同一份页缓存; 每个进程只保持最近使用的 memory_entries 个曲谱打开。
+    invalidate 只作用于调用它的进程, 其他进程使用内存中的曲谱前检查目录中的 meta.json,
+    目录被删除或替换后重新读取。
+    """
+
+    def __init__(self, root: pathlib.Path, memory_entries: int):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.memory_entries = memory_entries
+        self._entries = OrderedDict()  # sheet_id -> (目录, meta.json 的 _stamp, meta, SegmentFeatures)
+        self._lock = threading.Lock()
+
+    def _dirs(self, sheet_id: int):
+        return [path for path in self.root.glob(f"{sheet_id}-*") if path.is_dir()]
+
+    @staticmethod
+    def _stamp(path: pathlib.Path):
+        """meta.json 的 inode 和修改时间, 目录被删除时返回 None"""
+        try:
+            stat = os.stat(path / "meta.json")
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    @staticmethod
+    def _matches(meta: dict, source: str, segment_length: float, mode: str) -> bool:
+        return (meta.get("source") == source and meta.get("segment_length") == segment_length
+                and meta.get("mode") == mode)
+
+    def _open(self, sheet_id: int, path: pathlib.Path, meta: dict, stamp) -> SegmentFeatures:
+        """内存映射曲谱目录中的特征数组"""
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in FEATURE_ARRAYS}
+        features = SegmentFeatures(samples=meta["samples"], segment_length=meta["segment_length"],
+                                   mode=meta["mode"], sr=meta["sr"], **arrays)
+        with self._lock:
+            self._entries[sheet_id] = (path, stamp, meta, features)
+            self._entries.move_to_end(sheet_id)
+            while len(self._entries) > self.memory_entries:
+                self._entries.popitem(last=False)
+        return features
+
+    def _read(self, path: pathlib.Path):
+        """读取曲谱目录, 目录已被删除时返回 (None, None)"""
+        stamp = self._stamp(path)
+        try:
+            with open(path / "meta.json") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        return meta, stamp
+
+    def put(self, sheet_id: int, audio_path: str, source: str, segment_length=SEGMENT_LENGTH,
+            mode=MATCH_FEATURE_MODE) -> SegmentFeatures:
+        """提取本地音频文件的分段特征并写入缓存, source 为曲谱的 audio_file_path"""
+        digest = file_digest(audio_path)
+        # 曲谱音频只在这里解码一次, 不写入解码缓存
+        y, sr = librosa.load(audio_path, sr=SAMPLE_RATE)
+        y = np.ascontiguousarray(y, dtype=np.float32)
+        features = extract_features(y, sr) if mode == "full" else AudioFeatures(y=y, sr=sr)
+        segments = extract_segment_features(features, segment_length, mode)
+
+        # 先写入临时目录再改名, 避免其他进程读到不完整的数据
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(dir=self.root, prefix=".tmp-"))
+        for name in FEATURE_ARRAYS:
+            np.save(tmp_dir / f"{name}.npy", getattr(segments, name))
+        meta = {"source": source, "sha256": digest, "sr": segments.sr, "samples": segments.samples,
+                "segment_length": segment_length, "mode": mode}
+        with open(tmp_dir / "meta.json", "w") as f:
+            json.dump(meta, f)
+
+        self.invalidate(sheet_id)
+        path = self.root / f"{sheet_id}-{digest[:16]}"
+        os.replace(tmp_dir, path)
+        # 不在内存中保留刚提取的数组, 与其他进程一样从磁盘内存映射
+        return self._open(sheet_id, path, meta, self._stamp(path))
+
+    def get(self, sheet_id: int, source: str, segment_length=SEGMENT_LENGTH, mode=MATCH_FEATURE_MODE):
+        """读取缓存的分段特征, 不存在或音频地址、分段方式已变化时返回 None"""
+        with self._lock:
+            entry = self._entries.get(sheet_id)
+        if entry is not None:
+            path, stamp, meta, features = entry
+            if self._matches(meta, source, segment_length, mode) and self._stamp(path) == stamp:
+                with self._lock:
+                    if sheet_id in self._entries:
+                        self._entries.move_to_end(sheet_id)
+                return features
+            # 其他进程已删除或替换了该曲谱的特征
+            with self._lock:
+                if self._entries.get(sheet_id) is entry:
+                    del self._entries[sheet_id]
+
+        for path in self._dirs(sheet_id):
+            meta, stamp = self._read(path)
+            if meta is not None and self._matches(meta, source, segment_length, mode):
+                return self._open(sheet_id, path, meta, stamp)
+        return None
+
+    def load(self, sheet_id: int, source: str, segment_length=SEGMENT_LENGTH, mode=MATCH_FEATURE_MODE) -> SegmentFeatures:
+        """读取缓存的分段特征, 没有缓存时下载音频并提取"""
+        features = self.get(sheet_id, source, segment_length, mode)
+        if features is not None:
+            return features
+
+        response = requests.get(source)
+        response.raise_for_status()
+        suffix = pathlib.PurePosixPath(source).suffix or ".mp3"
+        fd, audio_path = tempfile.mkstemp(dir=self.root, prefix=f".{sheet_id}-", suffix=suffix)
+        with os.fdopen(fd, "wb") as f:
+            f.write(response.content)
+        try:
+            return self.put(sheet_id, audio_path, source, segment_length, mode)
+        finally:
+            os.remove(audio_path)
+
+    def invalidate(self, sheet_id: int) -> None:
+        """删除曲谱的缓存特征"""
+        with self._lock:
+            self._entries.pop(sheet_id, None)
+        for path in self._dirs(sheet_id):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+feature_store = FeatureStore(FEATURE_STORE_DIR, FEATURE_STORE_MEMORY_ENTRIES)
+
+
+# 以下函数在分析进程中执行, 各进程使用自己的 feature_store 实例
+
+def extract_sheet_features(sheet_id: int, audio_path: str, source: str) -> None:
+    """提取曲谱音频的特征并写入缓存"""
+    feature_store.put(sheet_id, audio_path, source)
+
+
+def match_sheet(sheet_id: int, source: str, file_path: str, segment_length=SEGMENT_LENGTH, on_segment=None):
+    """计算上传文件与曲谱音频的分段匹配度, 特征的提取方式由 MATCH_FEATURE_MODE 决定"""
+    reference = feature_store.load(sheet_id, source, segment_length)
+    return calculate_reference_match(reference, file_path, segment_length, on_segment)
+
+
+def iter_match_sheet(sheet_id: int, source: str, file_path: str, segment_length=SEGMENT_LENGTH):
+    """逐段计算上传文件与曲谱音频的匹配度"""
+    reference = feature_store.load(sheet_id, source, segment_length)
+    yield from iter_reference_match(reference, file_path, segment_length)
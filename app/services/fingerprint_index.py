@@ -0,0 +1,363 @@
+"""
+曲谱库音频指纹索引, 用于识别上传的片段是哪一首曲谱
+
+指纹为频谱峰值对: 在对数幅度谱上找局部最大值, 每个峰值与其后的若干峰值组成一对,
+(两者的频点, 时间差) 编码为一个 24 位整数, 记在前一个峰值所在的帧上。
+索引按指纹排序保存 (指纹, 曲谱 id, 帧号) 三个并行数组, 查询时二分查找
+（与 utils/audio/testAudioCompare/AudioCompare-master 的 FingerprintIndex 相同）;
+同一曲谱与片段匹配的指纹按帧号差（时间偏移）统计, 出现最多的偏移的次数即为得分。
+"""
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+import librosa
+import numpy as np
+import requests
+from fastapi import HTTPException
+from scipy.ndimage import maximum_filter
+from dotenv import load_dotenv
+
+from services.audio_pool import audio_pool
+from services.decode_cache import load_audio
+
+load_dotenv()
+
+FINGERPRINT_DIR = pathlib.Path(os.getenv("FINGERPRINT_DIR", "Temp/fingerprints"))
+FINGERPRINT_MAX_POSTINGS = int(os.getenv("FINGERPRINT_MAX_POSTINGS", 5000))  # 出现次数超过该值的指纹不参与查询
+FINGERPRINT_SR = 11025
+FINGERPRINT_N_FFT = 1024
+FINGERPRINT_HOP = 256  # 约 23ms 一帧
+PEAK_FREQ_SIZE = 21  # 局部最大值的邻域（频点）
+PEAK_TIME_SIZE = 11  # 局部最大值的邻域（帧）
+PEAK_MIN_DB = -50.0  # 低于全曲最大值 50dB 的峰值忽略
+PEAK_OVER_MEDIAN_DB = 10.0  # 峰值至少比所在频点的中位数高 10dB, 排除底噪上的峰值
+FAN_OUT = 5  # 每个峰值与其后的几个峰值组成指纹
+MAX_DT = 63  # 峰值对的最大帧数差, 占 6 位
+MERGE_FACTOR = 2  # 新段不小于前一段的 1/MERGE_FACTOR 时与前一段合并
+
+
+def fingerprint_audio(y: np.ndarray, sr: int) -> np.ndarray:
+    """
+    计算单声道波形的指纹, 返回 (n, 2) 的 uint32 数组, 每行为 (指纹, 帧号), 按帧号排序。
+    """
+    if sr != FINGERPRINT_SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=FINGERPRINT_SR)
+    if len(y) < FINGERPRINT_N_FFT:
+        return np.zeros((0, 2), dtype=np.uint32)
+
+    spectrum = np.abs(librosa.stft(np.asarray(y, dtype=np.float32), n_fft=FINGERPRINT_N_FFT,
+                                   hop_length=FINGERPRINT_HOP, center=False))[1:FINGERPRINT_N_FFT // 2]
+    db = librosa.amplitude_to_db(spectrum, ref=np.max)
+    floor = np.median(db, axis=1, keepdims=True) + PEAK_OVER_MEDIAN_DB
+    peaks = (db == maximum_filter(db, size=(PEAK_FREQ_SIZE, PEAK_TIME_SIZE))) & (db > PEAK_MIN_DB) & (db > floor)
+    frames, freqs = np.nonzero(peaks.T)  # 按帧号、频点排序
+    freqs = freqs + 1
+
+    anchors, targets = [], []
+    for k in range(1, FAN_OUT + 1):
+        i = np.arange(len(frames) - k)
+        dt = frames[i + k] - frames[i]
+        valid = (dt > 0) & (dt <= MAX_DT)
+        anchors.append(i[valid])
+        targets.append(i[valid] + k)
+    anchors = np.concatenate(anchors)
+    targets = np.concatenate(targets)
+    order = np.argsort(anchors, kind="stable")
+    anchors, targets = anchors[order], targets[order]
+
+    hashes = (freqs[anchors] << 15) | (freqs[targets] << 6) | (frames[targets] - frames[anchors])
+    return np.stack([hashes, frames[anchors]], axis=1).astype(np.uint32)
+
+
+def fingerprint_file(path) -> np.ndarray:
+    """解码音频文件并计算指纹"""
+    y, sr = load_audio(path, sr=FINGERPRINT_SR)
+    return fingerprint_audio(y, sr)
+
+
+def frames_to_seconds(frames) -> float:
+    return float(frames) * FINGERPRINT_HOP / FINGERPRINT_SR
+
+
+def _length(landmarks) -> int:
+    """指纹覆盖的帧数"""
+    return int(landmarks[:, 1].max()) + 1 if len(landmarks) else 0
+
+
+class _Segment:
+    """按指纹排序的一段索引"""
+
+    def __init__(self, fingerprints, sheet_ids, frames, sort=True):
+        if sort:
+            order = np.argsort(fingerprints, kind="stable")
+            fingerprints, sheet_ids, frames = fingerprints[order], sheet_ids[order], frames[order]
+        self.fingerprints = fingerprints
+        self.sheet_ids = sheet_ids
+        self.frames = frames
+
+    @classmethod
+    def build(cls, items):
+        """items: [(sheet_id, fingerprint_audio 返回的数组), ...]"""
+        return cls(np.concatenate([landmarks[:, 0] for _, landmarks in items]),
+                   np.concatenate([np.full(len(landmarks), sheet_id, dtype=np.int32) for sheet_id, landmarks in items]),
+                   np.concatenate([landmarks[:, 1].astype(np.int32) for _, landmarks in items]))
+
+    @classmethod
+    def merge(cls, segments):
+        # 各段已排序, 稳定排序 (timsort) 只需归并
+        return cls(np.concatenate([s.fingerprints for s in segments]),
+                   np.concatenate([s.sheet_ids for s in segments]),
+                   np.concatenate([s.frames for s in segments]))
+
+    def without(self, sheet_ids):
+        keep = ~np.isin(self.sheet_ids, list(sheet_ids))
+        return _Segment(self.fingerprints[keep], self.sheet_ids[keep], self.frames[keep], sort=False)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+class FingerprintIndex:
+    """
+    曲谱指纹的内存索引。
+    索引由若干按指纹排序的段组成, 新增曲谱时只为它建一个小段, 与大小相近的末尾段合并
+    (段的大小依次减半, 段数为对数级), 不需要重建整个索引。
+    段的列表整体替换, 查询不需要加锁。
+    """
+
+    def __init__(self, max_postings: int = FINGERPRINT_MAX_POSTINGS):
+        self.max_postings = max_postings
+        self._segments = ()
+        self._lengths = {}  # sheet_id -> 帧数
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, sheet_id):
+        return sheet_id in self._lengths
+
+    def add(self, items) -> None:
+        """
+        加入或替换曲谱的指纹。
+        items: {sheet_id: 指纹} 或 [(sheet_id, 指纹), ...], 指纹为 fingerprint_audio 返回的数组
+        """
+        items = [(int(sheet_id), np.asarray(f, dtype=np.uint32).reshape(-1, 2)) for sheet_id, f in dict(items).items()]
+        if not items:
+            return
+        segment = _Segment.build(items)
+        with self._lock:
+            replaced = [sheet_id for sheet_id, _ in items if sheet_id in self._lengths]
+            segments = list(self._segments)
+            if replaced:
+                segments = [s.without(replaced) for s in segments]
+            while segments and len(segments[-1]) <= MERGE_FACTOR * len(segment):
+                segment = _Segment.merge([segments.pop(), segment])
+            segments.append(segment)
+            self._segments = tuple(s for s in segments if len(s))
+            for sheet_id, landmarks in items:
+                self._lengths[sheet_id] = _length(landmarks)
+
+    def remove(self, sheet_id: int) -> None:
+        with self._lock:
+            if self._lengths.pop(sheet_id, None) is None:
+                return
+            self._segments = tuple(s for s in (s.without([sheet_id]) for s in self._segments) if len(s))
+
+    def query(self, landmarks, top_k: int = 5):
+        """
+        查找与片段指纹最匹配的曲谱。
+        返回按得分从高到低的 [(sheet_id, 得分, 偏移帧数), ...], 最多 top_k 个;
+        得分为最多的同一时间偏移的匹配指纹数除以片段与曲谱中较短者的秒数,
+        偏移为片段开头在曲谱音频中的帧号（片段开头早于曲谱开头时为负数）。
+        """
+        landmarks = np.asarray(landmarks, dtype=np.uint32).reshape(-1, 2)
+        query = landmarks[:, 0]
+        query_frames = landmarks[:, 1].astype(np.int64)
+        segments = self._segments
+        lengths = self._lengths
+        if not len(query) or not segments:
+            return []
+
+        ranges = [(np.searchsorted(s.fingerprints, query, side="left"),
+                   np.searchsorted(s.fingerprints, query, side="right")) for s in segments]
+        # 跳过在整个曲谱库中都很常见的指纹, 它们几乎不能区分曲谱
+        common = sum(end - start for start, end in ranges) > self.max_postings
+
+        sheet_ids, offsets = [], []
+        for segment, (starts, ends) in zip(segments, ranges):
+            counts = np.where(common, 0, ends - starts)
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            # 把每个 [start, end) 展开为所有匹配帧的位置, 以及与之匹配的片段帧号
+            first = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            positions = first + np.arange(total)
+            sheet_ids.append(segment.sheet_ids[positions])
+            offsets.append(segment.frames[positions] - np.repeat(query_frames, counts))
+        if not sheet_ids:
+            return []
+        sheet_ids = np.concatenate(sheet_ids).astype(np.int64)
+        offsets = np.concatenate(offsets).astype(np.int64)
+
+        # 每个 (曲谱, 偏移) 一个键, 同一曲谱的键相邻
+        low = offsets.min()
+        span = int(offsets.max() - low) + 1
+        keys, key_counts = np.unique(sheet_ids * span + (offsets - low), return_counts=True)
+        key_sheets = keys // span
+        # 同一曲谱内按次数排序, 取每个曲谱次数最多的偏移
+        order = np.lexsort((key_counts, key_sheets))
+        last = np.flatnonzero(np.append(np.diff(key_sheets[order]), 1))
+        best = order[last]
+
+        query_seconds = frames_to_seconds(_length(landmarks))
+        results = []
+        for key, count in zip(keys[best], key_counts[best]):
+            sheet_id = int(key // span)
+            length = lengths.get(sheet_id)
+            if length is None:
+                continue  # 查询期间被删除
+            seconds = min(query_seconds, frames_to_seconds(length))
+            score = float(count) / seconds if seconds > 0 else 0.0
+            results.append((sheet_id, score, int(key % span + low)))
+        results.sort(key=lambda r: -r[1])
+        return results[:top_k]
+
+
+class SheetIdentifier:
+    """
+    曲谱库的指纹索引及其磁盘缓存, 索引保存在主进程中, 指纹在分析进程中计算。
+    每个曲谱的指纹以 .npy 格式保存为 {曲谱 id}-{音频地址 SHA-256 前 16 位}.npy,
+    启动时读取全部缓存建立索引, 缺少缓存的曲谱在后台逐个计算后加入索引。
+    每个曲谱记录被删除的次数（代数）, 计算指纹期间曲谱被删除时, 计算结果不再加入索引。
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index = FingerprintIndex()
+        self._generations = {}  # sheet_id -> 删除次数
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def generation(self, sheet_id: int) -> int:
+        with self._lock:
+            return self._generations.get(sheet_id, 0)
+
+    def cache_path(self, sheet_id: int, source: str) -> pathlib.Path:
+        digest = hashlib.sha256(source.encode()).hexdigest()[:16]
+        return self.root / f"{sheet_id}-{digest}.npy"
+
+    def read(self, sheet_id: int, source: str):
+        """读取缓存的指纹, 不存在时返回 None"""
+        try:
+            return np.load(self.cache_path(sheet_id, source))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write(self, sheet_id: int, source: str, landmarks: np.ndarray) -> None:
+        # 先写入临时文件再改名, 避免其他进程读到不完整的数据
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, landmarks)
+        self.invalidate(sheet_id)
+        os.replace(tmp_path, self.cache_path(sheet_id, source))
+
+    def invalidate(self, sheet_id: int) -> None:
+        for path in self.root.glob(f"{sheet_id}-*.npy"):
+            path.unlink(missing_ok=True)
+
+    def submit(self, sheet_id: int, source: str, audio_path: str | None = None, generation: int | None = None):
+        """
+        在分析进程中计算曲谱的指纹, 完成后加入索引; 进程池已满时抛出 503。
+        generation 默认为提交时曲谱的代数, 完成时曲谱已被删除（代数变化）则丢弃结果。
+        """
+        if generation is None:
+            generation = self.generation(sheet_id)
+        future = audio_pool.submit(fingerprint_sheet, sheet_id, source, audio_path)
+
+        def done(f):
+            try:
+                landmarks = f.result()
+            except Exception as e:
+                print(f"Warning: failed to fingerprint sheet {sheet_id}: {e}")
+                return
+            with self._lock:
+                if self._generations.get(sheet_id, 0) == generation:
+                    self.index.add({sheet_id: landmarks})
+                    return
+            # 曲谱在计算期间已被删除, 删除分析进程写入的缓存
+            self.invalidate(sheet_id)
+
+        future.add_done_callback(done)
+        return future
+
+    def load_library(self, sheets) -> None:
+        """
+        建立曲谱库的索引, sheets: [(sheet_id, audio_file_path), ...]
+        有缓存的曲谱立即加入索引, 其余的在后台线程中逐个提交到分析进程计算, 不阻塞启动
+        """
+        cached, missing = {}, []
+        for sheet_id, source in sheets:
+            if not source:
+                continue
+            landmarks = self.read(sheet_id, source)
+            if landmarks is None:
+                missing.append((sheet_id, source, self.generation(sheet_id)))
+            else:
+                cached[sheet_id] = landmarks
+        self.index.add(cached)
+
+        def backfill():
+            for sheet_id, source, generation in missing:
+                future = None
+                # 等待期间被删除的曲谱不再计算
+                while future is None and self.generation(sheet_id) == generation:
+                    try:
+                        future = self.submit(sheet_id, source, generation=generation)
+                    except HTTPException:
+                        time.sleep(1)  # 进程池繁忙, 稍后重试
+                if future is None:
+                    continue
+                try:
+                    future.result()
+                except Exception:
+                    pass  # 已在 submit 的回调中提示
+
+        if missing:
+            self._thread = threading.Thread(target=backfill, name="fingerprint-backfill", daemon=True)
+            self._thread.start()
+
+    def remove(self, sheet_id: int) -> None:
+        with self._lock:
+            self._generations[sheet_id] = self._generations.get(sheet_id, 0) + 1
+            self.index.remove(sheet_id)
+        self.invalidate(sheet_id)
+
+
+sheet_identifier = SheetIdentifier(FINGERPRINT_DIR)
+
+
+# 以下函数在分析进程中执行
+
+def fingerprint_sheet(sheet_id: int, source: str, audio_path: str | None = None) -> np.ndarray:
+    """计算曲谱音频的指纹并写入缓存, 没有本地文件时下载 source"""
+    if audio_path is not None and os.path.exists(audio_path):
+        landmarks = fingerprint_file(audio_path)
+    else:
+        response = requests.get(source)
+        response.raise_for_status()
+        suffix = pathlib.PurePosixPath(source).suffix or ".mp3"
+        fd, tmp_path = tempfile.mkstemp(dir=sheet_identifier.root, prefix=f".{sheet_id}-", suffix=suffix)
+        with os.fdopen(fd, "wb") as f:
+            f.write(response.content)
+        try:
+            landmarks = fingerprint_file(tmp_path)
+        finally:
+            os.remove(tmp_path)
+    sheet_identifier.write(sheet_id, source, landmarks)
+    return landmarks
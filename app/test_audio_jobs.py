@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from services import audio_jobs
+from services.audio_jobs import DONE, FAILED, JobStore
+from services.audio_pool import AudioPool
+
+
+def sleep_job(job_id, progress, seconds, source, file_path):
+    """代替 _run_match_job, 等待 seconds 秒后返回一段的结果"""
+    time.sleep(seconds)
+    return [1.0], [1.0], [1.0], [1.0]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    pool = AudioPool(workers=2, queue_depth=2, timeout=0.5, grace=5)
+    monkeypatch.setattr(audio_jobs, "audio_pool", pool)
+    monkeypatch.setattr(audio_jobs, "_run_match_job", sleep_job)
+    store = JobStore(ttl=60, max_jobs=2)
+    yield store
+    store.shutdown()
+    pool.shutdown()
+
+
+def upload(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b"audio")
+    return str(path)
+
+
+def wait_finished(job):
+    for _ in range(100):
+        if job.finished_at is not None:
+            return
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+def test_timed_out_job_fails(store, tmp_path):
+    file_path = upload(tmp_path, "slow.wav")
+    job = store.submit_match(10, "sheet.wav", file_path)
+    wait_finished(job)
+    assert store.get(job.id).to_dict()["state"] == FAILED
+    assert job.error == "音频分析超时"
+    assert not (tmp_path / "slow.wav").exists()
+
+
+def test_active_jobs_are_not_evicted(store, tmp_path):
+    first = store.submit_match(0.3, "sheet.wav", upload(tmp_path, "1.wav"))
+    second = store.submit_match(0.3, "sheet.wav", upload(tmp_path, "2.wav"))
+    with pytest.raises(HTTPException) as error:
+        store.submit_match(0, "sheet.wav", upload(tmp_path, "3.wav"))
+    assert error.value.status_code == 503
+    assert store.get(first.id) is first and store.get(second.id) is second
+
+    wait_finished(first)
+    wait_finished(second)
+    third = store.submit_match(0, "sheet.wav", upload(tmp_path, "4.wav"))
+    # 只删除最早结束的任务
+    assert [store.get(job.id) is not None for job in (first, second, third)].count(True) == 2
+    assert store.get(third.id) is third
+    wait_finished(third)
+    assert third.state == DONE
+
+
+def slow_segments(sheet_id, source, file_path):
+    """代替 iter_match_sheet, 每 0.1 秒产出一段"""
+    for index in range(100):
+        time.sleep(0.1)
+        yield {"segment": index}
+
+
+def test_closed_stream_stops_worker(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_jobs, "iter_match_sheet", slow_segments)
+    pool = audio_jobs.audio_pool
+    pool.timeout = 30
+    lines = store.stream_match(1, "sheet.wav", upload(tmp_path, "stream.wav"))
+
+    async def read_first():
+        async for line in lines:
+            await lines.aclose()  # 客户端断开连接
+            return line
+
+    assert asyncio.run(read_first()) == '{"segment": 0}\n'
+    started = time.monotonic()
+    while pool._pending and time.monotonic() - started < 5:
+        time.sleep(0.05)
+    # 100 段需要 10 秒, 关闭后分析进程应在下一段之后停止
+    assert pool._pending == 0
+    assert not (tmp_path / "stream.wav").exists()
+
+
+def test_full_pool_rejects_stream_before_creating_queue(store, tmp_path):
+    audio_jobs.audio_pool._pending = audio_jobs.audio_pool.workers + audio_jobs.audio_pool.queue_depth
+    with pytest.raises(HTTPException) as error:
+        store.stream_match(1, "sheet.wav", upload(tmp_path, "stream.wav"))
+    assert error.value.status_code == 503
+    assert store._manager is None
+    audio_jobs.audio_pool._pending = 0
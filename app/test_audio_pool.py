@@ -0,0 +1,87 @@
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from services.audio_pool import AudioPool
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def sleep_ignoring_alarm(seconds):
+    """模拟无法被 SIGALRM 中断的 C 扩展调用"""
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+    time.sleep(seconds)
+
+
+def crash():
+    os._exit(1)
+
+
+async def wait_released(pool):
+    for _ in range(100):
+        if pool._pending == 0:
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError("job slots were not released")
+
+
+def test_timeout_interrupts_job_in_worker():
+    pool = AudioPool(workers=1, queue_depth=1, timeout=0.5, grace=5)
+
+    async def main():
+        with pytest.raises(HTTPException) as error:
+            await pool.run(sleep, 10)
+        assert error.value.status_code == 504
+        executor = pool._executor
+        # 同一个进程池继续执行任务
+        await pool.run(sleep, 0)
+        assert pool._executor is executor
+        await wait_released(pool)
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
+
+
+def test_hung_job_does_not_break_other_jobs():
+    pool = AudioPool(workers=2, queue_depth=2, timeout=0.5, grace=0.5)
+
+    async def main():
+        hung, other = await asyncio.gather(
+            pool.run(sleep_ignoring_alarm, 30),
+            pool.run(sleep, 2, timeout=5),
+            return_exceptions=True
+        )
+        assert isinstance(hung, HTTPException) and hung.status_code == 504
+        assert isinstance(other, int)
+        assert isinstance(await pool.run(sleep, 0), int)
+        # 卡住的进程在旧进程池的其他任务结束后被终止, 名额随之释放
+        await wait_released(pool)
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
+
+
+def test_pool_is_rebuilt_after_worker_exits():
+    pool = AudioPool(workers=1, queue_depth=1, timeout=5, grace=1)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await pool.run(crash)
+        assert isinstance(await pool.run(sleep, 0), int)
+        await wait_released(pool)
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+
+from utils.audio import CChordRec as chord_module
+from utils.audio.CChordRec import CChordRec
+
+
+class TinyModel(torch.nn.Module):
+    """代替 model.pth 的六分类模型, 测试不需要训练好的权重"""
+
+    def __init__(self):
+        super().__init__()
+        self.pool = torch.nn.AdaptiveAvgPool2d(4)
+        self.fc = torch.nn.Linear(3 * 4 * 4, 6)
+
+    def forward(self, x):
+        return self.fc(self.pool(x).flatten(1))
+
+
+def tiny_recognizer(tmp_path):
+    torch.manual_seed(0)
+    path = tmp_path / "model.pth"
+    torch.save(TinyModel(), path)
+    return CChordRec(path=str(path))
+
+
+def test_timeline_of_empty_audio(tmp_path, monkeypatch):
+    recognizer = tiny_recognizer(tmp_path)
+    assert recognizer.predictTimeline((np.zeros(0, dtype=np.float32), 22050)) == []
+    # 较短的音频只有一个窗口, 覆盖整段
+    audio = np.random.default_rng(0).standard_normal(2000).astype(np.float32)
+    [(start, end, chord, confidence)] = recognizer.predictTimeline((audio, 22050))
+    assert start == 0.0 and end == len(audio) / 22050 and chord in recognizer.classes
+
+    monkeypatch.setattr(chord_module.librosa.feature, "chroma_stft", lambda **kwargs: np.zeros((12, 0)))
+    assert recognizer.predictTimeline((audio, 22050)) == []
+
+
+def test_tensor_preprocess_matches_pil(tmp_path):
+    recognizer = tiny_recognizer(tmp_path)
+    rng = np.random.default_rng(0)
+    # PIL 路径把 [0, 255] 截断为 uint8, 归一化前最多相差 1/255
+    tolerance = (1 / 255 / recognizer._std + 1e-5).expand(3, 224, 224)
+    tensors, images = [], []
+    for frames in [44, 87, 173, 224, 300]:
+        chroma = rng.random((12, frames)).astype(np.float32)
+        tensor = recognizer.preprocessTensor(chroma)
+        image = recognizer.preprocess(recognizer.normalize_chroma(chroma))
+        assert tensor.shape == image.shape == (3, 224, 224)
+        assert torch.all((tensor - image).abs() <= tolerance)
+        tensors.append(tensor)
+        images.append(image)
+    # 两种预处理给出相同的和弦
+    assert recognizer.predictTensors(tensors).argmax(dim=1).tolist() == \
+        recognizer.predictTensors(images).argmax(dim=1).tolist()
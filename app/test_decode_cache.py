@@ -0,0 +1,110 @@
+import os
+import shutil
+
+import librosa
+import numpy as np
+import pytest
+import soundfile
+
+from services import decode_cache as decode_cache_module
+from services.decode_cache import DecodeCache, file_digest
+
+
+def write_tone(path, seconds=1.0, sr=22050, frequency=440.0):
+    t = np.arange(int(seconds * sr)) / sr
+    soundfile.write(path, (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32), sr)
+    return str(path)
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """记录实际调用 librosa.load 的次数"""
+    calls = []
+    decode = librosa.load
+
+    def load(path, sr=None):
+        calls.append((path, sr))
+        return decode(path, sr=sr)
+
+    monkeypatch.setattr(decode_cache_module.librosa, "load", load)
+    return calls
+
+
+def test_hit_and_miss_return_the_same_array(tmp_path, decodes):
+    audio = write_tone(tmp_path / "audio.wav")
+    # 文件本身是 22050 Hz 的 float32, 解码结果应与原始采样完全相同
+    expected, expected_sr = soundfile.read(audio, dtype="float32")
+    cache = DecodeCache(tmp_path / "cache", 1024 ** 3, 1024 ** 3)
+
+    miss, miss_sr = cache.load(audio, 22050)
+    memory_hit, _ = cache.load(audio, 22050)
+    disk_hit, disk_sr = DecodeCache(tmp_path / "cache", 1024 ** 3, 1024 ** 3).load(audio, 22050)  # 其他进程
+    assert len(decodes) == 1
+    assert miss_sr == disk_sr == expected_sr
+    for y in (miss, memory_hit, disk_hit):
+        # 未命中和命中都返回只读的内存映射
+        assert isinstance(y, np.memmap) and not y.flags.writeable
+        assert y.dtype == np.float32
+        assert np.array_equal(y, expected)
+
+    # 按内容寻址: 内容相同的其他文件直接命中
+    shutil.copy(audio, tmp_path / "copy.wav")
+    assert np.array_equal(cache.load(str(tmp_path / "copy.wav"), 22050)[0], expected)
+    assert len(decodes) == 1
+
+
+def test_sample_rate_is_part_of_the_key(tmp_path, decodes):
+    audio = write_tone(tmp_path / "audio.wav", sr=44100)
+    cache = DecodeCache(tmp_path / "cache", 1024 ** 3, 1024 ** 3)
+
+    y_22k, sr_22k = cache.load(audio, 22050)
+    y_11k, sr_11k = cache.load(audio, 11025)
+    y_native, sr_native = cache.load(audio)
+    assert (sr_22k, sr_11k, sr_native) == (22050, 11025, 44100)
+    assert (len(y_22k), len(y_11k), len(y_native)) == (22050, 11025, 44100)
+    assert len(decodes) == 3
+
+    digest = file_digest(audio)
+    assert sorted(path.name for path in cache.root.glob("*.npy")) == sorted([
+        f"{digest}-11025-11025.npy", f"{digest}-22050-22050.npy", f"{digest}-native-44100.npy"
+    ])
+
+
+def test_memory_cache_evicts_least_recently_used(tmp_path, decodes):
+    first = write_tone(tmp_path / "first.wav", frequency=220)
+    second = write_tone(tmp_path / "second.wav", frequency=330)
+    third = write_tone(tmp_path / "third.wav", frequency=440)
+    # 每段 1 秒, 22050 个 float32, 内存中最多放两段
+    cache = DecodeCache(tmp_path / "cache", 1024 ** 3, 2 * 22050 * 4)
+
+    cache.load(first, 22050)
+    cache.load(second, 22050)
+    cache.load(first, 22050)  # first 变为最近使用
+    cache.load(third, 22050)
+    assert [digest for digest, _ in cache._entries] == [file_digest(first), file_digest(third)]
+    assert cache._memory_used == 2 * 22050 * 4
+    # 被淘汰的 second 仍可从磁盘读取, 不需要重新解码
+    cache.load(second, 22050)
+    assert len(decodes) == 3
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path, decodes):
+    paths = [write_tone(tmp_path / f"{index}.wav", frequency=220 * (index + 1)) for index in range(3)]
+    cache_dir = tmp_path / "cache"
+    # .npy 文件包含 128 字节的头, 磁盘上最多放两个
+    cache = DecodeCache(cache_dir, 2 * (22050 * 4 + 128), 0)
+
+    cache.load(paths[0], 22050)
+    cache.load(paths[1], 22050)
+    files = {index: next(cache_dir.glob(f"{file_digest(path)}-*.npy")) for index, path in enumerate(paths[:2])}
+    os.utime(files[0], (1000, 1000))
+    os.utime(files[1], (2000, 2000))
+    # 从磁盘读取 0 会更新它的修改时间, 于是 1 成为最久未使用的文件
+    cache.load(paths[0], 22050)
+    cache.load(paths[2], 22050)
+
+    assert files[0].exists() and not files[1].exists()
+    assert len(list(cache_dir.glob("*.npy"))) == 2
+    assert list(cache_dir.glob(".tmp-*")) == []
+    cache.load(paths[1], 22050)
+    assert len(decodes) == 4
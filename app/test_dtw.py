@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+import pytest
+from dtaidistance import dtw as dtaidistance_dtw
+
+from services import dtw as dtw_module
+from services.dtw import band_limits, dtw
+
+
+def exact_dtw(x, y, lo=None, hi=None):
+    """逐格计算的 DTW, 只允许 lo[i] <= j < hi[i] 的格子; 返回欧氏距离之和"""
+    x, y = np.atleast_2d(x.T).T, np.atleast_2d(y.T).T
+    n, m = len(x), len(y)
+    acc = np.full((n + 1, m + 1), np.inf)
+    acc[0, 0] = 0.0
+    for i in range(n):
+        for j in range(m):
+            if lo is not None and not lo[i] <= j < hi[i]:
+                continue
+            cost = np.linalg.norm(x[i] - y[j])
+            acc[i + 1, j + 1] = cost + min(acc[i, j], acc[i, j + 1], acc[i + 1, j])
+    return acc[n, m]
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_full_band_equals_exact_dtw(rng):
+    for n, m in [(1, 1), (1, 7), (9, 1), (30, 44), (44, 30), (50, 50)]:
+        x, y = rng.standard_normal((n, 20)), rng.standard_normal((m, 20))
+        expected = exact_dtw(x, y)
+        assert dtw(x, y) == pytest.approx(expected, rel=1e-9)
+        # 半径不小于较长序列的长度时与不加约束相同
+        assert dtw(x, y, window=max(n, m)) == pytest.approx(expected, rel=1e-9)
+
+
+def test_sqeuclidean_equals_dtaidistance(rng):
+    for n, m in [(1, 5), (44, 44), (40, 60), (100, 37)]:
+        x, y = rng.standard_normal(n), rng.standard_normal(m)
+        assert dtw(x, y, metric="sqeuclidean") == pytest.approx(dtaidistance_dtw.distance(x, y), rel=1e-9)
+
+
+def test_band_limits_follow_the_diagonal():
+    for n, m, window in [(10, 10, 2), (20, 50, 3), (50, 20, 3), (44, 44, 1), (1, 9, 2)]:
+        lo, hi = band_limits(n, m, window)
+        slope = (m - 1) / (n - 1) if n > 1 else float(m - 1)
+        radius = max(window, math.ceil(slope), 1)
+        for i in range(n):
+            assert lo[i] < hi[i]
+            assert max(0, math.ceil(i * slope - radius)) == lo[i]
+            assert min(m, math.floor(i * slope + radius) + 1) == hi[i]
+        # 相邻两行的范围相连, 起点和终点都在带内
+        assert np.all(lo[1:] <= hi[:-1])
+        assert lo[0] == 0 and hi[-1] == m
+
+
+def test_band_restricts_alignment(rng):
+    x, y = rng.standard_normal((40, 5)), rng.standard_normal((60, 5))
+    full = dtw(x, y)
+    for window in [2, 5, 10]:
+        lo, hi = band_limits(len(x), len(y), window)
+        banded = dtw(x, y, window=window)
+        assert banded == pytest.approx(exact_dtw(x, y, lo, hi), rel=1e-9)
+        assert banded >= full - 1e-9
+
+        distance, path = dtw(x, y, window=window, return_path=True)
+        assert distance == pytest.approx(banded, rel=1e-9)
+        assert path[0] == (0, 0) and path[-1] == (len(x) - 1, len(y) - 1)
+        for (i0, j0), (i1, j1) in zip(path, path[1:]):
+            assert (i1 - i0, j1 - j0) in [(0, 1), (1, 0), (1, 1)]
+        assert all(lo[i] <= j < hi[i] for i, j in path)
+        assert sum(np.linalg.norm(x[i] - y[j]) for i, j in path) == pytest.approx(distance, rel=1e-9)
+
+
+def test_max_dist_and_path_limit(rng, monkeypatch):
+    x, y = rng.standard_normal((30, 3)), rng.standard_normal((30, 3))
+    distance = dtw(x, y)
+    assert dtw(x, y, max_dist=distance * 1.01) == pytest.approx(distance)
+    assert dtw(x, y, max_dist=distance * 0.5) == np.inf
+    assert dtw(x, np.zeros((0, 3))) == np.inf
+
+    monkeypatch.setattr(dtw_module, "MAX_PATH_CELLS", 100)
+    with pytest.raises(ValueError):
+        dtw(x, y, return_path=True)
+    assert dtw(x, y, window=1, return_path=True)[0] == pytest.approx(dtw(x, y, window=1))
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import soundfile
+
+from services.audio_service import SAMPLE_RATE, calculate_reference_match, calculate_segment_match
+from services.decode_cache import decode_cache
+from services.feature_store import FeatureStore
+
+
+def write_tones(path, seconds, seed):
+    """每 0.25 秒换一个随机音高的正弦波, 加少量噪声"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(0.25 * SAMPLE_RATE)) / SAMPLE_RATE
+    notes = [np.sin(2 * np.pi * rng.uniform(110, 880) * t) for _ in range(int(seconds * 4))]
+    y = 0.5 * np.concatenate(notes) + 0.01 * rng.standard_normal(len(notes) * len(t))
+    soundfile.write(path, y.astype(np.float32), SAMPLE_RATE)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def temp_decode_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(decode_cache, "root", tmp_path / "decode_cache")
+    decode_cache.root.mkdir()
+
+
+def test_reference_segments_match_segment_mode(tmp_path):
+    reference = write_tones(tmp_path / "reference.wav", 4, 0)
+    upload = write_tones(tmp_path / "upload.wav", 3.5, 1)
+    store = FeatureStore(tmp_path / "store", 4)
+    features = store.put(1, reference, "sheet.wav", mode="segment")
+    # 曲谱音频不写入解码缓存
+    assert list(decode_cache.root.glob("*.npy")) == []
+
+    expected = calculate_segment_match(reference, upload, mode="segment")
+    assert calculate_reference_match(features, upload, mode="segment") == expected
+
+
+def test_reload_after_invalidate_in_other_process(tmp_path):
+    first = write_tones(tmp_path / "first.wav", 3, 0)
+    second = write_tones(tmp_path / "second.wav", 4, 1)
+    main = FeatureStore(tmp_path / "store", 4)
+    worker = FeatureStore(tmp_path / "store", 4)  # 分析进程中的实例
+
+    old = main.put(1, first, "sheet.wav", mode="segment")
+    assert worker.get(1, "sheet.wav", mode="segment").samples == old.samples
+
+    # 重新上传曲谱: 只有主进程中的实例执行 invalidate
+    new = main.put(1, second, "sheet.wav", mode="segment")
+    reloaded = worker.get(1, "sheet.wav", mode="segment")
+    assert reloaded.samples == new.samples != old.samples
+    assert np.array_equal(reloaded.pitch, new.pitch)
+
+    main.invalidate(1)
+    assert worker.get(1, "sheet.wav", mode="segment") is None
+
+
+def test_segment_length_and_mode_are_part_of_the_key(tmp_path):
+    audio = write_tones(tmp_path / "audio.wav", 3, 0)
+    store = FeatureStore(tmp_path / "store", 4)
+    store.put(1, audio, "sheet.wav", mode="segment")
+    assert store.get(1, "sheet.wav", mode="segment") is not None
+    assert store.get(1, "sheet.wav", mode="full") is None
+    assert store.get(1, "sheet.wav", segment_length=0.5, mode="segment") is None
+    assert store.get(1, "other.wav", mode="segment") is None
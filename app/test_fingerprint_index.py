@@ -0,0 +1,148 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from services import fingerprint_index
+from services.fingerprint_index import MERGE_FACTOR, FingerprintIndex, SheetIdentifier
+
+
+def landmarks(rng, n_frames, per_frame=3):
+    """合成指纹: 每帧 per_frame 个随机的 24 位指纹, 格式同 fingerprint_audio 的返回值"""
+    frames = np.repeat(np.arange(n_frames), per_frame)
+    hashes = rng.integers(0, 1 << 24, len(frames))
+    return np.stack([hashes, frames], axis=1).astype(np.uint32)
+
+
+def excerpt(sheet, start, n_frames):
+    """从曲谱指纹中截取 [start, start + n_frames) 帧, 帧号从 0 开始"""
+    keep = (sheet[:, 1] >= start) & (sheet[:, 1] < start + n_frames)
+    part = sheet[keep].copy()
+    part[:, 1] -= start
+    return part
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_segments_merge_like_a_single_build(rng):
+    library = {sheet_id: landmarks(rng, int(rng.integers(20, 400))) for sheet_id in range(40)}
+    index = FingerprintIndex()
+    for sheet_id, sheet in library.items():
+        index.add({sheet_id: sheet})
+        sizes = [len(segment) for segment in index._segments]
+        # 段的大小依次减半以上, 段数为对数级
+        assert all(a > MERGE_FACTOR * b for a, b in zip(sizes, sizes[1:]))
+    assert len(index._segments) <= np.log2(sum(map(len, library.values()))) + 1
+    for segment in index._segments:
+        assert np.all(np.diff(segment.fingerprints.astype(np.int64)) >= 0)
+
+    built = FingerprintIndex()
+    built.add(library)
+    assert len(built._segments) == 1 and len(index) == len(built) == 40
+    for sheet_id in [0, 17, 39]:
+        query = excerpt(library[sheet_id], 10, 15)
+        assert index.query(query) == built.query(query)
+
+
+def test_query_ranks_by_aligned_matches(rng):
+    library = {sheet_id: landmarks(rng, 300) for sheet_id in range(1, 9)}
+    query = excerpt(library[3], 100, 50)
+    # 曲谱 5 在第 40 帧起包含片段的后一半, 曲谱 7 包含前 10 帧
+    library[5] = np.concatenate([library[5], excerpt(query, 25, 25) + [0, 40]])
+    library[7] = np.concatenate([library[7], excerpt(query, 0, 10) + [0, 200]])
+    index = FingerprintIndex()
+    index.add(library)
+
+    results = index.query(query, top_k=5)
+    assert [sheet_id for sheet_id, _, _ in results] == [3, 5, 7]
+    assert [offset for _, _, offset in results] == [100, 40 - 25, 200]
+    scores = [score for _, score, _ in results]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[0] == pytest.approx(len(query) / fingerprint_index.frames_to_seconds(50))
+    assert index.query(query, top_k=2) == results[:2]
+    assert index.query(np.zeros((0, 2), dtype=np.uint32)) == []
+
+
+def test_common_fingerprints_are_skipped(rng):
+    sheet = landmarks(rng, 100)
+    common = np.array([[12345, frame] for frame in range(100)], dtype=np.uint32)
+    index = FingerprintIndex(max_postings=50)
+    index.add({1: sheet, 2: common})
+    # 指纹 12345 在曲谱库中出现 100 次, 超过上限, 不参与查询
+    assert index.query(common[:20]) == []
+    assert [sheet_id for sheet_id, _, _ in index.query(excerpt(sheet, 0, 20))] == [1]
+
+
+def test_remove_and_replace(rng):
+    library = {sheet_id: landmarks(rng, 200) for sheet_id in range(1, 6)}
+    index = FingerprintIndex()
+    for sheet_id, sheet in library.items():
+        index.add({sheet_id: sheet})
+
+    index.remove(2)
+    index.remove(2)  # 不存在的曲谱忽略
+    assert 2 not in index and len(index) == 4
+    assert all(2 not in segment.sheet_ids for segment in index._segments)
+    assert index.query(excerpt(library[2], 50, 30)) == []
+    assert index.query(excerpt(library[4], 50, 30))[0][0] == 4
+
+    # 重新上传的曲谱替换原有指纹
+    replacement = landmarks(rng, 80)
+    index.add({4: replacement})
+    assert sum(int(np.sum(segment.sheet_ids == 4)) for segment in index._segments) == len(replacement)
+    assert index.query(excerpt(library[4], 50, 30)) == []
+    assert index.query(excerpt(replacement, 20, 30))[0][:1] == (4,)
+
+
+class ManualPool:
+    """代替 audio_pool, 由测试决定任务何时完成"""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+def test_removed_while_fingerprinting(tmp_path, rng, monkeypatch):
+    pool = ManualPool()
+    monkeypatch.setattr(fingerprint_index, "audio_pool", pool)
+    identifier = SheetIdentifier(tmp_path)
+    first, second = landmarks(rng, 100), landmarks(rng, 100)
+
+    identifier.submit(1, "a.mp3")
+    identifier.submit(2, "b.mp3")
+    identifier.remove(1)  # 计算期间删除曲谱 1
+    assert identifier.generation(1) == 1 and identifier.generation(2) == 0
+    # 分析进程写入缓存后返回
+    identifier.write(1, "a.mp3", first)
+    identifier.write(2, "b.mp3", second)
+    pool.futures[0].set_result(first)
+    pool.futures[1].set_result(second)
+
+    assert 1 not in identifier.index and 2 in identifier.index
+    assert identifier.read(1, "a.mp3") is None
+    assert np.array_equal(identifier.read(2, "b.mp3"), second)
+
+    # 删除后重新上传: 以新的代数提交, 结果正常加入索引
+    identifier.submit(1, "c.mp3")
+    pool.futures[2].set_result(first)
+    assert 1 in identifier.index
+    assert identifier.index.query(excerpt(first, 10, 20))[0][0] == 1
+
+
+def test_load_library_uses_cache(tmp_path, rng, monkeypatch):
+    pool = ManualPool()
+    monkeypatch.setattr(fingerprint_index, "audio_pool", pool)
+    identifier = SheetIdentifier(tmp_path)
+    cached = landmarks(rng, 100)
+    identifier.write(1, "a.mp3", cached)
+
+    identifier.load_library([(1, "a.mp3"), (2, None)])
+    assert 1 in identifier.index and 2 not in identifier.index
+    assert pool.futures == []
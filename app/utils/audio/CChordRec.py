@@ -3,11 +3,17 @@ import librosa.display
 import librosa.feature  
 from scipy.signal import resample
 import numpy as np
+import os
+import tempfile
+import warnings
 import torch
 from torchvision import transforms
 from PIL import Image
 class CChordRec():
-    def __init__(self,path="./model.pth"):
+    def __init__(self,path="./model.pth",mode="eager",loader=None):
+        # mode: eager 直接使用 torch.load 的模型; script 使用 TorchScript; int8 在 script 基础上对全连接层做动态量化
+        # loader(音频路径) -> (波形, 采样率), 默认按原采样率解码
+        self.loader=loader or (lambda audio_path: librosa.load(audio_path,sr=None))
         self.device=torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model=torch.load(path,weights_only=False)
         self.classes=["c","dm","em","f","g","am"]
@@ -18,6 +24,45 @@ class CChordRec():
 		])
         self.model.eval()
         self.model.to(self.device)
+        # 张量预处理: 重采样矩阵按输入长度缓存, 归一化常数只构造一次
+        self.use_tensor_preprocess=True
+        self.image_size=224
+        self._resample_cache={}
+        self._mean=torch.tensor([0.485, 0.456, 0.406]).view(3,1,1)
+        self._std=torch.tensor([0.229, 0.224, 0.225]).view(3,1,1)
+        self.mode="eager"
+        if mode!="eager":
+            self.optimize(path,quantize=mode=="int8")
+    def optimize(self,path,quantize=False):
+        # 导出 TorchScript 并缓存在 model.pth 旁, model.pth 更新后重新导出; 失败时继续使用 eager 模型
+        mode="int8" if quantize else "script"
+        cache=os.path.splitext(path)[0]+f".{mode}.pt"
+        try:
+            if quantize and self.device.type!="cpu":
+                raise RuntimeError("dynamic quantization only runs on CPU")
+            example=torch.zeros(1,3,self.image_size,self.image_size,device=self.device)
+            if not os.path.exists(cache) or os.path.getmtime(cache)<os.path.getmtime(path):
+                model=self.model
+                if quantize:
+                    model=torch.ao.quantization.quantize_dynamic(model,{torch.nn.Linear},dtype=torch.qint8)
+                with torch.no_grad():
+                    scripted=torch.jit.freeze(torch.jit.trace(model,example).eval())
+                # 先写临时文件再改名, 多个进程同时导出时不会读到不完整的文件
+                fd,tmp_path=tempfile.mkstemp(dir=os.path.dirname(cache) or ".",suffix=".tmp")
+                os.close(fd)
+                torch.jit.save(scripted,tmp_path)
+                os.replace(tmp_path,cache)
+            # optimize_for_inference 的结果无法序列化, 每次加载后再做
+            scripted=torch.jit.optimize_for_inference(torch.jit.load(cache,map_location=self.device))
+            with torch.inference_mode():
+                if scripted(example).shape!=(1,len(self.classes)):
+                    raise RuntimeError("unexpected output shape")
+        except Exception as e:
+            warnings.warn(f"CChordRec: {mode} mode unavailable, using eager model ({e})")
+            return False
+        self.model=scripted
+        self.mode=mode
+        return True
     def normalize_chroma(self,chromagram):
         chromagram_resized = resample(chromagram, 224, axis=1)
         chromagram_resized = resample(chromagram_resized, 224, axis=0)
@@ -26,18 +71,38 @@ class CChordRec():
         chromagram_normalized = (chromagram_resized - min_val) / (max_val - min_val) * 255
         chromagram_uint8 = chromagram_normalized.astype(np.uint8)
         return Image.fromarray(chromagram_uint8)
+    def resampleMatrix(self,n):
+        # scipy 的 FFT 重采样是线性变换, 对单位矩阵重采样即得到 (224, n) 的变换矩阵
+        matrix=self._resample_cache.get(n)
+        if matrix is None:
+            matrix=torch.from_numpy(resample(np.eye(n),self.image_size,axis=0).astype(np.float32))
+            if len(self._resample_cache)>=64:
+                self._resample_cache.pop(next(iter(self._resample_cache)))
+            self._resample_cache[n]=matrix
+        return matrix
+    def preprocessTensor(self,chromagram):
+        # 与 normalize_chroma + preprocess 等价, 但全程使用 float32 张量, 不经过 uint8 和 PIL
+        x=torch.from_numpy(np.asarray(chromagram,dtype=np.float32))
+        x=self.resampleMatrix(x.shape[0])@x@self.resampleMatrix(x.shape[1]).T
+        min_val,max_val=x.min(),x.max()
+        x.sub_(min_val).div_(torch.clamp(max_val-min_val,min=1e-12))
+        return x.expand(3,-1,-1).sub(self._mean).div_(self._std)
+    def toInput(self,chromagram):
+        if self.use_tensor_preprocess:
+            return self.preprocessTensor(chromagram)
+        return self.preprocess(self.normalize_chroma(chromagram))
     def predictChord(self,audio_path):
-        audio,sr=librosa.load(audio_path,sr=None)
+        audio,sr=self.loader(audio_path)
         chromagram=librosa.feature.chroma_stft(y=audio, sr=sr)
-        input=self.preprocess(self.normalize_chroma(chromagram))
+        input=self.toInput(chromagram)
         input=input.to(self.device)
         output=self.model(input.unsqueeze(0))
         pred=output.argmax(dim=1,keepdim=True)
         return self.classes[pred.item()]
     def predictProb(self,audio_path):
-        audio,sr=librosa.load(audio_path,sr=None)
+        audio,sr=self.loader(audio_path)
         chromagram=librosa.feature.chroma_stft(y=audio, sr=sr)
-        input=self.preprocess(self.normalize_chroma(chromagram))
+        input=self.toInput(chromagram)
         input=input.to(self.device)
         output=self.model(input.unsqueeze(0))
         probs=torch.softmax(output,dim=1)
@@ -45,6 +110,63 @@ class CChordRec():
         for i in self.classes:
             result[i]=probs[0][self.classes.index(i)].item()
         return result
+    def loadChroma(self,audio,sr=None):
+        # audio 可以是音频路径、(波形,采样率) 或波形数组（此时需给出 sr）
+        if isinstance(audio,str):
+            audio,sr=self.loader(audio)
+        elif isinstance(audio,tuple):
+            audio,sr=audio
+        return librosa.feature.chroma_stft(y=audio, sr=sr)
+    def predictTensors(self,tensors,batch_size=32):
+        # 预处理后的输入每 batch_size 个做一次前向计算, 返回 (N, 类别数) 的概率
+        probs=[]
+        for start in range(0,len(tensors),batch_size):
+            batch=torch.stack(tensors[start:start+batch_size]).to(self.device)
+            with torch.inference_mode():
+                probs.append(torch.softmax(self.model(batch),dim=1).cpu())
+        return torch.cat(probs) if probs else torch.empty(0,len(self.classes))
+    def predictBatch(self,inputs,sr=None,batch_size=32):
+        # 批量识别, 返回 [(和弦, {和弦: 概率}), ...]
+        tensors=[self.toInput(self.loadChroma(i,sr)) for i in inputs]
+        results=[]
+        for prob in self.predictTensors(tensors,batch_size):
+            result={c:prob[i].item() for i,c in enumerate(self.classes)}
+            results.append((self.classes[prob.argmax().item()],result))
+        return results
+    def predictTimeline(self,audio,sr=None,window=2.0,hop=0.5,batch_size=64,hop_length=512):
+        # 和弦时间线: 整段音频只计算一次色度图, 以 window 秒的窗口、hop 秒的步长滑动,
+        # 所有窗口批量识别后合并相邻的相同和弦, 返回 [(开始秒, 结束秒, 和弦, 置信度), ...]
+        if isinstance(audio,str):
+            audio,sr=self.loader(audio)
+        elif isinstance(audio,tuple):
+            audio,sr=audio
+        if len(audio)==0:
+            return []
+        chromagram=librosa.feature.chroma_stft(y=audio, sr=sr, hop_length=hop_length)
+        n_frames=chromagram.shape[1]
+        if n_frames==0:
+            return []  # 没有可识别的帧, 时间线为空
+        win=max(1,min(n_frames,int(round(window*sr/hop_length))))
+        step=max(1,int(round(hop*sr/hop_length)))
+        starts=list(range(0,n_frames-win+1,step))
+        if starts[-1]+win<n_frames:
+            starts.append(n_frames-win)  # 最后一个窗口对齐到结尾
+        tensors=[self.toInput(chromagram[:,s:s+win]) for s in starts]
+        probs=self.predictTensors(tensors,batch_size)
+        confidence,labels=probs.max(dim=1)
+        duration=len(audio)/sr
+        # 窗口的识别结果代表窗口中心的和弦, 每个窗口负责相邻窗口中心的中点之间的时间段
+        centers=[(s+win/2)*hop_length/sr for s in starts]
+        bounds=[0.0]+[(a+b)/2 for a,b in zip(centers,centers[1:])]+[duration]
+        timeline=[]
+        for i,(label,conf) in enumerate(zip(labels.tolist(),confidence.tolist())):
+            chord=self.classes[label]
+            if timeline and timeline[-1][2]==chord:
+                begin,_,_,confs=timeline[-1]
+                timeline[-1]=(begin,bounds[i+1],chord,confs+[conf])
+            else:
+                timeline.append((bounds[i],bounds[i+1],chord,[conf]))
+        return [(begin,end,chord,sum(confs)/len(confs)) for begin,end,chord,confs in timeline]
 if __name__=="__main__":
     obj=CChordRec()
     print(obj.predictChord("./test.wav"))
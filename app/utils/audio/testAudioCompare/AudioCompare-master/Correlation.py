@@ -0,0 +1,124 @@
+import numpy as np
+from InputFile import InputFile
+from common import *
+
+
+# Chunks are 1/50th of a second long
+CHUNKS_PER_SECOND = 50
+# Two chunks are similar when the correlation of their spectra is at least this
+CORRELATION_THRESHOLD = 0.9
+# Two files match when this many pairs of similar chunks have the same offset
+CORRELATION_MIN_MATCHES = 10
+# Number of chunks of each file correlated at a time
+CORRELATION_TILE = 1024
+
+
+class CorrelationResult(BaseResult):
+    """The result of comparing two files by
+    the correlation of their chunk spectra."""
+    def __init__(self, file1, file2, matched, offset, count):
+        super(CorrelationResult, self).__init__(True, "")
+        self.file1 = file1
+        self.file2 = file2
+        self.matched = matched
+        self.offset = offset
+        self.count = count
+
+    def __str__(self):
+        if self.matched:
+            return "MATCH {f1} {f2} ({c})".format(f1=self.file1, f2=self.file2, c=self.count)
+        else:
+            return "NO MATCH"
+
+
+def chunk_spectra(samples, chunk_size):
+    """Split the samples into chunks of chunk_size samples
+    (dropping the samples after the last whole chunk)
+    and return the rfft of every chunk, one row per chunk."""
+    chunks = len(samples) // chunk_size
+    return np.fft.rfft(np.reshape(samples[:chunks * chunk_size], (chunks, chunk_size)), axis=1)
+
+
+def normalize_spectra(spectra):
+    """Z-normalise complex chunk spectra, so that the correlation
+    of two chunks is the dot product of their rows.
+
+    np.corrcoef(a, b)[0][1] of two complex spectra is the sum of
+    (a - mean(a)) * conj(b - mean(b)), divided by the norms of
+    a - mean(a) and b - mean(b). Its real part, which is what
+    comparing it with a threshold looks at, is the dot product of
+    the real and imaginary parts laid side by side, so we return
+    real rows of twice the length. Chunks with no variance (silence)
+    become rows of zeros, which correlate with nothing."""
+    spectra = np.asarray(spectra, dtype=np.complex128)
+    centered = spectra - spectra.mean(axis=1)[:, np.newaxis]
+    rows = np.hstack((centered.real, centered.imag))
+    norms = np.sqrt((rows ** 2).sum(axis=1))
+    nonzero = norms > 0
+    rows[nonzero] /= norms[nonzero][:, np.newaxis]
+    rows[~nonzero] = 0
+    return rows
+
+
+def offset_histogram(a, b, threshold=CORRELATION_THRESHOLD, min_matches=CORRELATION_MIN_MATCHES,
+                     tile=CORRELATION_TILE):
+    """Count the pairs of chunks (i, j) whose correlation is at least
+    threshold, by the distance abs(j - i) between them.
+
+    The correlation matrix is computed as matrix products of
+    tile x tile blocks of a and b, so memory use doesn't depend on
+    the length of the files. We stop as soon as some distance
+    has min_matches pairs.
+    @param a Normalised spectra of the first file, as returned by normalize_spectra()
+    @param b Normalised spectra of the second file
+    @param min_matches Stop once a count reaches this. None means never stop early.
+    @return A 2-tuple of the histogram (an array indexed by distance)
+    and whether some distance reached min_matches"""
+    n, m = len(a), len(b)
+    histogram = np.zeros(max(n, m), dtype=np.int64)
+    for i in xrange(0, n, tile):
+        for j in xrange(0, m, tile):
+            correlation = np.dot(a[i:i + tile], b[j:j + tile].T)
+            rows, columns = np.nonzero(correlation >= threshold)
+            if len(rows) == 0:
+                continue
+            histogram += np.bincount(np.abs((columns + j) - (rows + i)), minlength=len(histogram))
+            if min_matches is not None and histogram.max() >= min_matches:
+                return histogram, True
+    matched = min_matches is not None and len(histogram) > 0 and histogram.max() >= min_matches
+    return histogram, matched
+
+
+def _file_spectra(filename):
+    """Read a file (WAVE or MP3) mixed down to mono, and return the
+    normalised spectra of its chunks. The chunk size depends on the
+    sample rate, so each chunk is the same amount of time."""
+    input_file = InputFile(filename)
+    try:
+        chunk_size = input_file.get_sample_rate() // CHUNKS_PER_SECOND
+        chunks = []
+        while True:
+            samples = input_file.get_mono_samples(CORRELATION_TILE * chunk_size)
+            chunks.append(normalize_spectra(chunk_spectra(samples, chunk_size)))
+            if len(samples) < CORRELATION_TILE * chunk_size:
+                break
+    finally:
+        input_file.close()
+    return np.concatenate(chunks)
+
+
+def correlate_files(filename1, filename2, threshold=CORRELATION_THRESHOLD, min_matches=CORRELATION_MIN_MATCHES):
+    """Compare two files by the correlation of their chunk spectra.
+    This is slower than the fingerprints of Matcher, but compares
+    whole spectra instead of a few loud frequencies.
+    @return A CorrelationResult, or a FileErrorResult if a file could not be read"""
+    try:
+        a = _file_spectra(filename1)
+        b = _file_spectra(filename2)
+    except Exception as e:
+        return FileErrorResult(str(e))
+
+    histogram, matched = offset_histogram(a, b, threshold, min_matches)
+    offset = int(histogram.argmax()) if len(histogram) else 0
+    count = int(histogram[offset]) if len(histogram) else 0
+    return CorrelationResult(filename1, filename2, matched, offset, count)
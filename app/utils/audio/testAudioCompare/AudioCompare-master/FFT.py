@@ -1,6 +1,12 @@
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import time
 
+# Number of frames put through rfft at a time by specgram()
+SPECGRAM_BLOCK = 4096
+# Number of chunks of audio samples read at a time by blocks()
+SERIES_BLOCK_CHUNKS = 2048
+
 
 class FFT:
     """A mechanism for identifying the dominant frequencies
@@ -24,21 +30,77 @@ class FFT:
         @param f The number of frequency values to return per chunk. -1 means all. Must be positive number
         less than chunk size otherwise."""
 
+        blocks = list(self.blocks(chunks))
+        if not blocks:
+            return np.zeros((0, self.chunk_size//2 + 1), np.float32)
+        return np.concatenate(blocks)
+
+    def blocks(self, chunks=-1, block_chunks=SERIES_BLOCK_CHUNKS):
+        """Generate the rows of series() a block at a time. At most
+        block_chunks chunks of audio samples are read at once, so
+        memory use doesn't depend on the length of the file, and files
+        whose length isn't known in advance (decoded MP3) can be used.
+        @param chunks As in series()"""
+        noverlap = self.chunk_size/self.overlap_ratio
+        step = self.chunk_size - noverlap
         if chunks == -1:
-            chunks = self.input_file.get_total_samples() / self.chunk_size
-
-        # get all the audio samples we'll be working with
-        samples = self.input_file.get_audio_samples(chunks * self.chunk_size)
-        # mix those samples down into one channel
-        samples = samples.mean(axis=0)
-        result = self.specgram(samples, NFFT=self.chunk_size,
-                               window=FFT.__window_hanning,
-                               noverlap=self.chunk_size/self.overlap_ratio)
-        result = result.transpose()
-        return result
+            remaining = None
+        else:
+            remaining = chunks * self.chunk_size
+
+        # samples that belong to frames of the next block
+        carry = np.zeros(0, np.float32)
+        while remaining is None or remaining > 0:
+            wanted = block_chunks * self.chunk_size
+            if remaining is not None:
+                wanted = min(wanted, remaining)
+                remaining -= wanted
+            # get the next audio samples we'll be working with,
+            # mixed down into one channel
+            samples = self.input_file.get_mono_samples(wanted)
+            end_of_file = len(samples) < wanted
+            if end_of_file:
+                # only whole chunks are used
+                samples = samples[:len(samples) - len(samples) % self.chunk_size]
+
+            x = np.concatenate((carry, samples))
+            frames = max(0, (len(x) - self.chunk_size) // step + 1)
+            if frames > 0:
+                result = self.specgram(x[:(frames - 1) * step + self.chunk_size], NFFT=self.chunk_size,
+                                       window=FFT.__window_hanning,
+                                       noverlap=noverlap)
+                yield result.transpose()
+            carry = x[frames * step:]
+            if end_of_file:
+                break
 
     def specgram(self, x, NFFT, window, noverlap):
-        """Compute a spectrogram of the given audio samples.
+        """Compute a power spectrogram of the given audio samples.
+        Returns a real float32 array of shape (NFFT//2 + 1, frames),
+        with the same values as specgram_loop().
+
+        The overlapping frames are a strided view of x. They are
+        windowed and put through rfft a block of SPECGRAM_BLOCK
+        frames at a time, which bounds the temporary memory."""
+
+        numFreqs = NFFT//2 + 1
+        windowVals = window(np.ones((NFFT,), x.dtype))
+
+        step = NFFT - noverlap
+        n = max(0, (len(x) - NFFT) // step + 1)
+        Pxx = np.empty((numFreqs, n), np.float32)
+
+        x = np.ascontiguousarray(x)
+        frames = as_strided(x, shape=(n, NFFT), strides=(x.strides[0] * step, x.strides[0]))
+        for start in xrange(0, n, SPECGRAM_BLOCK):
+            fx = np.fft.rfft(frames[start:start + SPECGRAM_BLOCK] * windowVals, n=NFFT, axis=1)
+            Pxx[:, start:start + len(fx)] = (fx.real ** 2 + fx.imag ** 2).T
+
+        return Pxx
+
+    def specgram_loop(self, x, NFFT, window, noverlap):
+        """Compute a spectrogram of the given audio samples,
+        one window at a time. Kept as the reference for specgram().
 
         This is a stripped-down version of the code inside
         matplotlib.mlab.specgram().
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import os
+import stat
+import sqlite3
+import multiprocessing
+import numpy as np
+from argparse import ArgumentParser
+from error import *
+from Matcher import FileResult, FingerprintIndex, MatchResult, SCORE_THRESHOLD
+from Matcher import _file_fingerprint, _report_file_matches
+
+
+class FingerprintDB(object):
+    """A library of audio file fingerprints kept in an SQLite file,
+    so that every file in the library is decoded and fingerprinted
+    only once. For each file we store its absolute path, modification
+    time and size, its length in seconds and its fingerprints as a
+    little endian uint32 array. A file is fingerprinted again when
+    its modification time or size changes."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, "
+            "mtime REAL NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "file_len INTEGER NOT NULL, "
+            "fingerprints BLOB NOT NULL)")
+        self.connection.commit()
+        self.__index = None
+
+    @staticmethod
+    def __stat(filename):
+        file_stat = os.stat(filename)
+        return file_stat.st_mtime, file_stat.st_size
+
+    def __is_current(self, filename, file_stat):
+        row = self.connection.execute(
+            "SELECT mtime, size FROM files WHERE path = ?", (filename,)).fetchone()
+        return row is not None and tuple(row) == file_stat
+
+    def add(self, filenames):
+        """Fingerprint the given files, unless they are already
+        in the library and have not changed, and store them.
+        Returns the FileErrorResults of files that could not
+        be fingerprinted."""
+        filenames = [os.path.abspath(f) for f in filenames]
+        stats = dict((f, FingerprintDB.__stat(f)) for f in filenames)
+        stale = [f for f in filenames if not self.__is_current(f, stats[f])]
+
+        if len(stale) > 1:
+            pool = multiprocessing.Pool()
+            try:
+                results = pool.map(_file_fingerprint, stale)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_file_fingerprint, stale)
+
+        errors = []
+        for filename, result in zip(stale, results):
+            if not result.success:
+                errors.append(result)
+                continue
+            mtime, size = stats[filename]
+            fingerprints = result.fingerprints.astype("<u4").tostring()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (filename, mtime, size, result.file_len, sqlite3.Binary(fingerprints)))
+        self.connection.commit()
+        if stale:
+            self.__index = None
+        return errors
+
+    def remove(self, filenames):
+        """Remove the given files from the library."""
+        for filename in filenames:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(filename),))
+        self.connection.commit()
+        self.__index = None
+
+    def files(self):
+        """Returns a FileResult for every file in the library."""
+        rows = self.connection.execute("SELECT path, file_len, fingerprints FROM files ORDER BY path")
+        return [FileResult(np.frombuffer(fingerprints, dtype="<u4"), file_len, path)
+                for path, file_len, fingerprints in rows]
+
+    def index(self):
+        """Returns a FingerprintIndex of the non-empty files in the
+        library and a hash mapping their filenames to their lengths.
+        The index is kept until the library changes."""
+        if self.__index is None:
+            files = [f for f in self.files() if f.file_len > 0]
+            file_lengths = dict((f.filename, f.file_len) for f in files)
+            self.__index = (FingerprintIndex(files), file_lengths)
+        return self.__index
+
+    def query(self, filename):
+        """Compare one file against every file in the library.
+        Only the query file is fingerprinted.
+        @return A list of MatchResult objects, or a list holding
+        a FileErrorResult if the file could not be fingerprinted"""
+        result = _file_fingerprint(os.path.abspath(filename))
+        if not result.success:
+            return [result]
+
+        # Empty files only match other empty files, as in Matcher.match()
+        if result.file_len == 0:
+            return [MatchResult(result.filename, f.filename, 0, 0, SCORE_THRESHOLD + 1)
+                    for f in self.files() if f.file_len == 0]
+
+        index, file_lengths = self.index()
+        return _report_file_matches(result, index, file_lengths)
+
+    def close(self):
+        self.connection.close()
+
+
+def _expand(paths):
+    """Turn a list of files and directories into a list
+    of the regular files they contain (non-recursively)."""
+    results = []
+    for path in paths:
+        if os.path.isdir(path):
+            for node in sorted(os.listdir(path)):
+                node = os.path.join(path, node)
+                if stat.S_ISREG(os.stat(node).st_mode):
+                    results.append(node)
+        else:
+            results.append(path)
+    return results
+
+
+def fingerprint_db():
+    """Manage a fingerprint library and query it."""
+    parser = ArgumentParser(
+        description="Keep the fingerprints of a library of audio files "
+                    "and compare single files against the whole library.",
+        prog="FingerprintDB.py")
+    parser.add_argument("db", help="The SQLite file holding the library.")
+    parser.add_argument("command", choices=["add", "remove", "query"])
+    parser.add_argument("paths", nargs="+",
+                        help="Files or directories to add or remove, or files to query.")
+    args = parser.parse_args()
+
+    db = FingerprintDB(args.db)
+    code = 0
+    try:
+        if args.command == "add":
+            for error in db.add(_expand(args.paths)):
+                code = 1
+                warn(error.message)
+        elif args.command == "remove":
+            db.remove(_expand(args.paths))
+        else:
+            for path in args.paths:
+                for match in db.query(path):
+                    if not match.success:
+                        code = 1
+                        warn(match.message)
+                    else:
+                        print(match)
+    finally:
+        db.close()
+    return code
+
+if __name__ == "__main__":
+    exit(fingerprint_db())
@@ -1,10 +1,13 @@
 import struct
 import numpy as np
-import tempfile
-import shutil
 import subprocess 
 import os
-import time
+
+# Number of frames mixed down to mono at a time
+MIX_BLOCK = 65536
+
+# The LAME program used to decode MP3 files
+LAME = os.path.dirname(os.path.abspath(__file__)) + "/lame"
 
 
 class InputFile:
@@ -12,60 +15,63 @@ class InputFile:
     def __init__(self, filename):
         """Open an Audio file with the given file path.
         Supported formats: WAVE, MP3.
-        All MP3 files will be converted to WAVE using the LAME program
+        All MP3 files are decoded with the LAME program, which
+        writes WAVE data to a pipe that we read from as samples are
+        needed; no decoded copy of the file is written to disk.
 
         This document http://www-mmsp.ece.mcgill.ca/documents/AudioFormats/WAVE/WAVE.html
         was used as a spec for files. We implement a limited subset
-        of the WAVE format. We assume a RIFF chunk contains a fmt
-        chunk and then a data chunk, and do not read past that.
+        of the WAVE format. We walk the chunks of the RIFF chunk until
+        we find the data chunk, skipping chunks we don't use (LIST, fact, ...),
+        and do not read past that.
         We also will only open WAVE_FORMAT_PCM files.
 
-        At the end of this constructor. self.wav_file will be positioned
-        at the first byte of audio data in the file."""
-        lame = os.path.dirname(os.path.abspath(__file__)) + "/lame"
-
-        original_name = filename
+        The data chunk of a WAVE file is memory-mapped, so samples are
+        only read from disk when they are used. At the end of this
+        constructor, self.wav_file will be positioned at the first
+        byte of audio data in the file (or in the decoder's output)."""
         self.wav_file = open( filename, "r" )
-        #try to use lame to convert
-        self.workingdir = tempfile.mkdtemp()
+        self.decoder = None
+        self.samples = None
+        self.position = 0
 
         if  not self.__is_wave_file( self.wav_file ):   
             self.wav_file.close()
-            canonical_form = self.workingdir + str( time.time() )
-            
-            #make sure the filename has a ".mp3" extension before sending to lame
-            if filename[-4:] != ".mp3" :
-                # create a copy of the file in                 
-                temp_file_name =  self.workingdir + str(time.time()) + ".mp3" 
-                shutil.copyfile( filename, temp_file_name )
-                filename = temp_file_name
-            # Use lame to make a wav representation of the mp3 file to be analyzed
-            lame = [lame, '--silent', '--decode', filename, canonical_form]
-            return_code = subprocess.call(lame, shell=False)
-            
-            if return_code != 0 or not os.path.exists(canonical_form):
-                raise IOError("{f} 's format is not supported".format(f=original_name))
-            
-            # At this point, we should be confident that "lame" create a correct WAVE file
-            self.wav_file = open( canonical_form , "r")
-            
-       # At this point, audio file should have the canonical form(WAVE)    
-        self.wav_file.seek(4,0)
-        riff_size = InputFile.__read_size(self.wav_file)
-
-        self.wav_file.seek(16,0)
-        fmt_chunk_size = InputFile.__read_size(self.wav_file)
-        fmt_data = self.wav_file.read(fmt_chunk_size)
+            # --mp3input makes lame decode the file whatever its extension is,
+            # and "-" sends the decoded WAVE data to standard output
+            with open(os.devnull, "w") as devnull:
+                self.decoder = subprocess.Popen([LAME, '--silent', '--mp3input', '--decode', filename, '-'],
+                                                stdout=subprocess.PIPE, stderr=devnull)
+            self.wav_file = self.decoder.stdout
+            fmt_data = InputFile.__read_stream_header(self.wav_file)
+            if fmt_data is None or not InputFile.__check_fmt_valid(fmt_data[0:2]):
+                self.close()
+                raise IOError("{f} 's format is not supported".format(f=filename))
+        else:
+            # At this point, audio file should have the canonical form(WAVE)    
+            chunks = InputFile.__read_chunks(self.wav_file)
+
+            fmt_offset, fmt_chunk_size = chunks["fmt "]
+            self.wav_file.seek(fmt_offset, 0)
+            fmt_data = self.wav_file.read(fmt_chunk_size)
         
         # get some info from the file header
         self.channels = self.__read_ushort(fmt_data[2:4])
         self.sample_rate = self.__read_uint(fmt_data[4:8])
         self.block_align = self.__read_ushort(fmt_data[12:14])
 
-        self.wav_file.seek( 40 , 0 )
-        self.data_chunk_size = InputFile.__read_size(self.wav_file)
+        if self.decoder is not None:
+            # The length of decoded data is only known once we reach
+            # the end of it, so we count samples as we read them
+            self.total_samples = 0
+            return
+
+        self.data_offset, self.data_chunk_size = chunks["data"]
         self.total_samples = (self.data_chunk_size / self.block_align)
 
+        self.samples = self.__map_samples()
+        self.wav_file.seek(self.data_offset, 0)
+
     @staticmethod
     def __is_wave_file(file):
 
@@ -73,15 +79,15 @@ class InputFile:
             return False 
         if ( not InputFile.__check_wave_id(file) ):
             return False
-        if ( not InputFile.__check_fmt(file) ):
+
+        chunks = InputFile.__read_chunks(file)
+        if "fmt " not in chunks or "data" not in chunks:
             return False
 
-        file.seek( 20 )
+        file.seek( chunks["fmt "][0] )
         data = file.read( 2 ) 
         file.seek( 0 )
-        if( not InputFile.__check_fmt_valid(data) ):
-            return False        
-        return  InputFile.__check_data(file)
+        return InputFile.__check_fmt_valid(data)
     
     @staticmethod
     def __check_riff_format(file):
@@ -97,18 +103,49 @@ class InputFile:
         return WAVE == "WAVE"
 
     @staticmethod
-    def __check_fmt(file):
-        file.seek(12)
-        fmt = file.read(4)
+    def __read_chunks(file):
+        """Walk the chunks inside the RIFF chunk, up to and
+        including the data chunk. Returns a dict mapping chunk ids
+        to (offset of the chunk contents, size of the contents)."""
+        chunks = {}
+        file.seek(0, 2)
+        file_size = file.tell()
+        offset = 12
+        while offset + 8 <= file_size:
+            file.seek(offset)
+            chunk_id = file.read(4)
+            size = InputFile.__read_size(file)
+            chunks[chunk_id] = (offset + 8, size)
+            if chunk_id == "data":
+                break
+            # chunks are padded to an even number of bytes
+            offset += 8 + size + (size & 1)
         file.seek(0)
-        return fmt == "fmt "
+        return chunks
 
     @staticmethod
-    def __check_data(file):
-        file.seek(36)
-        data = file.read(4)
-        file.seek(0)
-        return data == "data"
+    def __read_stream_header(stream):
+        """Read the header of WAVE data from a stream that can't seek,
+        up to the start of the data chunk. Returns the contents of the
+        fmt chunk, or None if the stream doesn't hold WAVE data."""
+        header = stream.read(12)
+        if len(header) < 12 or header[0:4] != "RIFF" or header[8:12] != "WAVE":
+            return None
+        fmt_data = None
+        while True:
+            chunk_header = stream.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id = chunk_header[0:4]
+            size = InputFile.__read_uint(chunk_header[4:8])
+            if chunk_id == "data":
+                # the size of the data chunk can't be trusted,
+                # a decoder writing to a pipe doesn't know it yet
+                return fmt_data
+            # chunks are padded to an even number of bytes
+            contents = stream.read(size + (size & 1))
+            if chunk_id == "fmt ":
+                fmt_data = contents[:size]
 
     @staticmethod
     def __check_fmt_valid(data):
@@ -130,22 +167,52 @@ class InputFile:
         """Turn a 4-byte little endian number into a Python number."""
         return struct.unpack("<I", data)[0]
 
+    def __map_samples(self):
+        """Memory-map the data chunk as a (frames, channels) int16 array.
+        A data chunk that claims to be longer than the file is cut
+        at the end of the file."""
+        file_size = os.fstat(self.wav_file.fileno()).st_size
+        frames = min(self.data_chunk_size, file_size - self.data_offset) // self.block_align
+        if frames <= 0:
+            return np.zeros((0, self.channels), dtype=np.int16)
+        return np.memmap(self.wav_file, dtype="<i2", mode="r", offset=self.data_offset,
+                         shape=(frames, self.channels))
+
+    def __next_frames(self, n):
+        if self.decoder is None:
+            frames = self.samples[self.position:self.position + n]
+        else:
+            data = self.wav_file.read(n * self.block_align)
+            frames = np.frombuffer(data, dtype="<i2", count=len(data) // self.block_align * self.channels)
+            frames = frames.reshape(-1, self.channels)
+            self.total_samples += len(frames)
+            if len(frames) < n and self.decoder.wait() != 0:
+                raise IOError("lame could not decode the whole file")
+        self.position += len(frames)
+        return frames
+
     def get_audio_samples(self, n):
         """Get n audio samples from each channel.
-        Returns an array of arrays. There will be one
-        array for each channel, each with n samples in it.
+        Returns a (channels, n) int16 array. The rows are
+        views into the memory-mapped file, nothing is copied.
         If we encounter end of file, we may return less than
-        n samples. If we were already at end of file, we raise
-        EOFError.
-
-        This function assumes that self.wav_file is positioned
-        at the place in the file you want to read from."""
-        data = np.fromfile(self.wav_file, dtype=np.int16, count=n*self.channels)
-        result = np.zeros((self.channels, n), dtype=int)
-        for c in range(self.channels):
-            result[c] = data[c::self.channels]
-
-        return result
+        n samples.
+
+        Samples are read starting after the last sample
+        returned by get_audio_samples() or get_mono_samples()."""
+        return self.__next_frames(n).T
+
+    def get_mono_samples(self, n):
+        """Get n audio samples, mixed down to one float32 channel
+        by averaging the channels. The mix is done a block at a time,
+        so the only array allocated is the result."""
+        frames = self.__next_frames(n)
+        mono = np.empty(len(frames), dtype=np.float32)
+        for start in xrange(0, len(frames), MIX_BLOCK):
+            block = frames[start:start + MIX_BLOCK]
+            np.sum(block, axis=1, dtype=np.float32, out=mono[start:start + MIX_BLOCK])
+        mono /= self.channels
+        return mono
 
     def get_channels(self):
         """Returns the number of channels in the file."""
@@ -161,13 +228,18 @@ class InputFile:
         return self.sample_rate
 
     def get_total_samples(self):
-        """Returns the total number of samples per channel."""
+        """Returns the total number of samples per channel.
+        For decoded MP3 files this is the number of samples
+        read so far, which is the total once all samples
+        have been read."""
         return self.total_samples
 
     def close(self):
         """Close the input file."""
         self.wav_file.close()
-        #Delete temporary working directory and its contents.
-        shutil.rmtree(self.workingdir)
+        if self.decoder is not None and self.decoder.poll() is None:
+            # we stopped reading before the end of the decoded data
+            self.decoder.kill()
+            self.decoder.wait()
     
 
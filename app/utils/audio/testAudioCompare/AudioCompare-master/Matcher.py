@@ -2,11 +2,11 @@ import math
 import itertools
 from FFT import FFT
 import numpy as np
-from collections import defaultdict
 from InputFile import InputFile
 import multiprocessing
 import os
 import stat
+import time
 from error import *
 from common import *
 
@@ -15,6 +15,8 @@ BUCKET_SIZE = 20
 BUCKETS = 4
 BITS_PER_NUMBER = int(math.ceil(math.log(BUCKET_SIZE, 2)))
 assert((BITS_PER_NUMBER * BUCKETS) <= 32)
+# How far the loudest index of each bucket is shifted in a fingerprint
+BUCKET_SHIFTS = np.arange(BUCKETS, dtype=np.uint32) * BITS_PER_NUMBER
 
 NORMAL_CHUNK_SIZE = 1024
 NORMAL_SAMPLE_RATE = 44100.0
@@ -36,9 +38,10 @@ class FileResult(BaseResult):
 
 
 class ChunkInfo(object):
-    """These objects will be the values in
-    our master hashes that map fingerprints
-    to instances of this class."""
+    """A chunk of a file that has a given fingerprint,
+    as returned by FingerprintIndex.chunks()."""
+    __slots__ = ("chunk_index", "filename")
+
     def __init__(self, chunk_index, filename):
         self.chunk_index = chunk_index
         self.filename = filename
@@ -47,6 +50,83 @@ class ChunkInfo(object):
         return "Chunk: {c}, File: {f}".format(c=self.chunk_index, f=self.filename)
 
 
+class FingerprintIndex(object):
+    """Maps fingerprints to the chunks of the files they occur in.
+    Instead of a hash of lists of ChunkInfo objects, all
+    (fingerprint, file id, chunk index) triples are kept in
+    three parallel numpy arrays sorted by fingerprint, and
+    lookups are binary searches."""
+    def __init__(self, files):
+        """@param files A list of FileResult objects"""
+        # Files with the same name share an id
+        ids = {}
+        for f in files:
+            ids.setdefault(f.filename, len(ids))
+        self.filenames = sorted(ids, key=ids.get)
+        lengths = [len(f.fingerprints) for f in files]
+        fingerprints = np.concatenate([f.fingerprints for f in files] + [np.zeros(0, np.uint32)])
+        file_ids = np.repeat(np.array([ids[f.filename] for f in files], dtype=np.int32), lengths)
+        chunk_indices = np.concatenate([np.arange(n, dtype=np.int32) for n in lengths] + [np.zeros(0, np.int32)])
+
+        # A stable sort keeps the chunks of each fingerprint
+        # in file order, then chunk order
+        order = np.argsort(fingerprints, kind="mergesort")
+        self.fingerprints = fingerprints[order].astype(np.uint32)
+        self.file_ids = file_ids[order]
+        self.chunk_indices = chunk_indices[order]
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, fingerprint):
+        i = np.searchsorted(self.fingerprints, fingerprint)
+        return i < len(self.fingerprints) and self.fingerprints[i] == fingerprint
+
+    def lookup(self, fingerprint):
+        """Returns two arrays, the file ids and the chunk
+        indices of every chunk with the given fingerprint."""
+        start = np.searchsorted(self.fingerprints, fingerprint, side="left")
+        end = np.searchsorted(self.fingerprints, fingerprint, side="right")
+        return self.file_ids[start:end], self.chunk_indices[start:end]
+
+    def max_offset_counts(self, query):
+        """For every file in the index, count the matching fingerprints
+        at each offset (chunk index in the file minus chunk index in
+        the query), and return the highest count per file as an
+        array indexed by file id.
+        @param query The fingerprints of the query file"""
+        query = np.asarray(query, dtype=np.uint32)
+        starts = np.searchsorted(self.fingerprints, query, side="left")
+        ends = np.searchsorted(self.fingerprints, query, side="right")
+        counts = ends - starts
+        total = counts.sum()
+        result = np.zeros(len(self.filenames), dtype=np.int64)
+        if total == 0:
+            return result
+
+        # Expand the [start, end) ranges into the positions of all
+        # matching chunks, with the query chunk each one matched
+        query_chunks = np.repeat(np.arange(len(query), dtype=np.int64), counts)
+        first = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        positions = first + np.arange(total)
+        file_ids = self.file_ids[positions].astype(np.int64)
+        offsets = self.chunk_indices[positions] - query_chunks
+
+        # One key per (file, offset) pair; the keys of a file are contiguous
+        span = int(self.chunk_indices.max()) + len(query) + 1
+        keys, key_counts = np.unique(file_ids * span + offsets + len(query), return_counts=True)
+        key_files = keys // span
+        boundaries = np.flatnonzero(np.diff(key_files)) + 1
+        group_starts = np.concatenate(([0], boundaries))
+        result[key_files[group_starts]] = np.maximum.reduceat(key_counts, group_starts)
+        return result
+
+    def chunks(self, fingerprint):
+        """Returns ChunkInfo objects for the chunks with the given fingerprint."""
+        file_ids, chunk_indices = self.lookup(fingerprint)
+        return [ChunkInfo(int(c), self.filenames[f]) for f, c in zip(file_ids, chunk_indices)]
+
+
 class MatchResult(BaseResult):
     """The result of comparing two files."""
     def __init__(self, file1, file2, file1_len, file2_len, score):
@@ -75,7 +155,22 @@ def _to_fingerprints(freq_chunks):
     that are loudest in each "bucket." A bucket is a series of
     frequencies. Return the indices of the loudest frequency in each
     bucket in each chunk. These indices will be encoded into
-    a single number per chunk."""
+    a single number per chunk.
+
+    All chunks are done at once: the first BUCKETS * BUCKET_SIZE
+    frequencies are viewed as a (chunks, BUCKETS, BUCKET_SIZE) array,
+    and the loudest indices are packed with BUCKET_SHIFTS."""
+    freq_chunks = np.asarray(freq_chunks)
+    chunks = len(freq_chunks)
+    buckets = freq_chunks[:, :BUCKETS * BUCKET_SIZE].reshape(chunks, BUCKETS, BUCKET_SIZE)
+    winners = buckets.argmax(axis=2).astype(np.uint32)
+    # each index has its own bits, so adding them is the same as or-ing them
+    return (winners << BUCKET_SHIFTS).sum(axis=1, dtype=np.uint32)
+
+
+def _to_fingerprints_loop(freq_chunks):
+    """The chunk-by-chunk version of _to_fingerprints().
+    Kept as the reference it is tested against."""
     chunks = len(freq_chunks)
     fingerprints = np.zeros(chunks, dtype=np.uint32)
     # Examine each chunk independently
@@ -93,44 +188,86 @@ def _to_fingerprints(freq_chunks):
     return fingerprints
 
 
-def _file_fingerprint(filename):
+class _TimedInputFile(object):
+    """Wraps an InputFile, adding up the time spent reading samples."""
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.elapsed = 0.0
+
+    def get_mono_samples(self, n):
+        start = time.time()
+        samples = self.input_file.get_mono_samples(n)
+        self.elapsed += time.time() - start
+        return samples
+
+    def __getattr__(self, name):
+        return getattr(self.input_file, name)
+
+
+def _file_fingerprint(filename, times=None):
     """Read the samples from the files, run them through FFT,
     find the loudest frequencies to use as fingerprints,
     turn those into a hash table.
     Returns a 2-tuple containing the length
-    of the file in seconds, and the hash table."""
+    of the file in seconds, and the hash table.
+    @param times If given, a hash in which the seconds spent
+    in each stage are stored: "decode" (opening the file and
+    reading samples), "fft" (FFT.blocks() without the reading)
+    and "fingerprint" (_to_fingerprints())"""
 
     # Open the file
     try:
+        start = time.time()
         file = InputFile(filename)
+        opened = time.time() - start
+        if times is not None:
+            file = _TimedInputFile(file)
 
-        # Read samples from the input files, divide them
-        # into chunks by time, and convert the samples in each
-        # chunk into the frequency domain.
-        # The chunk size is dependent on the sample rate of the
-        # file. It is important that each chunk represent the
-        # same amount of time, regardless of the sample
-        # rate of the file.
-        chunk_size_adjust_factor = (NORMAL_SAMPLE_RATE / file.get_sample_rate())
-        fft = FFT(file, int(NORMAL_CHUNK_SIZE / chunk_size_adjust_factor))
-        series = fft.series()
-
-        file_len = file.get_total_samples() / file.get_sample_rate()
-
-        file.close()
-
-        # Find the indices of the loudest frequencies
-        # in each "bucket" of frequencies (for every chunk).
-        # These loud frequencies will become the
-        # fingerprints that we'll use for matching.
-        # Each chunk will be reduced to a tuple of
-        # 4 numbers which are 4 of the loudest frequencies
-        # in that chunk.
-        # Convert each tuple in winners to a single
-        # number. This number is unique for each possible
-        # tuple. This hopefully makes things more
-        # efficient.
-        fingerprints = _to_fingerprints(series)
+        try:
+            # Read samples from the input files, divide them
+            # into chunks by time, and convert the samples in each
+            # chunk into the frequency domain.
+            # The chunk size is dependent on the sample rate of the
+            # file. It is important that each chunk represent the
+            # same amount of time, regardless of the sample
+            # rate of the file.
+            chunk_size_adjust_factor = (NORMAL_SAMPLE_RATE / file.get_sample_rate())
+            fft = FFT(file, int(NORMAL_CHUNK_SIZE / chunk_size_adjust_factor))
+
+            # Find the indices of the loudest frequencies
+            # in each "bucket" of frequencies (for every chunk).
+            # These loud frequencies will become the
+            # fingerprints that we'll use for matching.
+            # Each chunk will be reduced to a tuple of
+            # 4 numbers which are 4 of the loudest frequencies
+            # in that chunk.
+            # Convert each tuple in winners to a single
+            # number. This number is unique for each possible
+            # tuple. This hopefully makes things more
+            # efficient.
+            # The FFT is done a block of the file at a time,
+            # so only the fingerprints of the whole file are kept.
+            fingerprints = [np.zeros(0, dtype=np.uint32)]
+            fingerprint_time = 0.0
+            start = time.time()
+            for block in fft.blocks():
+                block_start = time.time()
+                fingerprints.append(_to_fingerprints(block))
+                fingerprint_time += time.time() - block_start
+            blocks_time = time.time() - start
+            fingerprints = np.concatenate(fingerprints)
+
+            # For decoded MP3 files, the length is known once
+            # all samples have been read
+            file_len = file.get_total_samples() / file.get_sample_rate()
+        finally:
+            # stops the decoder if we fail before the end of the file
+            file.close()
+
+        if times is not None:
+            times["decode"] = opened + file.elapsed
+            times["fft"] = blocks_time - file.elapsed - fingerprint_time
+            times["fingerprint"] = fingerprint_time
 
     except Exception as e:
         return FileErrorResult(e.message)
@@ -138,6 +275,60 @@ def _file_fingerprint(filename):
     return FileResult(fingerprints, file_len, filename)
 
 
+def _report_file_matches(file, master_hash, file_lengths):
+    """Find files from the master hash that match
+    the given file.
+    @param file A FileResult object that is our query
+    @param master_hash The FingerprintIndex to search through
+    @param file_lengths A hash mapping filenames to file lengths
+    @return A list of MatchResult objects, one for every file
+    that was represented in master_hash"""
+
+    results = []
+
+    # For each chunk in the query file, we find the chunks with
+    # the same fingerprint in master_hash, and the difference in
+    # chunk numbers (the "offset") of each of these matches.
+    # For each file, we count the matches found with each offset,
+    # and keep the highest count.
+    # This allows us to see if many fingerprints
+    # from different files occurred at the same
+    # time offsets relative to each other.
+    max_offset_counts = master_hash.max_offset_counts(file.fingerprints)
+    file_ids = dict((f, i) for i, f in enumerate(master_hash.filenames))
+
+    # For each file that was in master_hash,
+    # we examine the offsets of the matching fingerprints we found
+    for f in file_lengths:
+        # The length of the shorter file is important
+        # to deciding whether two audio files match.
+        min_len = min(file_lengths[f], file.file_len)
+
+        # max_offset is the highest number of times that two matching
+        # hash keys were found with the same time difference
+        # relative to each other.
+        if f in file_ids:
+            max_offset = int(max_offset_counts[file_ids[f]])
+        else:
+            max_offset = 0
+
+        # The score is the ratio of max_offset (as explained above)
+        # to the length of the shorter file. A short file that should
+        # match another file will result in less matching fingerprints
+        # than a long file would, so we take this into account. At the
+        # same time, a long file that should *not* match another file
+        # will generate a decent number of matching fingerprints by
+        # pure chance, so this corrects for that as well.
+        if min_len > 0:
+            score = max_offset / min_len
+        else:
+            score = 0
+
+        results.append(MatchResult(file.filename, f, file.file_len, file_lengths[f], score))
+
+    return results
+
+
 class Matcher(object):
     """Create an instance of this class to use our matching system."""
 
@@ -193,15 +384,9 @@ class Matcher(object):
     @staticmethod
     def __combine_hashes(files):
         """Take a list of FileResult objects and
-        create a hash that maps all of their fingerprints
-        to ChunkInfo objects."""
-        master = defaultdict(list)
-        for f in files:
-            for chunk in xrange(len(f.fingerprints)):
-                hash = f.fingerprints[chunk]
-                master[hash].append(ChunkInfo(chunk, f.filename))
-
-        return master
+        create an index that maps all of their fingerprints
+        to the chunks they occur in."""
+        return FingerprintIndex(files)
 
     @staticmethod
     def __file_lengths(files):
@@ -214,74 +399,6 @@ class Matcher(object):
 
         return results
 
-    @staticmethod
-    def __report_file_matches(file, master_hash, file_lengths):
-        """Find files from the master hash that match
-        the given file.
-        @param file A FileResult object that is our query
-        @param master_hash The data to search through
-        @param file_lengths A hash mapping filenames to file lengths
-        @return A list of MatchResult objects, one for every file
-        that was represented in master_hash"""
-
-        results = []
-
-        # A hash that maps filenames to "offset" hashes. Then,
-        # an offset hash maps the difference in chunk numbers of
-        # the matches we will find.
-        # We'll map those differences to the number of matches
-        # found with that difference.
-        # This allows us to see if many fingerprints
-        # from different files occurred at the same
-        # time offsets relative to each other.
-        file_match_offsets = {}
-        for f in file_lengths:
-            file_match_offsets[f] = defaultdict(lambda: 0)
-
-        # For each chunk in the query file
-        for query_chunk_index in xrange(len(file.fingerprints)):
-            # See if that chunk's fingerprint is in our master hash
-            chunk_fingerprint = file.fingerprints[query_chunk_index]
-            if chunk_fingerprint in master_hash:
-                # If it is, record the offset between our query chunk
-                # and the found chunk
-                for matching_chunk in master_hash[chunk_fingerprint]:
-                    offset = matching_chunk.chunk_index - query_chunk_index
-                    file_match_offsets[matching_chunk.filename][offset] += 1
-
-        # For each file that was in master_hash,
-        # we examine the offsets of the matching fingerprints we found
-        for f in file_match_offsets:
-            offsets = file_match_offsets[f]
-
-            # The length of the shorter file is important
-            # to deciding whether two audio files match.
-            min_len = min(file_lengths[f], file.file_len)
-
-            # max_offset is the highest number of times that two matching
-            # hash keys were found with the same time difference
-            # relative to each other.
-            if len(offsets) != 0:
-                max_offset = max(offsets.viewvalues())
-            else:
-                max_offset = 0
-
-            # The score is the ratio of max_offset (as explained above)
-            # to the length of the shorter file. A short file that should
-            # match another file will result in less matching fingerprints
-            # than a long file would, so we take this into account. At the
-            # same time, a long file that should *not* match another file
-            # will generate a decent number of matching fingerprints by
-            # pure chance, so this corrects for that as well.
-            if min_len > 0:
-                score = max_offset / min_len
-            else:
-                score = 0
-
-            results.append(MatchResult(file.filename, f, file.file_len, file_lengths[f], score))
-
-        return results
-
     def match(self):
         """Takes two AbstractInputFiles as input,
         and returns a boolean as output, indicating
@@ -378,7 +495,7 @@ class Matcher(object):
             # same time difference relative to each
             # other. This indicates that the two files
             # contain similar audio.
-            file_matches = Matcher.__report_file_matches(file, master_hash, file_lengths)
+            file_matches = _report_file_matches(file, master_hash, file_lengths)
             results.extend(file_matches)
 
         return results
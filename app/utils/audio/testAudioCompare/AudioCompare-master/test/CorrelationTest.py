@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from Correlation import chunk_spectra, normalize_spectra, offset_histogram, correlate_files
+from WavFile import write_wav
+
+
+def loop_histogram(a, b, threshold=0.9):
+    """The pair-by-pair np.corrcoef loop of similaritywav.py, without stopping early."""
+    diffs = np.zeros(max(len(a), len(b)), dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        for i in xrange(len(a)):
+            for j in xrange(len(b)):
+                if np.corrcoef(a[i], b[j])[0][1] >= threshold:
+                    diffs[abs(j - i)] += 1
+    return diffs
+
+
+class CorrelationTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.randint(-10000, 10000, 882 * 60).astype(np.int16)
+        # y holds a noisy copy of part of x, 7 chunks later
+        self.y = rng.randint(-10000, 10000, 882 * 50).astype(np.int16)
+        noise = rng.randint(-1500, 1500, 882 * 30)
+        self.y[882 * 17:882 * 47] = self.x[882 * 10:882 * 40] + noise
+        # and some silence
+        self.y[:882 * 3] = 0
+
+    def testSameAsCorrcoef(self):
+        a = chunk_spectra(self.x, 882)
+        b = chunk_spectra(self.y, 882)
+        expected = loop_histogram(a, b)
+        self.assertEqual(expected[7], 30)
+        for tile in [7, 1024]:
+            histogram, matched = offset_histogram(normalize_spectra(a), normalize_spectra(b),
+                                                  min_matches=None, tile=tile)
+            self.assertTrue(np.array_equal(histogram, expected))
+            self.assertFalse(matched)
+
+    def testStopEarly(self):
+        a = normalize_spectra(chunk_spectra(self.x, 882))
+        b = normalize_spectra(chunk_spectra(self.y, 882))
+        histogram, matched = offset_histogram(a, b, min_matches=10, tile=4)
+        self.assertTrue(matched)
+        self.assertTrue(10 <= histogram[7] < 30)
+        histogram, matched = offset_histogram(a, b, min_matches=31)
+        self.assertFalse(matched)
+        self.assertEqual(histogram[7], 30)
+
+    def testEmpty(self):
+        a = normalize_spectra(chunk_spectra(self.x[:100], 882))
+        b = normalize_spectra(chunk_spectra(self.y, 882))
+        self.assertEqual(len(a), 0)
+        histogram, matched = offset_histogram(a, b)
+        self.assertFalse(matched)
+        self.assertEqual(histogram.sum(), 0)
+
+    def testFiles(self):
+        workingdir = tempfile.mkdtemp()
+        try:
+            write_wav(os.path.join(workingdir, "x.wav"), self.x)
+            write_wav(os.path.join(workingdir, "y.wav"), self.y)
+            write_wav(os.path.join(workingdir, "z.wav"), self.y[::-1])
+            result = correlate_files(os.path.join(workingdir, "x.wav"), os.path.join(workingdir, "y.wav"))
+            self.assertTrue(result.success)
+            self.assertTrue(result.matched)
+            self.assertEqual(result.offset, 7)
+            result = correlate_files(os.path.join(workingdir, "x.wav"), os.path.join(workingdir, "z.wav"))
+            self.assertFalse(result.matched)
+            self.assertEqual(str(result), "NO MATCH")
+            result = correlate_files(os.path.join(workingdir, "x.wav"), os.path.join(workingdir, "none.wav"))
+            self.assertFalse(result.success)
+        finally:
+            shutil.rmtree(workingdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import FingerprintDB as fingerprint_db
+from FingerprintDB import FingerprintDB
+from Matcher import Matcher
+from WavFile import write_wav
+
+
+class FingerprintDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workingdir = tempfile.mkdtemp()
+        self.libdir = os.path.join(self.workingdir, "lib")
+        os.mkdir(self.libdir)
+        rng = np.random.RandomState(0)
+        t = np.arange(44100 * 3) / 44100.0
+        self.songs = []
+        for i in range(3):
+            samples = 8000 * np.sin(2 * np.pi * (300 + 200 * i) * t * (1 + t * i)) + 500 * rng.randn(len(t))
+            filename = os.path.join(self.libdir, "song%d.wav" % i)
+            write_wav(filename, samples)
+            self.songs.append(filename)
+        self.db = FingerprintDB(os.path.join(self.workingdir, "fingerprints.db"))
+        self.assertEqual(self.db.add(self.songs), [])
+
+    def results(self, results):
+        return sorted((r.file1, r.file2, r.score) for r in results)
+
+    def testQueryMatchesMatcher(self):
+        for song in self.songs:
+            expected = self.results(Matcher(song, self.libdir).match())
+            self.assertEqual(self.results(self.db.query(song)), expected)
+
+    def testUnchangedFilesAreNotFingerprinted(self):
+        calls = []
+        original = fingerprint_db._file_fingerprint
+        fingerprint_db._file_fingerprint = lambda f: calls.append(f) or original(f)
+        try:
+            self.db.add(self.songs)
+            self.assertEqual(calls, [])
+            write_wav(self.songs[0], np.zeros(44100))
+            os.utime(self.songs[0], (0, 0))
+            self.db.add(self.songs)
+            self.assertEqual(calls, [self.songs[0]])
+        finally:
+            fingerprint_db._file_fingerprint = original
+        lengths = dict((f.filename, f.file_len) for f in self.db.files())
+        self.assertEqual(lengths[self.songs[0]], 1)
+
+    def testRemove(self):
+        self.db.remove(self.songs[1:])
+        self.assertEqual([f.filename for f in self.db.files()], self.songs[:1])
+        self.assertEqual(len(self.db.query(self.songs[1])), 1)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.workingdir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import os
+import numpy as np
+from InputFile import InputFile
+from FFT import FFT
+from collections import defaultdict
+from Matcher import NORMAL_CHUNK_SIZE, NORMAL_SAMPLE_RATE, _to_fingerprints, _to_fingerprints_loop
+from Matcher import FileResult, FingerprintIndex, _file_fingerprint
+
+
+class FingerprintTest(unittest.TestCase):
+    """_to_fingerprints() must give exactly the same fingerprints
+    as the chunk-by-chunk _to_fingerprints_loop()."""
+
+    testDir = os.path.dirname(os.path.abspath(__file__))
+    testDirs = [testDir + "/../test_data/", testDir + "/../test_data/A6/", testDir + "/../../"]
+
+    def assertSameFingerprints(self, freq_chunks, name):
+        expected = _to_fingerprints_loop(freq_chunks)
+        actual = _to_fingerprints(freq_chunks)
+        self.assertEqual(actual.dtype, np.uint32, msg=name)
+        self.assertTrue(np.array_equal(actual, expected), msg=name)
+
+    def testRandomSpectra(self):
+        rng = np.random.RandomState(0)
+        self.assertSameFingerprints(rng.rand(500, 513).astype(np.float32), "random")
+        # ties inside a bucket go to the first index in both versions
+        self.assertSameFingerprints(rng.randint(0, 3, size=(500, 513)).astype(np.float32), "ties")
+
+    def testBlocks(self):
+        """Reading a file a few chunks at a time gives the same series."""
+        for directory in self.testDirs:
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(".wav"):
+                    continue
+                series = []
+                for block_chunks in [3, 2048]:
+                    input_file = InputFile(directory + name)
+                    blocks = list(FFT(input_file, 1024).blocks(block_chunks=block_chunks))
+                    input_file.close()
+                    series.append(np.concatenate(blocks))
+                self.assertTrue(np.array_equal(series[0], series[1]), msg=name)
+
+    def testEmpty(self):
+        self.assertSameFingerprints(np.zeros((0, 513), dtype=np.float32), "empty")
+
+    def testWavFiles(self):
+        for directory in self.testDirs:
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(".wav"):
+                    continue
+                input_file = InputFile(directory + name)
+                chunk_size = int(NORMAL_CHUNK_SIZE / (NORMAL_SAMPLE_RATE / input_file.get_sample_rate()))
+                series = FFT(input_file, chunk_size).series()
+                input_file.close()
+                self.assertSameFingerprints(series, name)
+
+    def testStageTimes(self):
+        """Timing the stages does not change the fingerprints."""
+        for directory in self.testDirs:
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(".wav"):
+                    continue
+                times = {}
+                timed = _file_fingerprint(directory + name, times)
+                untimed = _file_fingerprint(directory + name)
+                self.assertTrue(np.array_equal(timed.fingerprints, untimed.fingerprints), msg=name)
+                self.assertEqual(timed.file_len, untimed.file_len, msg=name)
+                self.assertEqual(sorted(times), ["decode", "fft", "fingerprint"], msg=name)
+
+class FingerprintIndexTest(unittest.TestCase):
+    """FingerprintIndex.max_offset_counts() must agree with
+    counting offsets one match at a time in a hash."""
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        # a small alphabet gives many matches per fingerprint
+        self.files = [FileResult(rng.randint(0, 8, size=n).astype(np.uint32), 1, "f%d" % i)
+                      for i, n in enumerate([300, 1, 0, 450, 300])]
+        self.index = FingerprintIndex(self.files)
+
+    def expectedCounts(self, query):
+        offsets = dict((f.filename, defaultdict(lambda: 0)) for f in self.files)
+        for f in self.files:
+            for query_chunk, fingerprint in enumerate(query):
+                for chunk in np.flatnonzero(f.fingerprints == fingerprint):
+                    offsets[f.filename][chunk - query_chunk] += 1
+        return [max(offsets[name].values()) if offsets[name] else 0
+                for name in self.index.filenames]
+
+    def testLookup(self):
+        file_ids, chunks = self.index.lookup(3)
+        for file_id, chunk in zip(file_ids, chunks):
+            self.assertEqual(self.files[file_id].fingerprints[chunk], 3)
+        self.assertEqual(len(chunks), sum((f.fingerprints == 3).sum() for f in self.files))
+        self.assertFalse(99 in self.index)
+
+    def testMaxOffsetCounts(self):
+        for f in self.files:
+            counts = self.index.max_offset_counts(f.fingerprints)
+            self.assertEqual(list(counts), self.expectedCounts(f.fingerprints))
+
+    def testNoMatches(self):
+        counts = self.index.max_offset_counts(np.array([99, 100], dtype=np.uint32))
+        self.assertEqual(list(counts), [0] * len(self.files))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,13 @@
 import unittest
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+import InputFile as input_file_module
 from InputFile import InputFile
+from FFT import FFT
+import Matcher as matcher_module
 
 
 class InputFileTest(unittest.TestCase):
@@ -23,5 +31,127 @@ class InputFileTest(unittest.TestCase):
     def tearDown(self):
         self.inputFile1.close()
 
+class InputFileChunkTest(unittest.TestCase):
+    """A WAVE file with a LIST chunk between the fmt and data
+    chunks, so the data chunk does not start at byte 36."""
+
+    def setUp(self):
+        self.workingdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workingdir, "list.wav")
+        self.samples = np.arange(-3000, 3000, dtype=np.int16).reshape(-1, 2)
+        data = self.samples.tostring()
+        fmt = struct.pack("<HHIIHH", 1, 2, 44100, 44100 * 4, 4, 16)
+        # odd-sized chunk, followed by a pad byte
+        chunks = "fmt " + struct.pack("<I", len(fmt)) + fmt
+        chunks += "LIST" + struct.pack("<I", 5) + "INFOx" + "\0"
+        chunks += "data" + struct.pack("<I", len(data)) + data
+        with open(self.filename, "wb") as f:
+            f.write("RIFF" + struct.pack("<I", 4 + len(chunks)) + "WAVE" + chunks)
+        self.inputFile = InputFile(self.filename)
+
+    def testFormat(self):
+        self.assertEqual(self.inputFile.get_channels(), 2)
+        self.assertEqual(self.inputFile.get_sample_rate(), 44100)
+        self.assertEqual(self.inputFile.get_total_samples(), len(self.samples))
+
+    def testRead(self):
+        data = self.inputFile.get_audio_samples(1024)
+        self.assertTrue(np.array_equal(data, self.samples[:1024].T))
+        data = self.inputFile.get_audio_samples(len(self.samples))
+        self.assertTrue(np.array_equal(data, self.samples[1024:].T))
+
+    def testMonoSamples(self):
+        mono = self.inputFile.get_mono_samples(len(self.samples))
+        self.assertEqual(mono.dtype, np.float32)
+        self.assertTrue(np.array_equal(mono, self.samples.mean(axis=1)))
+
+    def tearDown(self):
+        self.inputFile.close()
+        shutil.rmtree(self.workingdir)
+
+class InputFileStreamTest(unittest.TestCase):
+    """Non-WAVE files are decoded through a pipe. A fake lame
+    that writes a WAVE file to its standard output, with an unknown
+    data chunk size like a real decoder writing to a pipe, stands in
+    for the real one."""
+
+    def setUp(self):
+        self.workingdir = tempfile.mkdtemp()
+        self.samples = (np.sin(np.arange(100000) / 7.0) * 10000).astype(np.int16).reshape(-1, 2)
+        data = self.samples.tostring()
+        fmt = struct.pack("<HHIIHH", 1, 2, 44100, 44100 * 4, 4, 16)
+        wav = "RIFF" + struct.pack("<I", 0xFFFFFFFF) + "WAVE" + "fmt " + struct.pack("<I", len(fmt)) + fmt
+        # "MP3" files are the WAVE data with a prefix that makes them not look like WAVE files
+        self.filename = os.path.join(self.workingdir, "song")
+        with open(self.filename, "wb") as f:
+            f.write("ID3x" + wav + "data" + struct.pack("<I", 0xFFFFFFFF) + data)
+        self.wav_filename = os.path.join(self.workingdir, "song.wav")
+        with open(self.wav_filename, "wb") as f:
+            f.write(wav.replace(struct.pack("<I", 0xFFFFFFFF), struct.pack("<I", 28 + len(fmt) + len(data)), 1)
+                    + "data" + struct.pack("<I", len(data)) + data)
+        # lame --silent --mp3input --decode FILE -
+        self.lame = os.path.join(self.workingdir, "lame")
+        with open(self.lame, "w") as f:
+            f.write("#!/bin/sh\ntail -c +5 \"$4\"\n")
+        os.chmod(self.lame, 0755)
+        self.original_lame = input_file_module.LAME
+        input_file_module.LAME = self.lame
+
+    def testRead(self):
+        inputFile = InputFile(self.filename)
+        self.assertEqual(inputFile.get_channels(), 2)
+        self.assertEqual(inputFile.get_sample_rate(), 44100)
+        data = inputFile.get_audio_samples(len(self.samples) + 10)
+        self.assertTrue(np.array_equal(data, self.samples.T))
+        self.assertEqual(inputFile.get_total_samples(), len(self.samples))
+        inputFile.close()
+
+    def testSameSeriesAsWave(self):
+        series = []
+        for filename in [self.filename, self.wav_filename]:
+            inputFile = InputFile(filename)
+            series.append(FFT(inputFile, 1024).series())
+            inputFile.close()
+        self.assertTrue(np.array_equal(series[0], series[1]))
+
+    def testCloseBeforeEnd(self):
+        inputFile = InputFile(self.filename)
+        inputFile.get_audio_samples(10)
+        inputFile.close()
+
+    def testFingerprintErrorStopsDecoder(self):
+        """A failure while fingerprinting a decoded file
+        doesn't leave the decoder running."""
+        with open(self.lame, "w") as f:
+            f.write("#!/bin/sh\ntail -c +5 \"$4\"\nexec cat /dev/zero\n")
+        opened = []
+
+        class RecordingInputFile(InputFile):
+            def __init__(self, filename):
+                InputFile.__init__(self, filename)
+                opened.append(self)
+
+        def fail(freq_chunks):
+            raise ValueError("fingerprint failed")
+
+        original = matcher_module.InputFile, matcher_module._to_fingerprints
+        matcher_module.InputFile, matcher_module._to_fingerprints = RecordingInputFile, fail
+        try:
+            result = matcher_module._file_fingerprint(self.filename)
+        finally:
+            matcher_module.InputFile, matcher_module._to_fingerprints = original
+        self.assertFalse(result.success)
+        self.assertEqual(len(opened), 1)
+        self.assertIsNotNone(opened[0].decoder.poll())
+
+    def testBadDecoderOutput(self):
+        with open(self.lame, "w") as f:
+            f.write("#!/bin/sh\necho garbage\nexit 1\n")
+        self.assertRaises(IOError, InputFile, self.filename)
+
+    def tearDown(self):
+        input_file_module.LAME = self.original_lame
+        shutil.rmtree(self.workingdir)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
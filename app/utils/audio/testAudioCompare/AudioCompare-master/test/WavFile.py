@@ -0,0 +1,12 @@
+import struct
+
+import numpy as np
+
+
+def write_wav(filename, samples, sample_rate=44100):
+    """Write mono int16 samples as a WAVE file."""
+    data = np.asarray(samples, dtype="<i2").tostring()
+    fmt = struct.pack("<HHIIHH", 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    chunks = "fmt " + struct.pack("<I", len(fmt)) + fmt + "data" + struct.pack("<I", len(data)) + data
+    with open(filename, "wb") as f:
+        f.write("RIFF" + struct.pack("<I", 4 + len(chunks)) + "WAVE" + chunks)
@@ -0,0 +1,210 @@
+"""Benchmark the matcher in-process on directories of audio files,
+and write a JSON report that can be compared with an earlier one.
+
+Every file is fingerprinted by Matcher._file_fingerprint(),
+timing each stage: decode (reading samples from the InputFile),
+fft (FFT.blocks() without the reading) and fingerprint
+(_to_fingerprints()). Then the fingerprints of all the files of a
+directory are put in a FingerprintIndex (index_build) and every file
+is scored against it (scoring), as "audiomatch -d DIR -d DIR" would.
+Each directory is run in a fresh process, so peak_rss_mb is the peak
+resident memory of that directory alone.
+
+Usage (from this directory):
+    PYTHONPATH=.. python matcherbench.py [-o report.json] [--repeat N]
+                                         [--compare old.json] [directory ...]
+The directories default to ../test_data/ and ../test_data/A6/."""
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import stat
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+import numpy as np
+from Matcher import FingerprintIndex, _file_fingerprint, _report_file_matches
+
+STAGES = ["decode", "fft", "fingerprint", "index_build", "scoring"]
+
+
+def fingerprint_file(filename):
+    """Fingerprint a file with Matcher._file_fingerprint(),
+    which closes the input file whether or not it succeeds.
+    @return A 2-tuple of a FileResult and a hash mapping the
+    decode, fft and fingerprint stages to their times in seconds"""
+    times = {}
+    result = _file_fingerprint(filename, times)
+    if not result.success:
+        raise IOError(result.message)
+    return result, times
+
+
+def search_dir(directory):
+    """The regular files of a directory (non-recursively), sorted."""
+    results = []
+    for node in sorted(os.listdir(directory)):
+        path = os.path.join(os.path.abspath(directory), node)
+        if stat.S_ISREG(os.stat(path).st_mode):
+            results.append(path)
+    return results
+
+
+def summarize(samples, repeat):
+    """Total per repetition, p50 and p95 in milliseconds
+    of a list of times in seconds."""
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    if len(samples) == 0:
+        return {"total_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "count": 0}
+    return {"total_ms": round(float(samples.sum()) / repeat, 3),
+            "p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3),
+            "count": len(samples)}
+
+
+def bench_dir(args):
+    """Benchmark one directory, repeat times. Run in a child process.
+    Per-file stages are summarized over every repetition; index_build
+    has one sample per repetition."""
+    directory, repeat = args
+    filenames = search_dir(directory)
+    samples = dict((stage, []) for stage in STAGES)
+    per_file = []
+    errors = {}
+    seconds_of_audio = 0.0
+    matches = 0
+    # Warm up (imports, FFT setup) on the first file that can be read
+    for filename in filenames:
+        try:
+            fingerprint_file(filename)
+            break
+        except Exception:
+            pass
+    for i in xrange(repeat):
+        files = []
+        for filename in filenames:
+            try:
+                result, times = fingerprint_file(filename)
+            except Exception as e:
+                errors[os.path.basename(filename)] = str(e)
+                continue
+            files.append(result)
+            for stage in times:
+                samples[stage].append(times[stage])
+            per_file.append(sum(times.values()))
+
+        files = [f for f in files if f.file_len > 0]
+        file_lengths = dict((f.filename, f.file_len) for f in files)
+        start = time.time()
+        index = FingerprintIndex(files)
+        samples["index_build"].append(time.time() - start)
+
+        matches = 0
+        for f in files:
+            start = time.time()
+            results = _report_file_matches(f, index, file_lengths)
+            samples["scoring"].append(time.time() - start)
+            matches += sum(1 for r in results if "NO MATCH" not in str(r))
+        seconds_of_audio = sum(f.file_len for f in files)
+
+    fingerprinted = len(per_file)
+    return {
+        "directory": os.path.abspath(directory),
+        "files": len(filenames),
+        "seconds_of_audio": round(seconds_of_audio, 3),
+        "repeat": repeat,
+        "stages": dict((stage, summarize(samples[stage], repeat)) for stage in STAGES),
+        "file_latency": summarize(per_file, repeat),
+        "files_per_second": round(fingerprinted / max(sum(per_file), 1e-9), 3),
+        "matches": matches,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        "errors": errors,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, "w")).strip()
+    except Exception:
+        return None
+
+
+def compare(old, new):
+    """Print the change of every stage total and summary number
+    between two reports, for the directories they have in common."""
+    for name in sorted(new["corpora"]):
+        if name not in old["corpora"]:
+            continue
+        print "{n}:".format(n=name)
+        old_corpus, new_corpus = old["corpora"][name], new["corpora"][name]
+        rows = [(stage + " total_ms", old_corpus["stages"][stage]["total_ms"], new_corpus["stages"][stage]["total_ms"])
+                for stage in STAGES]
+        rows += [("file p50_ms", old_corpus["file_latency"]["p50_ms"], new_corpus["file_latency"]["p50_ms"]),
+                 ("file p95_ms", old_corpus["file_latency"]["p95_ms"], new_corpus["file_latency"]["p95_ms"]),
+                 ("files_per_second", old_corpus["files_per_second"], new_corpus["files_per_second"]),
+                 ("peak_rss_mb", old_corpus["peak_rss_mb"], new_corpus["peak_rss_mb"])]
+        for label, before, after in rows:
+            change = (after - before) / before * 100 if before else 0.0
+            print "  {l:<22} {b:>12.3f} {a:>12.3f} {c:>+8.1f}%".format(l=label, b=before, a=after, c=change)
+
+
+def main():
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = ArgumentParser(description="Benchmark the matcher on directories of audio files.",
+                            prog="matcherbench.py")
+    parser.add_argument("directories", nargs="*",
+                        default=[test_dir + "/../test_data/", test_dir + "/../test_data/A6/"])
+    parser.add_argument("-o", dest="output", default="matcherbench.json",
+                        help="Where to write the JSON report.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compare", help="An earlier JSON report to compare with.")
+    args = parser.parse_args()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "corpora": {},
+    }
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            print >> sys.stderr, "skipping {d}: not a directory".format(d=directory)
+            continue
+        # A fresh process per directory, so that its peak RSS is its own
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            corpus = pool.apply(bench_dir, ((directory, args.repeat),))
+        finally:
+            pool.close()
+            pool.join()
+        # Directories are named relative to the matcher, so that reports
+        # from different checkouts can be compared
+        name = os.path.relpath(os.path.abspath(directory), os.path.abspath(test_dir + "/.."))
+        if name.startswith(".."):
+            name = os.path.abspath(directory)
+        report["corpora"][name] = corpus
+        print "{n}: {f} files, {s:.1f}s of audio, {r:.1f} files/s, file p50 {p50:.1f}ms p95 {p95:.1f}ms, " \
+              "peak RSS {m:.1f}MB".format(n=name, f=corpus["files"], s=corpus["seconds_of_audio"],
+                                          r=corpus["files_per_second"], p50=corpus["file_latency"]["p50_ms"],
+                                          p95=corpus["file_latency"]["p95_ms"], m=corpus["peak_rss_mb"])
+        for stage in STAGES:
+            summary = corpus["stages"][stage]
+            print "  {s:<12} total {t:>10.1f}ms  p50 {p50:>8.2f}ms  p95 {p95:>8.2f}ms".format(
+                s=stage, t=summary["total_ms"], p50=summary["p50_ms"], p95=summary["p95_ms"])
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print "report written to {o}".format(o=args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,9 @@ import wave
 import numpy as np
 import matplotlib.pyplot as plt
 import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + "/..")
+from Correlation import chunk_spectra, normalize_spectra, offset_histogram
 
 
 # open wav file and get data
@@ -36,44 +39,21 @@ y = op(sys.argv[2])
 #plt.plot(x,'b')
 #plt.show()
 
-b =[]
-a =[]
 chunksize = 44100/50
 chunks_x = len(x)/chunksize
 chunks_y = len(y)/chunksize
 
-for i in xrange((chunks_x-1)):
-	a.append(np.fft.rfft(x[i*chunksize:(i+1)*chunksize]))
-for i in xrange((chunks_y-1)):
-	b.append(np.fft.rfft(y[i*chunksize:(i+1)*chunksize]))
-
-a = np.array(a)
-b = np.array(b)
-ok = 0
-diffs = {}
-#print len(a)
-cx = chunks_x -2
-cy = chunks_y -2
-
-# please take a look at this part
-# the corrcoef is the calculation of similarity of two chunks in frequency domain
-# so this loop run entire two files compare between the chunks (O(n^2)??)
-# if there are over 10 matches of two chunks's similarity is over 90%, we deduce as a match
-
-for i in xrange(cx):
-	for j in xrange(cy):
-		cor = np.corrcoef(a[i],b[j])
-		if cor[0][1] >=0.9:
-			
-			diff = abs(j-i)
-			if diff in diffs:
-				diffs[diff] += 1
-				if diffs[diff] >=10:
-					ok = 1
-					print 'match'
-					sys.exit()
-
-			else:
-				diffs[diff] = 1
-
-print 'no match'			
+# the spectra of the first chunks_x - 2 chunks of x are compared
+# with the first chunks_y - 2 chunks of y
+a = normalize_spectra(chunk_spectra(x, chunksize)[:max(chunks_x - 2, 0)])
+b = normalize_spectra(chunk_spectra(y, chunksize)[:max(chunks_y - 2, 0)])
+
+# the correlation of every pair of chunks in frequency domain is computed
+# as matrix products (see Correlation.offset_histogram)
+# if there are over 10 matches of two chunks's similarity is over 90%
+# at the same distance, we deduce as a match
+histogram, matched = offset_histogram(a, b)
+if matched:
+	print 'match'
+else:
+	print 'no match'
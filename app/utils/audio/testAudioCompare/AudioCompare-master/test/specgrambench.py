@@ -0,0 +1,63 @@
+"""Compare FFT.specgram() with the windowed loop it replaced,
+FFT.specgram_loop(), on the WAVE files of a directory.
+
+Usage (from this directory):
+    PYTHONPATH=.. python specgrambench.py [directory]"""
+import os
+import sys
+import time
+import numpy as np
+from InputFile import InputFile
+from FFT import FFT
+from Matcher import NORMAL_CHUNK_SIZE, NORMAL_SAMPLE_RATE, _to_fingerprints
+
+
+def best_time(func, repeat=3):
+    """Run func repeat times, return the fastest time and the last result."""
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_file(filename):
+    input_file = InputFile(filename)
+    chunk_size = int(NORMAL_CHUNK_SIZE / (NORMAL_SAMPLE_RATE / input_file.get_sample_rate()))
+    fft = FFT(input_file, chunk_size)
+    samples = input_file.get_mono_samples(input_file.get_total_samples())
+    input_file.close()
+
+    window = FFT._FFT__window_hanning
+    noverlap = chunk_size / fft.overlap_ratio
+    loop_time, loop = best_time(lambda: fft.specgram_loop(samples, chunk_size, window, noverlap))
+    batch_time, batch = best_time(lambda: fft.specgram(samples, chunk_size, window, noverlap))
+
+    loop = loop.real
+    error = np.abs(batch - loop).max() / max(loop.max(), 1e-30) if loop.size else 0.0
+    same = (_to_fingerprints(loop.T) == _to_fingerprints(batch.T)).sum()
+    print "{f}: {n} frames, loop {l:.3f}s, batched {b:.3f}s ({s:.1f}x), " \
+          "max rel error {e:.2e}, same fingerprints {c}/{n}".format(
+              f=os.path.basename(filename), n=loop.shape[1], l=loop_time, b=batch_time,
+              s=loop_time / max(batch_time, 1e-9), e=error, c=same)
+    return loop_time, batch_time
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.dirname(os.path.abspath(__file__)) + "/../test_data/A6/"
+    total_loop = total_batch = 0.0
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".wav"):
+            loop_time, batch_time = bench_file(os.path.join(directory, name))
+            total_loop += loop_time
+            total_batch += batch_time
+    print "total: loop {l:.3f}s, batched {b:.3f}s ({s:.1f}x)".format(
+        l=total_loop, b=total_batch, s=total_loop / max(total_batch, 1e-9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*-coding:utf8-*-
+# 在本目录下运行: python -m unittest CompareAudioTest
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+from testCompareAudio import compareAllPairs, compareAudio, fingerprintFiles, lshCandidatePairs, readComparedPairs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AudioCompare-master', 'test'))
+from WavFile import write_wav
+
+
+class CompareAllPairsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workingdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.files = list()
+        for name in ['a.wav', 'b b.wav', 'c.wav']:
+            fileName = os.path.join(self.workingdir, name)
+            write_wav(fileName, rng.randint(-10000, 10000, 44100 * 3))
+            self.files.append(fileName)
+        self.compareFile = os.path.join(self.workingdir, 'out', 'compare.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.workingdir)
+
+    def readLines(self):
+        with open(self.compareFile) as f:
+            return [line for line in f if not line.startswith('#')]
+
+    def testResume(self):
+        self.assertEqual(compareAllPairs(self.files[:2], self.compareFile), 1)
+        self.assertEqual(compareAllPairs(self.files[:2], self.compareFile), 0)
+        self.assertEqual(len(self.readLines()), 1)
+        # 新增文件时只比较新的文件对
+        self.assertEqual(compareAllPairs(self.files, self.compareFile), 2)
+        self.assertEqual(compareAllPairs(self.files, self.compareFile), 0)
+        self.assertEqual(len(self.readLines()), 3)
+        self.assertEqual(readComparedPairs(self.compareFile),
+                         set(frozenset(pair) for pair in itertools.combinations(self.files, 2)))
+
+    def testPairs(self):
+        a, b, c = self.files
+        self.assertEqual(compareAllPairs(self.files, self.compareFile, pairs=[(a, c)]), 1)
+        self.assertEqual(compareAllPairs(self.files, self.compareFile, pairs=[(c, a), (b, b)]), 0)
+        line = self.readLines()[0]
+        self.assertEqual(line.split('|')[:2], [a, c])
+        self.assertEqual(line.split('|')[2], 'NO MATCH\n')
+
+    def testOldFormat(self):
+        a, b, c = self.files
+        os.makedirs(os.path.dirname(self.compareFile))
+        with open(self.compareFile, 'w') as f:
+            f.write('# 记录音频比较结果的文件\n')
+            f.write('MATCH a.wav b b.wav (40.0)\n')
+            f.write('NO MATCH\n')
+        self.assertEqual(readComparedPairs(self.compareFile, self.files), set([frozenset(['a.wav', 'b b.wav'])]))
+        # 旧记录中的文件对跳过, 'NO MATCH' 无法知道是哪一对, 其余文件对都要比较
+        self.assertEqual(compareAllPairs(self.files, self.compareFile), 2)
+        self.assertEqual(sorted(line.split('|')[:2] for line in self.readLines()[2:]), [[a, c], [b, c]])
+
+    def testCompareAudio(self):
+        # 原来的接口比较所有文件对, 与 compareAllPairs 写入相同的记录
+        compareAudio(self.files[:2], self.compareFile)
+        compareAudio(self.files, self.compareFile)
+        lines = self.readLines()
+        os.remove(self.compareFile)
+        compareAllPairs(self.files, self.compareFile)
+        self.assertEqual(sorted(lines), sorted(self.readLines()))
+
+
+class LshRecallTest(unittest.TestCase):
+    """init30_1.wav 的随机截取片段与原文件不按分块对齐, Matcher 判为 MATCH 的都必须是 LSH 候选"""
+
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init30_1.wav')
+
+    def setUp(self):
+        self.workingdir = tempfile.mkdtemp()
+        audio = wave.open(self.source)
+        sampleRate = audio.getframerate()
+        samples = np.frombuffer(audio.readframes(audio.getnframes()), dtype='<i2')
+        audio.close()
+        rng = np.random.RandomState(0)
+        self.trims = list()
+        for i in range(20):
+            length = int(rng.uniform(6, 12) * sampleRate)
+            start = rng.randint(0, len(samples) - length)
+            fileName = os.path.join(self.workingdir, 'trim%d.wav' % i)
+            write_wav(fileName, samples[start:start + length], sampleRate)
+            self.trims.append(fileName)
+
+    def tearDown(self):
+        shutil.rmtree(self.workingdir)
+
+    def testTrims(self):
+        fileResults = fingerprintFiles([self.source] + self.trims)
+        compareFile = os.path.join(self.workingdir, 'compare.txt')
+        pairs = [(self.source, trim) for trim in self.trims]
+        compareAllPairs([], compareFile, pairs=pairs, fileResults=fileResults)
+        with open(compareFile) as f:
+            matched = [line.split('|')[1] for line in f if line.split('|')[-1].startswith('MATCH')]
+        self.assertTrue(len(matched) > len(self.trims) // 2)
+        candidatePairs = set(frozenset(pair) for pair in lshCandidatePairs(fileResults))
+        missed = [trim for trim in matched if frozenset([self.source, trim]) not in candidatePairs]
+        self.assertEqual(missed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,107 +1,238 @@
-# -*-coding:utf8-*-
-import os
-import re
-import subprocess
-
-# 读取txt文件内容，每行分开加入到list中
-def readTxt(path, ignore):
-    contentList = list()
-    for line in open(path, "r"):
-        line = re.sub(r'\n', '', line)
-        if line.find(ignore) == -1:
-            contentList.append(line)
-    return contentList
-
-def compareAudio(fileNameList, compareFile):
-    # 调用AudioCompare库方法比较两个文件
-    fileName = compareFile.split('/')[-1]
-    filePath = compareFile[:-len(fileName)]
-    if not os.path.exists(filePath):
-        os.mkdir(filePath)
-    if os.path.exists(compareFile):  # 已存在
-        fout = open(compareFile, 'a')
-    else:
-        fout = open(compareFile, 'w')
-        fout.write('# 记录音频比较结果的文件\n')
-    contentList = readTxt(compareFile, '#')
-    for index, fileName in enumerate(fileNameList):
-        for compareFileName in fileNameList[index + 1:]:
-            # 从记录的文件中取值，如果已经比较过就不再比较
-            needCompareFlag = True
-            for content in contentList:
-                if fileName in content.split('|') and compareFileName in content.split('|'):
-                    needCompareFlag = False
-                    print ('已存在：' + fileName + '|' + compareFileName)
-            if needCompareFlag:
-                command = ' AudioCompare-master/main.py -f ' + fileName + ' -f ' + compareFileName
-                p = subprocess.Popen('python' + command, stdout=subprocess.PIPE, shell=True)
-                stdoutput = p.stdout.readlines()
-                fout.write(stdoutput[0])
-
-
-# 获取文件大小
-def getFileSize(fileName):
-    try:
-        return os.path.getsize(fileName)
-    except Exception as err:
-        print(err)
-
-# 得到文件大小相似的集合，返回[[('xx.wav',3715364L)],[('xx.wav',3715364L),('xx.wav',3715364L),('xx.wav',3715364L)]]
-def sortedNearFile(fileNamesList, level):
-    # 得到每个文件的大小
-    fileSizeDict = dict()
-    for fileName in fileNamesList:
-        fileSizeDict.setdefault(fileName, getFileSize(fileName))
-    # 先按照文件的大小排序
-    sortedFileSizeList = sorted(fileSizeDict.items(), key=lambda item: item[1])
-    # 逐个比较相邻的文件大小，小于阈值，提取出来
-    nearFileList = list()
-    for index in range(0, len(sortedFileSizeList)):
-        if index + 1 < len(sortedFileSizeList) and index > 0:
-            # 和左边的比
-            preVal = abs(sortedFileSizeList[index][1] - sortedFileSizeList[index - 1][1])
-            # 和右边比
-            nextVal = abs(sortedFileSizeList[index][1] - sortedFileSizeList[index + 1][1])
-            # 得出与左边或右边音频大小小于阀值的音频
-            if preVal <= level or nextVal <= level:
-                nearFileList.append(sortedFileSizeList[index])
-    # 把重复的放在一个列表中，返回[[('xx.wav',3715364L)],[('xx.wav',3715364L),('xx.wav',3715364L),('xx.wav',3715364L)]]
-    sortedNearFileList = list()
-    i = 0
-    for index in range(0, len(nearFileList)):
-        # 如果nearFileList[index] - sortedNearFileList[i][0] <= level 就添加，否则添加到sortedNearFileList[i+1]中
-        if len(sortedNearFileList) == 0:
-            sortedNearFileList.append([nearFileList[index]])
-        else:
-            # 右边减左边，小于阀值的保存
-            val = abs(sortedNearFileList[i][0][1] - nearFileList[index][1])
-            if val <= level:
-                sortedNearFileList[i].append(nearFileList[index])
-            else:
-                i += 1
-                sortedNearFileList.append([nearFileList[index]])
-    return sortedNearFileList
-
-# 找出指定文件夹下的所有后缀名为suffix的文件名称，返回列表
-def getFileNames(dirPath, suffix):
-    fileNamesList = list()
-    for fileName in os.listdir(dirPath):
-        if os.path.splitext(fileName)[1] == suffix:
-            fileNamesList.append(dirPath + '/' + fileName)
-    return fileNamesList
-
-if __name__ == '__main__':
-    fileNameList = getFileNames(os.path.curdir, '.wav')
-    for filename in fileNameList:
-        print(filename)
-
-    sortedFileList = sortedNearFile(fileNameList, 100 * 1024)
- 
-    
-
-    for fileTupleList in sortedFileList:
-        if len(fileTupleList) > 1:
-            compareList = list()
-            for fileTuple in fileTupleList:    
-                compareList.append(fileTuple[0])
-            compareAudio(compareList[:], './compare.txt')
\ No newline at end of file
+# -*-coding:utf8-*-
+import itertools
+import multiprocessing
+import os
+import re
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AudioCompare-master'))
+from Matcher import BITS_PER_NUMBER, BUCKET_SHIFTS, BUCKETS, FingerprintIndex, MatchResult, SCORE_THRESHOLD
+from Matcher import _file_fingerprint, _report_file_matches
+
+# LSH 候选筛选参数: Matcher 的指纹每秒约 86 个
+SKETCH_WINDOW = 430  # 每个 MinHash 签名覆盖的指纹数（约5秒）, 相邻窗口重叠一半, 截取的片段也能与原文件碰撞
+SKETCH_BANDS = 60  # 签名分为 60 段, 任意一段相同即为候选
+SKETCH_ROWS = 2  # 每段 2 个哈希值; 在 init30_1.wav 的 200 个随机截取片段上调出, 所有片段都能与原文件碰撞
+SKETCH_MIN_DISTINCT = 20  # 不同指纹少于该值的窗口（静音等）不参与
+SKETCH_MAX_BUCKET_FILES = 100  # 同一桶中的文件超过该值时视为常见内容, 不产生候选
+
+# 读取txt文件内容，每行分开加入到list中
+def readTxt(path, ignore):
+    contentList = list()
+    for line in open(path, "r"):
+        line = re.sub(r'\n', '', line)
+        if line.find(ignore) == -1:
+            contentList.append(line)
+    return contentList
+
+# 读取已比较过的文件对, 返回 frozenset((file1, file2)) 的集合
+# 每行记录为 'file1|file2|输出'; 旧脚本只记录 main.py 输出的第一行, 其中 'MATCH a.wav b.wav (分数)'
+# 只有文件的 basename, 按 fileNames 中的文件名识别, 返回 basename 组成的文件对;
+# 'NO MATCH' 不含文件名, 无法知道是哪一对, 这些文件对会重新比较
+def readComparedPairs(path, fileNames=()):
+    comparedPairs = set()
+    if not os.path.exists(path):
+        return comparedPairs
+    baseNames = set(os.path.basename(fileName) for fileName in fileNames)
+    for content in readTxt(path, '#'):
+        if '|' in content:
+            fields = content.split('|')
+            comparedPairs.add(frozenset(fields[:2]))
+        elif content.startswith('MATCH '):
+            pair = _parseOldMatch(content[len('MATCH '):], baseNames)
+            if pair is not None:
+                comparedPairs.add(frozenset(pair))
+    return comparedPairs
+
+# 解析旧记录 'MATCH a.wav b.wav (分数)' 中 'MATCH ' 之后的部分, 文件名可能含空格, 按已知的 baseNames 拆分
+def _parseOldMatch(content, baseNames):
+    for index, char in enumerate(content):
+        if char != ' ' or content[:index] not in baseNames:
+            continue
+        rest = content[index + 1:]
+        second = rest[:rest.rfind(' (')]
+        if second in baseNames:
+            return content[:index], second
+    return None
+
+# 文件对是否已比较过, 旧记录中的文件对由 basename 组成
+def _isCompared(pair, comparedPairs):
+    return frozenset(pair) in comparedPairs or \
+        frozenset(os.path.basename(fileName) for fileName in pair) in comparedPairs
+
+# 分析进程中各文件的指纹, 由进程池初始化时传入
+_fileResults = None
+
+def _initCompareWorker(fileResults):
+    global _fileResults
+    _fileResults = fileResults
+
+# 比较一对文件, 返回与 main.py -f file1 -f file2 相同的输出
+def _comparePair(pair):
+    file1, file2 = _fileResults[pair[0]], _fileResults[pair[1]]
+    for result in (file1, file2):
+        if not result.success:
+            return 'ERROR: ' + result.message
+    if file1.file_len == 0 or file2.file_len == 0:
+        # 空文件只与空文件匹配
+        if file1.file_len == file2.file_len:
+            return str(MatchResult(file1.filename, file2.filename, 0, 0, SCORE_THRESHOLD + 1))
+        return 'NO MATCH'
+    # 与 Matcher.match 相同, 数据较多的文件建索引, 用另一个文件查询
+    if file1.file_len < file2.file_len:
+        query, master = file1, file2
+    else:
+        query, master = file2, file1
+    results = _report_file_matches(query, FingerprintIndex([master]), {master.filename: master.file_len})
+    return str(results[0])
+
+# 在进程池中提取文件的指纹, 返回 {文件名: FileResult 或 FileErrorResult}
+def fingerprintFiles(fileNames):
+    pool = multiprocessing.Pool()
+    try:
+        return dict(zip(fileNames, pool.map(_file_fingerprint, fileNames)))
+    finally:
+        pool.close()
+        pool.join()
+
+# 在当前进程中比较文件对, pairs 默认为 fileNameList 中的所有两两组合
+# 每个文件只提取一次指纹（可以通过 fileResults 传入已提取的指纹）, 文件对在进程池中比较,
+# 结果按 'file1|file2|输出' 每 batchSize 行追加到 compareFile;
+# compareFile 中已记录的文件对会跳过, 中断后重新运行即可继续。返回本次比较的文件对数
+def compareAllPairs(fileNameList, compareFile, pairs=None, batchSize=1000, fileResults=None):
+    if pairs is None:
+        pairs = itertools.combinations(fileNameList, 2)
+    pairs = list(pairs)
+    comparedPairs = readComparedPairs(compareFile, set(fileNameList) | set(f for pair in pairs for f in pair))
+    remainingPairs = list()
+    for pair in pairs:
+        key = frozenset(pair)
+        if len(key) == 2 and not _isCompared(pair, comparedPairs):
+            comparedPairs.add(key)
+            remainingPairs.append(tuple(pair))
+    if len(remainingPairs) == 0:
+        return 0
+
+    fileNames = sorted(set(fileName for pair in remainingPairs for fileName in pair))
+    fileResults = dict(fileResults or {})
+    missing = [fileName for fileName in fileNames if fileName not in fileResults]
+    if missing:
+        fileResults.update(fingerprintFiles(missing))
+    fileResults = dict((fileName, fileResults[fileName]) for fileName in fileNames)
+
+    filePath = os.path.dirname(compareFile)
+    if filePath and not os.path.exists(filePath):
+        os.makedirs(filePath)
+    newFile = not os.path.exists(compareFile)
+    pool = multiprocessing.Pool(initializer=_initCompareWorker, initargs=(fileResults,))
+    try:
+        with open(compareFile, 'a') as fout:
+            if newFile:
+                fout.write('# 记录音频比较结果的文件\n')
+            lines = list()
+            outputs = pool.imap(_comparePair, remainingPairs, chunksize=64)
+            for pair, output in itertools.izip(remainingPairs, outputs):
+                lines.append(pair[0] + '|' + pair[1] + '|' + output + '\n')
+                if len(lines) >= batchSize:
+                    fout.writelines(lines)
+                    fout.flush()
+                    lines = list()
+            fout.writelines(lines)
+    finally:
+        pool.close()
+        pool.join()
+    return len(remainingPairs)
+
+# 比较 fileNameList 中的所有文件对, 结果追加到 compareFile, 已比较过的文件对跳过
+# 保留原来的接口, 不再为每一对启动 main.py 子进程, 由 compareAllPairs 在当前进程中比较
+def compareAudio(fileNameList, compareFile):
+    compareAllPairs(fileNameList, compareFile)
+
+
+# 指纹的部分指纹: 每个指纹去掉一个频段的最响频率, 得到 BUCKETS 个部分指纹, 返回 (BUCKETS, 指纹数) 的数组
+# 截取的片段与原文件的分块不对齐时, 完全相同的指纹只占约 1/4, 而至少 3 个频段相同的约占一半
+def partialFingerprints(fingerprints):
+    fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+    partials = list()
+    for bucket, shift in enumerate(BUCKET_SHIFTS):
+        mask = np.uint64(((1 << BITS_PER_NUMBER) - 1) << int(shift))
+        # 高位记录去掉的是哪个频段
+        tag = np.uint64((bucket + 1) << (BITS_PER_NUMBER * BUCKETS))
+        partials.append((fingerprints & ~mask) | tag)
+    return np.array(partials, dtype=np.uint64).reshape(len(BUCKET_SHIFTS), len(fingerprints))
+
+# 文件各窗口部分指纹集合的 MinHash 签名, 返回 (窗口数, len(hashA)) 的数组
+# 每个部分指纹 x 的第 k 个哈希值为 (hashA[k] * x + hashB[k]) mod 2^64 的高 32 位, 窗口的签名为窗口内各哈希值的最小值
+def minHashSignatures(fingerprints, hashA, hashB, window=SKETCH_WINDOW, minDistinct=SKETCH_MIN_DISTINCT):
+    fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+    hop = window // 2
+    if len(fingerprints) == 0:
+        return np.zeros((0, len(hashA)), dtype=np.uint64)
+    hashes = None
+    for partials in partialFingerprints(fingerprints):
+        partialHashes = (partials[:, np.newaxis] * hashA + hashB) >> np.uint64(32)
+        hashes = partialHashes if hashes is None else np.minimum(hashes, partialHashes)
+    # 先求每半个窗口的最小值, 相邻两块的最小值即为一个窗口的签名
+    starts = np.arange(0, len(fingerprints), hop)
+    blockMin = np.minimum.reduceat(hashes, starts, axis=0)
+    if len(blockMin) > 1:
+        signatures = np.minimum(blockMin[:-1], blockMin[1:])
+    else:
+        signatures = blockMin
+    distinct = [len(np.unique(fingerprints[start:start + window])) for start in starts[:len(signatures)]]
+    return signatures[np.array(distinct) >= minDistinct]
+
+# MinHash/LSH 候选筛选: 只有至少一个窗口的签名在某一段上完全相同的文件对才需要完整比较
+# 筛选可能漏掉分数较低的匹配, 需要比较所有文件对时运行 python testCompareAudio.py --all
+# fileResults 为 {文件名: FileResult}, 返回排好序的候选文件对列表; 无法读取的文件不产生候选
+def lshCandidatePairs(fileResults, bands=SKETCH_BANDS, rows=SKETCH_ROWS, window=SKETCH_WINDOW,
+                      maxBucketFiles=SKETCH_MAX_BUCKET_FILES):
+    random = np.random.RandomState(0)
+    hashA = random.randint(0, 2 ** 63, bands * rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    hashB = random.randint(0, 2 ** 63, bands * rows, dtype=np.uint64)
+    buckets = dict()
+    emptyFiles = list()
+    for fileName in sorted(fileResults):
+        result = fileResults[fileName]
+        if not result.success:
+            print ('无法读取：' + fileName + ' ' + result.message)
+            continue
+        if result.file_len == 0:
+            emptyFiles.append(fileName)  # 空文件只与空文件匹配
+            continue
+        signatures = minHashSignatures(result.fingerprints, hashA, hashB, window)
+        for band in range(bands):
+            for signature in signatures[:, band * rows:(band + 1) * rows]:
+                buckets.setdefault((band, signature.tostring()), set()).add(fileName)
+
+    candidatePairs = set(itertools.combinations(emptyFiles, 2))
+    for fileNames in buckets.values():
+        if 1 < len(fileNames) <= maxBucketFiles:
+            candidatePairs.update(itertools.combinations(sorted(fileNames), 2))
+    return sorted(candidatePairs)
+
+# 找出指定文件夹下的所有后缀名为suffix的文件名称，返回列表
+def getFileNames(dirPath, suffix):
+    fileNamesList = list()
+    for fileName in os.listdir(dirPath):
+        if os.path.splitext(fileName)[1] == suffix:
+            fileNamesList.append(dirPath + '/' + fileName)
+    return fileNamesList
+
+if __name__ == '__main__':
+    fileNameList = getFileNames(os.path.curdir, '.wav')
+    for filename in fileNameList:
+        print(filename)
+
+    # 每个文件只提取一次指纹, 用 MinHash/LSH 选出可能重复的文件对, 只对它们做完整的偏移打分;
+    # 加 --all 参数时不筛选, 比较所有文件对
+    fileResults = fingerprintFiles(fileNameList)
+    if '--all' in sys.argv[1:]:
+        candidatePairs = None
+    else:
+        candidatePairs = lshCandidatePairs(fileResults)
+        allPairs = len(fileNameList) * (len(fileNameList) - 1) // 2
+        print ('候选文件对：' + str(len(candidatePairs)) + '/' + str(allPairs))
+    compareAllPairs(fileNameList, './compare.txt', pairs=candidatePairs, fileResults=fileResults)